@@ -13,6 +13,7 @@ DEFAULT_ELASTICSEARCH_MAX_RETRIES = 5
 DEFAULT_ELASTICSEARCH_RETRY_INTERVAL = 10
 
 DEFAULT_MAX_FILE_SIZE = 10485760  # 10MB
+DEFAULT_MAX_IN_MEMORY_FILE_SIZE = 1048576  # 1MB
 
 
 def load_config(config_file):
@@ -90,8 +91,29 @@ def _default_config():
             "max_concurrent_content_syncs": 1,
             "max_concurrent_access_control_syncs": 1,
             "max_file_download_size": DEFAULT_MAX_FILE_SIZE,
+            "max_in_memory_file_size": DEFAULT_MAX_IN_MEMORY_FILE_SIZE,
+            "plain_text_extraction": True,
             "job_cleanup_interval": 300,
             "log_level": "INFO",
+            "log_queue_size": 0,
+            "metrics_host": "127.0.0.1",
+            "metrics_port": None,
+            "metrics_dump_path": None,
+            "metrics_dump_interval": 60,
+            "loop_monitor_enabled": False,
+            "loop_monitor_interval": 0.5,
+            "loop_monitor_threshold": 1,
+            "profiling_dir": None,
+            "profiling_interval": 0.005,
+            "profile_sync_rules": False,
+            "sink": "elasticsearch",
+            "file_sink_dir": None,
+            "file_sink_segment_size": 104857600,
+            "file_sink_compress": False,
+            "http_max_connections": 100,
+            "http_max_connections_per_host": 0,
+            "http_keepalive_timeout": 15,
+            "http_dns_cache_ttl": 300,
         },
         "sources": {
             "azure_blob_storage": "connectors.sources.azure_blob_storage:AzureBlobStorageDataSource",
@@ -203,19 +225,40 @@ class DataSourceFrameworkConfig:
     preventing them from requiring substantial changes to access new configs that may be added.
     """
 
-    def __init__(self, max_file_size):
+    def __init__(
+        self,
+        max_file_size,
+        max_in_memory_file_size=DEFAULT_MAX_IN_MEMORY_FILE_SIZE,
+        plain_text_extraction=True,
+    ):
         """
         Should not be called directly. Use the Builder.
         """
         self.max_file_size = max_file_size
+        self.max_in_memory_file_size = max_in_memory_file_size
+        self.plain_text_extraction = plain_text_extraction
 
     class Builder:
         def __init__(self):
             self.max_file_size = DEFAULT_MAX_FILE_SIZE
+            self.max_in_memory_file_size = DEFAULT_MAX_IN_MEMORY_FILE_SIZE
+            self.plain_text_extraction = True
 
         def with_max_file_size(self, max_file_size):
             self.max_file_size = max_file_size
             return self
 
+        def with_max_in_memory_file_size(self, max_in_memory_file_size):
+            self.max_in_memory_file_size = max_in_memory_file_size
+            return self
+
+        def with_plain_text_extraction(self, plain_text_extraction):
+            self.plain_text_extraction = plain_text_extraction
+            return self
+
         def build(self):
-            return DataSourceFrameworkConfig(self.max_file_size)
+            return DataSourceFrameworkConfig(
+                self.max_file_size,
+                self.max_in_memory_file_size,
+                self.plain_text_extraction,
+            )
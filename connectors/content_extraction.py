@@ -4,13 +4,277 @@
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
 
+import asyncio
+import codecs
 import os
+import time
+import zlib
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+from urllib.parse import urlsplit
 
 import aiofiles
 import aiohttp
 from aiohttp.client_exceptions import ClientConnectionError, ServerTimeoutError
 
+from connectors.http_client import http_client_registry
 from connectors.logger import logger
+from connectors.metrics import metrics
+from connectors.utils import Counters, html_to_text
+
+DEFAULT_TIMEOUT = 30
+DEFAULT_TIMEOUT_PER_MB = 2
+DEFAULT_MAX_CONCURRENT_REQUESTS = 8
+DEFAULT_TEXT_CACHE_SIZE = 64 * 1024 * 1024  # 64MB of compressed text
+
+EXTRACTED_FILES = "extracted_files"
+EXTRACTED_BYTES = "extracted_bytes"
+EXTRACTION_TIME = "extraction_time"
+QUEUE_WAIT_TIME = "queue_wait_time"
+MAX_QUEUE_WAIT_TIME = "max_queue_wait_time"
+TEXT_CACHE_HITS = "text_cache_hits"
+
+MB = 1024 * 1024
+
+PLAIN_TEXT_FILETYPES = [
+    ".txt",
+    ".py",
+    ".rst",
+    ".markdown",
+    ".json",
+    ".xml",
+    ".csv",
+    ".tsv",
+    ".md",
+    ".rb",
+    ".sh",
+]
+HTML_FILETYPES = [".html", ".aspx"]
+DEFAULT_PLAIN_TEXT_MAX_FILE_SIZE = 10 * MB
+# a NUL byte in the first bytes of a file means it's binary content
+TEXT_SNIFF_SIZE = 8192
+
+# UTF-32 BOMs first, as the UTF-32 LE BOM starts with the UTF-16 LE one
+_BOMS = [
+    (codecs.BOM_UTF32_LE, "utf-32-le"),
+    (codecs.BOM_UTF32_BE, "utf-32-be"),
+    (codecs.BOM_UTF8, "utf-8"),
+    (codecs.BOM_UTF16_LE, "utf-16-le"),
+    (codecs.BOM_UTF16_BE, "utf-16-be"),
+]
+
+
+class ExtractionScheduler:
+    """Bounds the number of in-flight requests to the extraction service.
+
+    Requests waiting for a free slot are queued per sync and slots are handed out
+    to the syncs in turn, so a sync with a lot of files does not starve the other ones.
+    As waiting for a slot blocks the download that produced the file, a busy
+    extraction service slows the downloads of the source down.
+    """
+
+    def __init__(self, max_concurrent_requests=DEFAULT_MAX_CONCURRENT_REQUESTS):
+        self.max_concurrent_requests = max_concurrent_requests
+        self._in_flight = 0
+        self._queues = OrderedDict()  # sync key -> futures waiting for a slot
+
+    def configure(self, extraction_config):
+        self.max_concurrent_requests = extraction_config.get(
+            "max_concurrent_requests", DEFAULT_MAX_CONCURRENT_REQUESTS
+        )
+
+    def in_flight(self):
+        return self._in_flight
+
+    def queued(self):
+        return sum(len(waiters) for waiters in self._queues.values())
+
+    @asynccontextmanager
+    async def slot(self, key):
+        """Waits for a free slot for the sync identified by `key` and holds it until exiting the context."""
+        if self._in_flight < self.max_concurrent_requests and not self._queues:
+            self._in_flight += 1
+        else:
+            waiter = asyncio.get_running_loop().create_future()
+            self._queues.setdefault(key, deque()).append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # the slot was handed over right before the cancellation
+                    self._release()
+                else:
+                    self._discard(key, waiter)
+                raise
+
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _discard(self, key, waiter):
+        waiters = self._queues.get(key)
+        if waiters is None:
+            return
+
+        try:
+            waiters.remove(waiter)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._queues[key]
+
+    def _release(self):
+        # hand the slot over to the next sync in turn, the number of in-flight requests stays the same
+        while self._queues:
+            key, waiters = next(iter(self._queues.items()))
+            waiter = waiters.popleft()
+            if waiters:
+                self._queues.move_to_end(key)
+            else:
+                del self._queues[key]
+
+            if not waiter.done():
+                waiter.set_result(None)
+                return
+
+        self._in_flight -= 1
+
+
+extraction_scheduler = ExtractionScheduler()
+
+metrics.gauge(
+    "connectors_extraction_requests_in_flight",
+    "Requests being processed by the extraction service",
+).set_function(extraction_scheduler.in_flight)
+metrics.gauge(
+    "connectors_extraction_requests_queued",
+    "Requests waiting for a free extraction service slot",
+).set_function(extraction_scheduler.queued)
+EXTRACTION_DURATION = metrics.histogram(
+    "connectors_extraction_duration_seconds",
+    "Duration of extraction service requests",
+)
+EXTRACTION_QUEUE_WAIT = metrics.histogram(
+    "connectors_extraction_queue_wait_seconds",
+    "Time extraction service requests waited for a free slot",
+)
+
+
+class ExtractedTextCache:
+    """Size-bounded LRU cache of extracted text, keyed by the hash of the file content.
+
+    Texts are stored zlib-compressed and `max_size` bounds their compressed size in bytes,
+    a `max_size` of 0 disables the cache. Identical files, f.e. unchanged files of a full
+    sync, are only sent once to the extraction service.
+    """
+
+    def __init__(self, max_size=DEFAULT_TEXT_CACHE_SIZE):
+        self.max_size = max_size
+        self._size = 0
+        self._texts = OrderedDict()
+
+    def configure(self, extraction_config):
+        self.max_size = extraction_config.get(
+            "text_cache_size", DEFAULT_TEXT_CACHE_SIZE
+        )
+        self._evict()
+
+    def get(self, content_hash):
+        compressed = self._texts.get(content_hash)
+        if compressed is None:
+            return None
+
+        self._texts.move_to_end(content_hash)
+        return zlib.decompress(compressed).decode()
+
+    def put(self, content_hash, text):
+        compressed = zlib.compress(text.encode())
+        if len(compressed) > self.max_size:
+            return
+
+        previous = self._texts.pop(content_hash, None)
+        if previous is not None:
+            self._size -= len(previous)
+
+        self._texts[content_hash] = compressed
+        self._size += len(compressed)
+        self._evict()
+
+    def _evict(self):
+        while self._size > self.max_size:
+            _, compressed = self._texts.popitem(last=False)
+            self._size -= len(compressed)
+
+    def size(self):
+        return self._size
+
+    def __len__(self):
+        return len(self._texts)
+
+
+extracted_text_cache = ExtractedTextCache()
+
+
+def decode_text(content):
+    """Decodes the bytes of a text file.
+
+    The encoding is taken from the byte order mark if there is one, otherwise UTF-8 is tried,
+    then Windows-1252 and finally Latin-1.
+
+    Returns `None` if the content looks binary.
+    """
+    for bom, encoding in _BOMS:
+        if content.startswith(bom):
+            return content[len(bom) :].decode(encoding, errors="replace")
+
+    if b"\x00" in content[:TEXT_SNIFF_SIZE]:
+        return None
+
+    for encoding in ("utf-8", "cp1252"):
+        try:
+            return content.decode(encoding)
+        except UnicodeDecodeError:
+            pass
+
+    return content.decode("latin-1")
+
+
+class PlainTextExtraction:
+    """Local text extraction for plain text formats (text, markdown, source code, csv, html...)
+
+    The text of these formats only needs to be decoded, so they skip both the
+    extraction service and the ingest pipeline. Files larger than `max_file_size`
+    are left to them.
+    """
+
+    def __init__(self, max_file_size=DEFAULT_PLAIN_TEXT_MAX_FILE_SIZE):
+        self.max_file_size = max_file_size
+
+    def can_extract(self, file_extension, file_size):
+        file_extension = file_extension.lower()
+        return (
+            file_extension in PLAIN_TEXT_FILETYPES or file_extension in HTML_FILETYPES
+        ) and file_size <= self.max_file_size
+
+    async def extract_text(self, file_extension, content=None, filepath=None):
+        """Extracts the text of `content`, or of the `filepath` file, in a worker thread.
+
+        Returns `None` if the file isn't text after all.
+        """
+        return await asyncio.to_thread(
+            self._extract_text, file_extension, content, filepath
+        )
+
+    def _extract_text(self, file_extension, content, filepath):
+        if content is None:
+            with open(filepath, "rb") as f:
+                content = f.read()
+
+        text = decode_text(content)
+        if text is not None and file_extension.lower() in HTML_FILETYPES:
+            text = html_to_text(text)
+        return text
 
 
 class ContentExtraction:
@@ -31,14 +295,24 @@ class ContentExtraction:
     def set_extraction_config(cls, extraction_config):
         global __EXTRACTION_CONFIG
         __EXTRACTION_CONFIG = extraction_config
+        if extraction_config is not None:
+            extraction_scheduler.configure(extraction_config)
+            extracted_text_cache.configure(extraction_config)
 
-    def __init__(self):
+    def __init__(self, scheduler=None, text_cache=None):
         self.session = None
+        self.scheduler = extraction_scheduler if scheduler is None else scheduler
+        self.text_cache = extracted_text_cache if text_cache is None else text_cache
+        self.counters = Counters()
+        self.max_queue_wait_time = 0
 
         self.extraction_config = ContentExtraction.get_extraction_config()
         if self.extraction_config is not None:
             self.host = self.extraction_config.get("host", None)
-            self.timeout = self.extraction_config.get("timeout", 30)
+            self.timeout = self.extraction_config.get("timeout", DEFAULT_TIMEOUT)
+            self.timeout_per_mb = self.extraction_config.get(
+                "timeout_per_mb", DEFAULT_TIMEOUT_PER_MB
+            )
             self.headers = {"accept": "application/json"}
             self.chunk_size = self.extraction_config.get("stream_chunk_size", 65536)
 
@@ -70,17 +344,17 @@ class ContentExtraction:
         if self.session is not None:
             return self.session
 
-        timeout = aiohttp.ClientTimeout(total=self.timeout)
-        self.session = aiohttp.ClientSession(
-            timeout=timeout,
-            headers=self.headers,
-        )
+        # the session is shared with other users of the extraction service host,
+        # so headers and timeout are sent with each request instead
+        self.session = http_client_registry.get_session(urlsplit(self.host).netloc)
+        return self.session
 
     async def _end_session(self):
-        if not self.session:
+        if self.session is None:
             return
 
-        await self.session.close()
+        await http_client_registry.release_session(self.session)
+        self.session = None
 
     def get_volume_dir(self):
         if self.host is None:
@@ -88,11 +362,31 @@ class ContentExtraction:
 
         return self.volume_dir
 
-    async def extract_text(self, filepath, original_filename):
+    def timeout_for(self, file_size):
+        """Request timeout for a file, large files get `timeout_per_mb` more seconds per MB."""
+        return self.timeout + self.timeout_per_mb * file_size / MB
+
+    def stats(self):
+        """Extraction stats of this sync: files, bytes, extraction and queue wait time, throughput."""
+        stats = self.counters.to_dict()
+        stats[MAX_QUEUE_WAIT_TIME] = self.max_queue_wait_time
+
+        extraction_time = stats.get(EXTRACTION_TIME, 0)
+        if extraction_time:
+            stats["extracted_bytes_per_second"] = round(
+                stats.get(EXTRACTED_BYTES, 0) / extraction_time
+            )
+        return stats
+
+    async def extract_text(
+        self, filepath, original_filename, content_hash=None, data=None
+    ):
         """Sends a text extraction request to tika-server using the supplied filename.
         Args:
             filepath: local path to the tempfile for extraction
             original_filename: original name of file
+            content_hash: hash of the file content, the text of already extracted content is taken from the cache
+            data: file content kept in memory, sent instead of the content of `filepath`
 
         Returns the extracted text
         """
@@ -108,35 +402,83 @@ class ContentExtraction:
             self._begin_session()
 
         filename = (
-            original_filename if original_filename else os.path.basename(filepath)
+            original_filename
+            if original_filename or filepath is None
+            else os.path.basename(filepath)
         )
 
-        try:
-            if self.use_file_pointers:
-                content = await self.send_filepointer(filepath, original_filename)
-            else:
-                content = await self.send_file(filepath, original_filename)
-        except (ClientConnectionError, ServerTimeoutError) as e:
-            logger.error(
-                f"Connection to {self.host} failed while extracting data from {filename}. Error: {e}"
-            )
-        except Exception as e:
-            logger.error(
-                f"Text extraction unexpectedly failed for {filename}. Error: {e}"
-            )
+        if content_hash is not None:
+            cached_text = self.text_cache.get(content_hash)
+            if cached_text is not None:
+                logger.debug(f"Using cached extracted text for '{filename}'.")
+                self.counters.increment(TEXT_CACHE_HITS)
+                return cached_text
+
+        if data is not None:
+            file_size = len(data)
+        else:
+            try:
+                file_size = os.path.getsize(filepath)
+            except OSError:
+                file_size = 0
+        timeout = self.timeout_for(file_size)
+
+        queued_at = time.monotonic()
+        async with self.scheduler.slot(key=id(self)):
+            started_at = time.monotonic()
+            queue_wait_time = started_at - queued_at
+            self.counters.increment(QUEUE_WAIT_TIME, queue_wait_time)
+            EXTRACTION_QUEUE_WAIT.observe(queue_wait_time)
+            self.max_queue_wait_time = max(self.max_queue_wait_time, queue_wait_time)
+
+            try:
+                if self.use_file_pointers and data is None:
+                    content = await self.send_filepointer(
+                        filepath, original_filename, timeout=timeout
+                    )
+                else:
+                    content = await self.send_file(
+                        filepath, original_filename, timeout=timeout, data=data
+                    )
+            except (ClientConnectionError, ServerTimeoutError) as e:
+                logger.error(
+                    f"Connection to {self.host} failed while extracting data from {filename}. Error: {e}"
+                )
+            except asyncio.TimeoutError:
+                logger.error(
+                    f"Text extraction of {filename} ({file_size} bytes) timed out after {timeout:.0f} seconds."
+                )
+            except Exception as e:
+                logger.error(
+                    f"Text extraction unexpectedly failed for {filename}. Error: {e}"
+                )
+
+            extraction_time = time.monotonic() - started_at
+            self.counters.increment(EXTRACTION_TIME, extraction_time)
+            EXTRACTION_DURATION.observe(extraction_time)
+            self.counters.increment(EXTRACTED_FILES)
+            self.counters.increment(EXTRACTED_BYTES, file_size)
+
+        # failed extractions return no text, so they are not cached
+        if content_hash is not None and content:
+            self.text_cache.put(content_hash, content)
 
         return content
 
-    async def send_filepointer(self, filepath, filename):
+    async def send_filepointer(self, filepath, filename, timeout=None):
         async with self._begin_session().put(
             f"{self.host}/extract_text/?local_file_path={filepath}",
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=timeout or self.timeout),
         ) as response:
             return await self.parse_extraction_resp(filename, response)
 
-    async def send_file(self, filepath, filename):
+    async def send_file(self, filepath, filename, timeout=None, data=None):
         async with self._begin_session().put(
             f"{self.host}/extract_text/",
-            data=self.file_sender(filepath),
+            data=self.file_sender(filepath) if data is None else data,
+            headers=self.headers,
+            timeout=aiohttp.ClientTimeout(total=timeout or self.timeout),
         ) as response:
             return await self.parse_extraction_resp(filename, response)
 
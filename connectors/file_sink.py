@@ -0,0 +1,381 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""
+File sink.
+
+`FileSyncOrchestrator` replaces `SyncOrchestrator` when the service runs with
+`sink: file`: documents of sync jobs go through the same steps (sync rules, lazy
+downloads and content extraction) but are written to local files in the
+Elasticsearch bulk format instead of being sent to the content index. It measures
+how fast a source is without a cluster in the way, and exports the data of a source.
+
+The documents of a job are written to `<file_sink_dir>/<index name>/`, in segments
+of about `file_sink_segment_size` bytes named `<job id>-00001.ndjson`, gzipped
+when `file_sink_compress` is set. The state of connectors and sync jobs is still
+stored in Elasticsearch.
+"""
+import asyncio
+import datetime
+import functools
+import gzip
+import json
+import os
+import tempfile
+
+from connectors.es.sink import (
+    BIN_DOCS_DOWNLOADED,
+    CREATES_QUEUED,
+    DELETES_QUEUED,
+    OP_DELETE,
+    OP_INDEX,
+    OP_UPDATE,
+    UPDATES_QUEUED,
+)
+from connectors.filtering.basic_rule import (
+    PROFILE_SYNC_RULES,
+    SLOWEST_SYNC_RULES,
+    SYNC_RULES_STATS,
+    BasicRuleEngine,
+    parse,
+)
+from connectors.logger import logger
+from connectors.protocol.connectors import (
+    DELETED_DOCUMENT_COUNT,
+    INDEXED_DOCUMENT_COUNT,
+    INDEXED_DOCUMENT_VOLUME,
+)
+from connectors.utils import ConcurrentTasks, Counters
+
+ELASTICSEARCH_SINK = "elasticsearch"
+FILE_SINK = "file"
+
+MB = 1024 * 1024
+DEFAULT_SEGMENT_SIZE = 100 * MB
+DEFAULT_CHUNK_SIZE = 1000
+DEFAULT_CHUNK_MEM_SIZE = 5  # MB
+DEFAULT_CONCURRENT_DOWNLOADS = 10
+DOCS_FILTERED = "docs_filtered"
+SYNC_RULES_BATCH_SIZE = 100
+
+
+def _json_default(value):
+    if isinstance(value, (datetime.date, datetime.datetime)):
+        return value.isoformat()
+    return str(value)
+
+
+def bulk_lines(index, doc, operation):
+    """Returns the bulk request lines of `operation` on `doc`, as bytes.
+
+    The `_id` of the document goes to the action line, deletes have no source line.
+    """
+    doc_id = doc.pop("_id")
+    action = {operation: {"_index": index, "_id": doc_id}}
+    lines = [action]
+    if operation == OP_UPDATE:
+        lines.append({"doc": doc, "doc_as_upsert": True})
+    elif operation != OP_DELETE:
+        lines.append(doc)
+    return b"".join(
+        json.dumps(line, default=_json_default).encode("utf-8") + b"\n"
+        for line in lines
+    )
+
+
+class SegmentWriter:
+    """Appends NDJSON lines to numbered segment files.
+
+    A new segment is started when writing to the current one would take it over
+    `segment_size` bytes, before compression. Lines are never split across segments.
+    """
+
+    def __init__(
+        self, directory, prefix, segment_size=DEFAULT_SEGMENT_SIZE, compress=False
+    ):
+        self.directory = directory
+        self.prefix = prefix
+        self.segment_size = segment_size
+        self.compress = compress
+        self.segments = []
+        self.bytes_written = 0
+        self._file = None
+        self._segment_bytes = 0
+
+    def _open_segment(self):
+        extension = ".ndjson.gz" if self.compress else ".ndjson"
+        path = os.path.join(
+            self.directory, f"{self.prefix}-{len(self.segments) + 1:05d}{extension}"
+        )
+        os.makedirs(self.directory, exist_ok=True)
+        self._file = gzip.open(path, "wb") if self.compress else open(path, "wb")
+        self._segment_bytes = 0
+        self.segments.append(path)
+
+    def write(self, data):
+        if (
+            self._file is not None
+            and self._segment_bytes > 0
+            and self._segment_bytes + len(data) > self.segment_size
+        ):
+            self.close()
+        if self._file is None:
+            self._open_segment()
+        self._file.write(data)
+        self._segment_bytes += len(data)
+        self.bytes_written += len(data)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class FileSyncOrchestrator:
+    """Runs the documents of a sync job through sync rules and downloads, and writes them to files.
+
+    Exposes the methods of `SyncOrchestrator` the sync job runner calls. Operations are
+    buffered in chunks of `chunk_size` documents or `chunk_max_mem_size` MB, the bulk
+    options of the job, and chunks are written to the segments from a thread. Sync rules
+    are evaluated on batches of `SYNC_RULES_BATCH_SIZE` documents with `should_ingest_many`.
+    `skip_unchanged_documents` is ignored: there is no index to compare documents with.
+    """
+
+    def __init__(
+        self,
+        output_dir,
+        job_id,
+        logger_=None,
+        segment_size=DEFAULT_SEGMENT_SIZE,
+        compress=False,
+    ):
+        self._logger = logger_ or logger
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.job_id = job_id
+        self.segment_size = segment_size
+        self.compress = compress
+        self.counters = Counters()
+        self.canceled = False
+        self.error = None
+        self.writer = None
+        self.basic_rule_engine = None
+        self._task = None
+        self._chunk = []
+        self._chunk_docs = 0
+        self._chunk_bytes = 0
+        self._write_lock = asyncio.Lock()
+
+    @classmethod
+    def from_config(cls, service_config, job_id, logger_=None):
+        return cls(
+            service_config.get("file_sink_dir"),
+            job_id,
+            logger_=logger_,
+            segment_size=service_config.get(
+                "file_sink_segment_size", DEFAULT_SEGMENT_SIZE
+            ),
+            compress=service_config.get("file_sink_compress", False),
+        )
+
+    async def close(self):
+        pass
+
+    async def has_active_license_enabled(self, license_):
+        # no cluster to check the license of
+        return True, license_
+
+    async def prepare_content_index(self, index_name, language_code=None):
+        self._logger.debug(
+            f"Writing documents of index {index_name} to {self.output_dir} instead of Elasticsearch"
+        )
+
+    def done(self):
+        return self._task is None or self._task.done()
+
+    def get_error(self):
+        return self.error
+
+    async def cancel(self):
+        self.canceled = True
+        if self._task is not None and not self._task.done():
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def ingestion_stats(self):
+        stats = self.counters.to_dict()
+        stats[INDEXED_DOCUMENT_VOLUME] = round(
+            stats.get(INDEXED_DOCUMENT_VOLUME, 0) / MB
+        )
+        if self.basic_rule_engine is not None:
+            stats[SYNC_RULES_STATS] = self.basic_rule_engine.rules_stats()
+            if self.basic_rule_engine.profile:
+                stats[SLOWEST_SYNC_RULES] = self.basic_rule_engine.slowest_rules()
+        return stats
+
+    async def async_bulk(
+        self,
+        index,
+        generator,
+        pipeline,
+        job_type,
+        filter_=None,
+        sync_rules_enabled=False,
+        content_extraction_enabled=True,
+        options=None,
+        skip_unchanged_documents=False,
+        enable_bulk_operations_logging=False,
+    ):
+        options = options or {}
+        self.basic_rule_engine = (
+            BasicRuleEngine(
+                parse(filter_.basic_rules),
+                profile=options.get(PROFILE_SYNC_RULES, False),
+            )
+            if sync_rules_enabled and filter_ is not None
+            else None
+        )
+        self.writer = SegmentWriter(
+            os.path.join(self.output_dir, index),
+            self.job_id,
+            segment_size=self.segment_size,
+            compress=self.compress,
+        )
+        self._task = asyncio.create_task(
+            self._run(
+                index,
+                generator,
+                content_extraction_enabled,
+                chunk_size=options.get("chunk_size", DEFAULT_CHUNK_SIZE),
+                chunk_mem_size=options.get("chunk_max_mem_size", DEFAULT_CHUNK_MEM_SIZE)
+                * MB,
+                concurrent_downloads=options.get(
+                    "concurrent_downloads", DEFAULT_CONCURRENT_DOWNLOADS
+                ),
+                log_operations=enable_bulk_operations_logging,
+            )
+        )
+
+    async def _run(
+        self,
+        index,
+        generator,
+        content_extraction_enabled,
+        chunk_size,
+        chunk_mem_size,
+        concurrent_downloads,
+        log_operations,
+    ):
+        downloads = ConcurrentTasks(max_concurrency=concurrent_downloads)
+        add = functools.partial(
+            self._add,
+            index,
+            chunk_size=chunk_size,
+            chunk_mem_size=chunk_mem_size,
+            log_operations=log_operations,
+        )
+        process = functools.partial(
+            self._process_batch,
+            add=add,
+            downloads=downloads,
+            content_extraction_enabled=content_extraction_enabled,
+        )
+        try:
+            batch = []
+            async for doc, lazy_download, operation in generator:
+                batch.append((doc, lazy_download, operation or OP_INDEX))
+                if len(batch) >= SYNC_RULES_BATCH_SIZE:
+                    await process(batch)
+                    batch = []
+            await process(batch)
+
+            await downloads.join(raise_on_error=True)
+            await self._flush()
+            self._logger.info(
+                f"Wrote {self.writer.bytes_written} bytes to {len(self.writer.segments)} segment(s) in {self.writer.directory}"
+            )
+        except asyncio.CancelledError:
+            downloads.cancel()
+            raise
+        except Exception as e:
+            downloads.cancel()
+            self._logger.error(f"File sink failed: {e}", exc_info=True)
+            self.error = e
+        finally:
+            await asyncio.to_thread(self.writer.close)
+
+    async def _process_batch(self, batch, add, downloads, content_extraction_enabled):
+        ingest = [True] * len(batch)
+        if self.basic_rule_engine is not None:
+            # sync rules are evaluated for the whole batch at once, deletes aren't filtered
+            positions = [
+                i for i, (_, _, operation) in enumerate(batch) if operation != OP_DELETE
+            ]
+            mask, _ = self.basic_rule_engine.should_ingest_many(
+                [batch[i][0] for i in positions]
+            )
+            for i, include in zip(positions, mask, strict=True):
+                ingest[i] = include
+
+        for (doc, lazy_download, operation), include in zip(batch, ingest, strict=True):
+            if not include:
+                self.counters.increment(DOCS_FILTERED)
+                continue
+
+            if (
+                operation != OP_DELETE
+                and lazy_download is not None
+                and content_extraction_enabled
+            ):
+                await downloads.put(
+                    functools.partial(
+                        self._download_and_add, add, doc, lazy_download, operation
+                    )
+                )
+            else:
+                await add(doc, operation)
+
+    async def _download_and_add(self, add, doc, lazy_download, operation):
+        data = await lazy_download(doit=True, timestamp=doc.get("_timestamp"))
+        if data is not None:
+            self.counters.increment(BIN_DOCS_DOWNLOADED)
+            data.pop("_id", None)
+            data.pop("_timestamp", None)
+            doc.update(data)
+        await add(doc, operation)
+
+    async def _add(
+        self, index, doc, operation, chunk_size, chunk_mem_size, log_operations
+    ):
+        if log_operations:
+            self._logger.debug(f"Writing {operation} of document {doc['_id']}")
+        lines = bulk_lines(index, doc, operation)
+
+        if operation == OP_DELETE:
+            self.counters.increment(DELETES_QUEUED)
+            self.counters.increment(DELETED_DOCUMENT_COUNT)
+        else:
+            self.counters.increment(
+                UPDATES_QUEUED if operation == OP_UPDATE else CREATES_QUEUED
+            )
+            self.counters.increment(INDEXED_DOCUMENT_COUNT)
+            self.counters.increment(INDEXED_DOCUMENT_VOLUME, len(lines))
+
+        self._chunk.append(lines)
+        self._chunk_docs += 1
+        self._chunk_bytes += len(lines)
+        if self._chunk_docs >= chunk_size or self._chunk_bytes >= chunk_mem_size:
+            await self._flush()
+
+    async def _flush(self):
+        if not self._chunk:
+            return
+        data = b"".join(self._chunk)
+        self._chunk, self._chunk_docs, self._chunk_bytes = [], 0, 0
+        # chunks are written one at a time, in the order they were completed
+        async with self._write_lock:
+            await asyncio.to_thread(self.writer.write, data)
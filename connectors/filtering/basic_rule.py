@@ -5,17 +5,26 @@
 #
 
 import datetime
+import itertools
+import logging
+import math
 import re
+import time
 from enum import Enum
 
-from dateutil.parser import ParserError, parser
-
-from connectors.logger import logger
+from connectors.logger import LogSampler, logger
 from connectors.utils import Format, shorten_str
 
 IS_BOOL_FALSE = re.compile("^(false|f|no|n|off)$", re.I)
 IS_BOOL_TRUE = re.compile("^(true|t|yes|y|on)$", re.I)
 
+# key of the basic rules stats reported at the end of a sync
+SYNC_RULES_STATS = "sync_rules_stats"
+# key of the ids of the most expensive basic rules, reported when sync rules are profiled
+SLOWEST_SYNC_RULES = "slowest_sync_rules"
+# bulk option turning on the per rule cost stats of the basic rule engine of a sync
+PROFILE_SYNC_RULES = "profile_sync_rules"
+
 
 def parse(basic_rules_json):
     """Parse a basic rules json array to BasicRule objects.
@@ -52,6 +61,8 @@ def to_float(value):
 
 
 def to_datetime(value):
+    from dateutil.parser import ParserError, parser
+
     try:
         date_parser = parser()
         parsed_date_or_datetime = date_parser.parse(timestr=value)
@@ -104,6 +115,31 @@ class RuleMatchStats:
         return self.policy == other.policy and self.matches_count == other.matches_count
 
 
+class RuleCostStats:
+    """RuleCostStats records how often a basic rule was evaluated and how long it took.
+
+    It's an internal class and is not expected to be used outside the module.
+    """
+
+    def __init__(self):
+        self.calls = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def record(self, duration):
+        self.calls += 1
+        self.total_time += duration
+        if duration > self.max_time:
+            self.max_time = duration
+
+    def to_dict(self):
+        return {
+            "calls": self.calls,
+            "total_time": self.total_time,
+            "max_time": self.max_time,
+        }
+
+
 class BasicRuleEngine:
     """BasicRuleEngine matches a document against a list of basic rules in order.
 
@@ -112,13 +148,23 @@ class BasicRuleEngine:
         - If a document matches a basic rule and the basic rule uses the `EXCLUDE` policy the document won't be ingested
 
     It also records stats, which basic rule matched how many documents with a certain policy.
+
+    The rules are compiled once into a `CompiledRules` matcher, which is used to find the first matching rule.
+
+    With `profile=True` the rules are evaluated one by one instead and the engine records per rule,
+    how often it was evaluated, the cumulative evaluation time and the slowest evaluation (in seconds).
     """
 
-    def __init__(self, rules):
+    def __init__(self, rules, profile=False):
         self.rules = rules
         self.rules_match_stats = {
             BasicRule.DEFAULT_RULE_ID: RuleMatchStats(Policy.INCLUDE, 0)
         }
+        self.profile = profile
+        self.rules_cost_stats = {}
+        self.compiled_rules = CompiledRules(rules)
+        # per document logs are rate limited
+        self._document_log_sampler = LogSampler()
 
     def should_ingest(self, document):
         """Check, whether a document should be ingested or not.
@@ -132,28 +178,143 @@ class BasicRuleEngine:
             self.rules_match_stats[BasicRule.DEFAULT_RULE_ID] += 1
             return True
 
-        for rule in self.rules:
-            if not rule:
-                continue
-
-            if rule.matches(document):
+        if self.profile:
+            rule = self._first_match_in_order(document)
+        else:
+            try:
+                rule = self.compiled_rules.first_match(document)
+            except Exception:
+                # the compiled matcher may evaluate rules in a different order, evaluating the rules
+                # one by one raises the same error as before (or none, if the failing rule is never reached)
+                rule = self._first_match_in_order(document)
+
+        # checking the level first is cheaper than a disabled log call on this per document path
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        if rule is not None:
+            if debug:
                 logger.debug(
-                    f"Document (id: '{document.get('id')}') matched basic rule (id: '{rule.id_}'). Document will be {rule.policy.value}d"
+                    lambda: f"Document (id: '{document.get('id')}') matched basic rule (id: '{rule.id_}'). Document will be {rule.policy.value}d",
+                    sampler=self._document_log_sampler,
                 )
 
-                self.rules_match_stats.setdefault(
-                    rule.id_, RuleMatchStats(rule.policy, 0)
-                )
-                self.rules_match_stats[rule.id_] += 1
+            self.rules_match_stats.setdefault(rule.id_, RuleMatchStats(rule.policy, 0))
+            self.rules_match_stats[rule.id_] += 1
 
-                return rule.is_include()
+            return rule.is_include()
 
         # default behavior: ingest document, if no rule matches ("default rule")
         self.rules_match_stats[BasicRule.DEFAULT_RULE_ID] += 1
+        if debug:
+            logger.debug(
+                lambda: f"Document (id: '{document.get('id')}') didn't match any basic rule. Document will be included",
+                sampler=self._document_log_sampler,
+            )
+        return True
+
+    def should_ingest_many(self, documents):
+        """Check for a batch of documents, whether they should be ingested or not.
+
+        The rules are evaluated field by field over the whole batch, documents sharing a field value
+        are matched against the rules of that field only once. Gives the same results as calling
+        `should_ingest` for every document.
+
+        Arguments:
+        - `documents`: list of documents matched against the basic rules
+
+        Returns a tuple of:
+        - a list of booleans, `True` at the position of every document, which should be ingested
+        - a dict with the number of documents matched per basic rule id in this batch
+        """
+        if not self.rules:
+            matched_rules = [None] * len(documents)
+        elif self.profile:
+            matched_rules = [
+                self._first_match_in_order(document) for document in documents
+            ]
+        else:
+            try:
+                matched_rules = self.compiled_rules.first_match_many(documents)
+            except Exception:
+                # same fallback as in `should_ingest`
+                matched_rules = [
+                    self._first_match_in_order(document) for document in documents
+                ]
+
+        mask = []
+        matches_count = {}
+        for rule in matched_rules:
+            if rule is None:
+                rule_id, policy, include = (
+                    BasicRule.DEFAULT_RULE_ID,
+                    Policy.INCLUDE,
+                    True,
+                )
+            else:
+                rule_id, policy, include = rule.id_, rule.policy, rule.is_include()
+
+            mask.append(include)
+            if rule_id not in matches_count:
+                matches_count[rule_id] = 0
+                self.rules_match_stats.setdefault(rule_id, RuleMatchStats(policy, 0))
+            matches_count[rule_id] += 1
+
+        for rule_id, count in matches_count.items():
+            self.rules_match_stats[rule_id] += count
+
         logger.debug(
-            f"Document (id: '{document.get('id')}') didn't match any basic rule. Document will be included"
+            lambda: f"{mask.count(True)} out of {len(documents)} documents will be included. Matched basic rules: {matches_count}"
         )
-        return True
+        return mask, matches_count
+
+    def _first_match_in_order(self, document):
+        for rule in self.rules:
+            if not rule:
+                continue
+
+            if self.profile:
+                start = time.perf_counter()
+                try:
+                    matches = rule.matches(document)
+                finally:
+                    self.rules_cost_stats.setdefault(rule.id_, RuleCostStats()).record(
+                        time.perf_counter() - start
+                    )
+            else:
+                matches = rule.matches(document)
+
+            if matches:
+                return rule
+
+        return None
+
+    def rules_stats(self):
+        """Return the match stats (and the cost stats, if profiling) per basic rule id.
+
+        The stats are meant to be reported at the end of a sync.
+        """
+        stats = {}
+        for rule_id, match_stats in self.rules_match_stats.items():
+            stats[rule_id] = {
+                "policy": match_stats.policy.value,
+                "matches_count": match_stats.matches_count,
+            }
+
+        for rule in self.rules or []:
+            if rule and rule.id_ in self.rules_cost_stats:
+                stats.setdefault(
+                    rule.id_, {"policy": rule.policy.value, "matches_count": 0}
+                ).update(self.rules_cost_stats[rule.id_].to_dict())
+
+        return stats
+
+    def slowest_rules(self, count=5):
+        """Return the ids of the `count` basic rules with the highest cumulative evaluation time."""
+        return sorted(
+            self.rules_cost_stats,
+            key=lambda rule_id: self.rules_cost_stats[rule_id].total_time,
+            reverse=True,
+        )[:count]
 
 
 class InvalidRuleError(ValueError):
@@ -350,3 +511,286 @@ class BasicRule:
             # order uses 0 based indexing
             return f"Basic rule {self.order + 1} (id: '{shorten_str(self.id_, BasicRule.SHORTEN_UUID_BY)}')"
         return str(self)
+
+
+class CompiledRules:
+    """CompiledRules finds the first basic rule (in order) matching a document.
+
+    It gives the same result as calling `BasicRule.matches` for every rule in order, but:
+        - rules are grouped by field, so rules on fields missing in the document are skipped with one lookup
+        - rule values are coerced once per document value type and regexes are compiled once
+        - `EQUALS` rules on the same field are looked up in a dict instead of being compared one by one
+        - `STARTS_WITH`, `ENDS_WITH` and `CONTAINS` rules on the same field are checked together first,
+          they are only compared one by one, if at least one of them matches
+        - the first matching `GREATER_THAN` or `LESS_THAN` rule on a string or number is found by binary search
+    """
+
+    def __init__(self, rules):
+        self.match_all = None
+        self.fields = {}
+
+        for position, rule in enumerate(rules or []):
+            if not rule:
+                continue
+
+            if rule.is_default_rule():
+                # the default rule matches every document, rules after it are never reached
+                self.match_all = _CompiledRule(position, rule)
+                break
+
+            self.fields.setdefault(rule.field, _FieldRules()).add(
+                _CompiledRule(position, rule)
+            )
+
+    def first_match(self, document):
+        """Return the first basic rule matching the document or `None`."""
+        best = self.match_all
+
+        for field, field_rules in self.fields.items():
+            if field not in document:
+                continue
+
+            candidate = field_rules.first_match(
+                document[field], best.position if best else math.inf
+            )
+            if candidate is not None:
+                best = candidate
+
+        return best.rule if best else None
+
+    def first_match_many(self, documents):
+        """Return the first basic rule matching each document (or `None`), field by field."""
+        best = [self.match_all] * len(documents)
+
+        for field, field_rules in self.fields.items():
+            # field value -> (first matching rule of the field, limit it was searched with)
+            matches_by_value = {}
+
+            for i, document in enumerate(documents):
+                if field not in document:
+                    continue
+
+                value = document[field]
+                limit = best[i].position if best[i] else math.inf
+                try:
+                    # string comparisons match on `str(value)` and equal values may print differently
+                    # (1 and 1.0, 0.0 and -0.0, equal datetimes in different timezones)
+                    key = (type(value), value, str(value))
+                    candidate, searched_limit = matches_by_value.get(key, (None, -1))
+                except TypeError:
+                    # unhashable value
+                    key, candidate, searched_limit = None, None, -1
+
+                if candidate is None and searched_limit < limit:
+                    candidate = field_rules.first_match(value, limit)
+                    if key is not None:
+                        matches_by_value[key] = (candidate, limit)
+
+                if candidate is not None and candidate.position < limit:
+                    best[i] = candidate
+
+        return [compiled_rule.rule if compiled_rule else None for compiled_rule in best]
+
+
+class _FieldRules:
+    """Compiled rules of a single field, grouped by comparison."""
+
+    def __init__(self):
+        self.rules_by_comparison = {}
+        self._equals_lookups = {}
+        self._prefilters = {}
+        self._running_bounds = {}
+
+    def add(self, compiled_rule):
+        self.rules_by_comparison.setdefault(compiled_rule.rule.rule, []).append(
+            compiled_rule
+        )
+
+    def first_match(self, document_value, limit):
+        """Return the first rule matching `document_value`, if it comes before position `limit`."""
+        value_type = _value_type(document_value)
+        first = None
+        text = None
+
+        for comparison, rules in self.rules_by_comparison.items():
+            if rules[0].position >= limit:
+                continue
+
+            if comparison == Rule.EQUALS and value_type != _OTHER:
+                candidate = self._equals_lookup(value_type, document_value).get(
+                    document_value
+                )
+                if candidate is not None and candidate.position < limit:
+                    first, limit = candidate, candidate.position
+                continue
+
+            if comparison in _STRING_COMPARISONS:
+                if text is None:
+                    text = str(document_value)
+                if not self._may_match(comparison, rules, text):
+                    continue
+
+            if comparison in _ORDER_COMPARISONS and value_type in (_STR, _NUMBER):
+                bounds = self._running_bounds_for(
+                    comparison, rules, value_type, document_value
+                )
+                if bounds is not None:
+                    candidate = _first_beyond_bound(
+                        comparison, rules, bounds, document_value
+                    )
+                    if candidate is not None and candidate.position < limit:
+                        first, limit = candidate, candidate.position
+                    continue
+
+            for compiled_rule in rules:
+                if compiled_rule.position >= limit:
+                    break
+
+                if compiled_rule.matches(document_value, value_type):
+                    first, limit = compiled_rule, compiled_rule.position
+                    break
+
+        return first
+
+    def _may_match(self, comparison, rules, text):
+        """Check all `STARTS_WITH`, `ENDS_WITH` or `CONTAINS` rules of the field at once."""
+        prefilter = self._prefilters.get(comparison)
+
+        if prefilter is None:
+            values = [compiled_rule.rule.value for compiled_rule in rules]
+            match comparison:
+                case Rule.STARTS_WITH:
+                    prefixes = tuple(values)
+                    prefilter = lambda text: text.startswith(prefixes)  # noqa: E731
+                case Rule.ENDS_WITH:
+                    suffixes = tuple(values)
+                    prefilter = lambda text: text.endswith(suffixes)  # noqa: E731
+                case Rule.CONTAINS:
+                    prefilter = re.compile("|".join(map(re.escape, values))).search
+            self._prefilters[comparison] = prefilter
+
+        return bool(prefilter(text))
+
+    def _running_bounds_for(self, comparison, rules, value_type, document_value):
+        """Running minimum (`GREATER_THAN`) or maximum (`LESS_THAN`) of the coerced rule values.
+
+        Returns `None`, if the coerced values can't be ordered (e.g. a number rule value, which couldn't be coerced).
+        """
+        key = (comparison, value_type)
+
+        if key not in self._running_bounds:
+            values = [
+                compiled_rule.coerced_value(value_type, document_value)
+                for compiled_rule in rules
+            ]
+            expected_type = str if value_type == _STR else float
+            bound = min if comparison == Rule.GREATER_THAN else max
+
+            bounds = None
+            if all(
+                type(value) is expected_type and value == value  # NaN isn't ordered
+                for value in values
+            ):
+                bounds = list(itertools.accumulate(values, bound))
+            self._running_bounds[key] = bounds
+
+        return self._running_bounds[key]
+
+    def _equals_lookup(self, value_type, document_value):
+        lookup = self._equals_lookups.get(value_type)
+
+        if lookup is None:
+            lookup = {}
+            for compiled_rule in self.rules_by_comparison[Rule.EQUALS]:
+                lookup.setdefault(
+                    compiled_rule.coerced_value(value_type, document_value),
+                    compiled_rule,
+                )
+            self._equals_lookups[value_type] = lookup
+
+        return lookup
+
+
+_STR, _BOOL, _NUMBER, _DATE, _OTHER = range(5)
+_STRING_COMPARISONS = (Rule.STARTS_WITH, Rule.ENDS_WITH, Rule.CONTAINS)
+_ORDER_COMPARISONS = (Rule.GREATER_THAN, Rule.LESS_THAN)
+
+
+def _first_beyond_bound(comparison, rules, bounds, document_value):
+    """Binary search for the first rule, whose running bound is beyond the document value.
+
+    The first `GREATER_THAN` rule matching a value is the first one whose running minimum is smaller
+    than the value (the same goes for `LESS_THAN` with the running maximum).
+    """
+    if document_value != document_value:  # NaN never matches
+        return None
+
+    if comparison == Rule.GREATER_THAN:
+        beyond = lambda bound: document_value > bound  # noqa: E731
+    else:
+        beyond = lambda bound: document_value < bound  # noqa: E731
+
+    low, high = 0, len(bounds)
+    while low < high:
+        middle = (low + high) // 2
+        if beyond(bounds[middle]):
+            high = middle
+        else:
+            low = middle + 1
+
+    return rules[low] if low < len(rules) else None
+
+
+def _value_type(value):
+    # mirrors the type cases of `BasicRule.coerce_rule_value_based_on_document_value`
+    match value:
+        case str():
+            return _STR
+        case bool():
+            return _BOOL
+        case float() | int():
+            return _NUMBER
+        case datetime.date():
+            return _DATE
+        case _:
+            return _OTHER
+
+
+class _CompiledRule:
+    __slots__ = ("position", "rule", "_coerced_values", "_regex")
+
+    def __init__(self, position, rule):
+        self.position = position
+        self.rule = rule
+        self._coerced_values = {}
+        self._regex = None
+
+    def coerced_value(self, value_type, document_value):
+        if value_type not in self._coerced_values:
+            self._coerced_values[
+                value_type
+            ] = self.rule.coerce_rule_value_based_on_document_value(document_value)
+
+        return self._coerced_values[value_type]
+
+    def matches(self, document_value, value_type):
+        """Same comparisons as `BasicRule.matches` on an already extracted field value."""
+        rule_value = self.rule.value
+
+        match self.rule.rule:
+            case Rule.STARTS_WITH:
+                return str(document_value).startswith(rule_value)
+            case Rule.ENDS_WITH:
+                return str(document_value).endswith(rule_value)
+            case Rule.CONTAINS:
+                return rule_value in str(document_value)
+            case Rule.REGEX:
+                if self._regex is None:
+                    self._regex = re.compile(rule_value)
+                return self._regex.match(str(document_value)) is not None
+            case Rule.LESS_THAN:
+                return document_value < self.coerced_value(value_type, document_value)
+            case Rule.GREATER_THAN:
+                return document_value > self.coerced_value(value_type, document_value)
+            case Rule.EQUALS:
+                return document_value == self.coerced_value(value_type, document_value)
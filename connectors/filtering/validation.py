@@ -3,11 +3,21 @@
 # or more contributor license agreements. Licensed under the Elastic License 2.0;
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
+import hashlib
+import json
+from collections import OrderedDict
 from copy import deepcopy
 from enum import Enum
 
 import fastjsonschema
 
+try:
+    from re import _constants as sre_constants
+    from re import _parser as sre_parse
+except ImportError:  # Python < 3.11
+    import sre_constants
+    import sre_parse
+
 from connectors.filtering.basic_rule import BasicRule, Policy, Rule
 from connectors.logger import logger
 from connectors.utils import Format
@@ -135,6 +145,56 @@ class FilteringValidationResult:
         }
 
 
+def rule_content_hash(rule):
+    """Hash of a (basic or advanced) rule's content, independent of the order of its keys."""
+    return hashlib.sha256(
+        json.dumps(rule, sort_keys=True, default=str).encode()
+    ).hexdigest()
+
+
+class ValidationResultsCache:
+    """LRU cache of validation results (and rule summaries) keyed by validator and rule content hash.
+
+    Validation results of a rule only depend on its content, so an edited rule set only needs
+    the new or changed rules to be validated again.
+    """
+
+    DEFAULT_MAX_SIZE = 10000
+
+    def __init__(self, max_size=DEFAULT_MAX_SIZE):
+        self.max_size = max_size
+        self._results = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        if key not in self._results:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self._results.move_to_end(key)
+        return self._results[key]
+
+    def put(self, key, result):
+        self._results[key] = result
+        self._results.move_to_end(key)
+        while len(self._results) > self.max_size:
+            self._results.popitem(last=False)
+
+    def clear(self):
+        self._results.clear()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self._results)
+
+
+# shared by all validators of the process, as a new validator is created for each validation
+validation_results_cache = ValidationResultsCache()
+
+
 class FilteringValidator:
     """Facade for basic and advanced rule validators.
 
@@ -143,7 +203,11 @@ class FilteringValidator:
     """
 
     def __init__(
-        self, basic_rules_validators=None, advanced_rules_validators=None, logger_=None
+        self,
+        basic_rules_validators=None,
+        advanced_rules_validators=None,
+        logger_=None,
+        cache=validation_results_cache,
     ):
         self.basic_rules_validators = (
             [] if basic_rules_validators is None else basic_rules_validators
@@ -152,6 +216,27 @@ class FilteringValidator:
             [] if advanced_rules_validators is None else advanced_rules_validators
         )
         self._logger = logger_ or logger
+        self.cache = cache
+
+    def _cached(self, key, validate, cacheable=True):
+        if self.cache is None or not cacheable:
+            return validate()
+
+        result = self.cache.get(key)
+        if result is None:
+            result = validate()
+            self.cache.put(key, result)
+        return result
+
+    async def _cached_async(self, key, validate):
+        if self.cache is None or key is None:
+            return await validate()
+
+        result = self.cache.get(key)
+        if result is None:
+            result = await validate()
+            self.cache.put(key, result)
+        return result
 
     async def validate(self, filtering):
         def _is_valid_str(result):
@@ -163,13 +248,37 @@ class FilteringValidator:
         self._logger.info("Filtering validation started")
         basic_rules = filtering.basic_rules
         basic_rules_ids = [basic_rule["id"] for basic_rule in basic_rules]
+        basic_rules_hashes = [
+            rule_content_hash(basic_rule) for basic_rule in basic_rules
+        ]
 
         filtering_validation_result = FilteringValidationResult()
 
         for validator in self.basic_rules_validators:
             if issubclass(validator, BasicRulesSetValidator):
                 # pass the whole set/list of rules at once (validate constraints between rules)
-                results = validator.validate(basic_rules)
+                if validator.incremental:
+                    # only new or changed rules are summarized, the summaries are checked against each other
+                    summaries = [
+                        self._cached(
+                            (validator, basic_rule_hash),
+                            lambda validator=validator, basic_rule=basic_rule: validator.rule_summary(
+                                basic_rule
+                            ),
+                            cacheable=validator.cacheable,
+                        )
+                        for basic_rule, basic_rule_hash in zip(
+                            basic_rules, basic_rules_hashes, strict=True
+                        )
+                    ]
+                    results = validator.validate_summaries(summaries)
+                else:
+                    # results are reused as long as no rule of the set changed
+                    results = self._cached(
+                        (validator, tuple(basic_rules_hashes)),
+                        lambda validator=validator: validator.validate(basic_rules),
+                        cacheable=validator.cacheable,
+                    )
                 for result in results:
                     filtering_validation_result += result
 
@@ -178,9 +287,17 @@ class FilteringValidator:
                     )
 
             if issubclass(validator, BasicRuleValidator):
-                for basic_rule in basic_rules:
-                    # pass rule by rule (validate rule in isolation)
-                    validator_result = validator.validate(basic_rule)
+                for basic_rule, basic_rule_hash in zip(
+                    basic_rules, basic_rules_hashes, strict=True
+                ):
+                    # pass rule by rule (validate rule in isolation), only new or changed rules are validated
+                    validator_result = self._cached(
+                        (validator, basic_rule_hash),
+                        lambda validator=validator, basic_rule=basic_rule: validator.validate(
+                            basic_rule
+                        ),
+                        cacheable=validator.cacheable,
+                    )
                     filtering_validation_result += validator_result
 
                     logger.debug(
@@ -189,6 +306,7 @@ class FilteringValidator:
 
         if filtering.has_advanced_rules():
             advanced_rules = filtering.get_advanced_rules()
+            advanced_rules_hash = rule_content_hash(advanced_rules)
             advanced_rules_validators = (
                 self.advanced_rules_validators
                 if isinstance(self.advanced_rules_validators, list)
@@ -196,7 +314,18 @@ class FilteringValidator:
             )
 
             for validator in advanced_rules_validators:
-                filtering_validation_result += await validator.validate(advanced_rules)
+                # validators can also be passed as classes, these are never cached
+                cache_key = (
+                    validator.cache_key()
+                    if isinstance(validator, AdvancedRulesValidator)
+                    else None
+                )
+                filtering_validation_result += await self._cached_async(
+                    None
+                    if cache_key is None
+                    else (type(validator), cache_key, advanced_rules_hash),
+                    lambda validator=validator: validator.validate(advanced_rules),
+                )
 
         self._logger.info(
             f"Filtering validation result: {filtering_validation_result.state}"
@@ -211,12 +340,30 @@ class FilteringValidator:
 
 
 class BasicRulesSetValidator:
-    """Validate constraints between different rules."""
+    """Validate constraints between different rules.
+
+    Incremental validators split the validation in a per rule part, `rule_summary`, and a check of
+    the summaries against each other, `validate_summaries`. Summaries only depend on the content of
+    their rule, so after an edit only the summaries of new or changed rules are computed again.
+    Other validators are run on the whole set again as soon as one rule changes.
+    """
+
+    # validators with side effects (f.e. logging warnings) run on every validation
+    cacheable = True
+    incremental = False
 
     @classmethod
     def validate(cls, rules):
         raise NotImplementedError
 
+    @classmethod
+    def rule_summary(cls, rule):
+        raise NotImplementedError
+
+    @classmethod
+    def validate_summaries(cls, summaries):
+        raise NotImplementedError
+
 
 class BasicRulesSetSemanticValidator(BasicRulesSetValidator):
     """BasicRulesSetSemanticValidator can be used to validate that a set of filtering rules does not contain semantic duplicates.
@@ -227,18 +374,27 @@ class BasicRulesSetSemanticValidator(BasicRulesSetValidator):
     If a semantic duplicate is detected both rules will be marked as invalid.
     """
 
+    incremental = True
+
     @classmethod
     def validate(cls, rules):
-        rules_dict = {}
+        return cls.validate_summaries([cls.rule_summary(rule) for rule in rules])
 
-        for rule in rules:
-            basic_rule = BasicRule.from_json(rule)
-            # we want to check whether another rule already uses the exact same values for 'field', 'rule' and 'value'
-            # to detect semantic duplicates
-            field_rule_value_hash = hash(
-                (basic_rule.field, basic_rule.rule, basic_rule.value)
-            )
+    @classmethod
+    def rule_summary(cls, rule):
+        basic_rule = BasicRule.from_json(rule)
+        # we want to check whether another rule already uses the exact same values for 'field', 'rule' and 'value'
+        # to detect semantic duplicates
+        field_rule_value_hash = hash(
+            (basic_rule.field, basic_rule.rule, basic_rule.value)
+        )
+        return field_rule_value_hash, basic_rule
 
+    @classmethod
+    def validate_summaries(cls, summaries):
+        rules_dict = {}
+
+        for field_rule_value_hash, basic_rule in summaries:
             if field_rule_value_hash in rules_dict:
                 semantic_duplicate = rules_dict[field_rule_value_hash]
 
@@ -280,6 +436,9 @@ class BasicRulesSetSemanticValidator(BasicRulesSetValidator):
 class BasicRuleValidator:
     """Validate a single rule in isolation."""
 
+    # validators with side effects (f.e. logging warnings) run on every validation
+    cacheable = True
+
     @classmethod
     def validate(cls, rule):
         raise NotImplementedError
@@ -310,6 +469,82 @@ class BasicRuleNoMatchAllRegexValidator(BasicRuleValidator):
         return SyncRuleValidationResult.valid_result(rule_id=basic_rule.id_)
 
 
+class BasicRuleNoCatastrophicBacktrackingValidator(BasicRuleValidator):
+    """BasicRuleNoCatastrophicBacktrackingValidator warns about regexes, which can backtrack catastrophically.
+
+    Nested unbounded quantifiers (f.e. `(a+)+`) and unbounded quantifiers over alternatives starting the same way
+    (f.e. `(a|a?b)*`) can take exponential time on documents they almost match. Such a rule is still valid,
+    but a warning is logged before the sync starts, as it can slow down the whole sync.
+    """
+
+    REPEATS = (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT)
+
+    # the warning is logged before each sync, not only the first time the rule is validated
+    cacheable = False
+
+    @classmethod
+    def validate(cls, basic_rule_json):
+        basic_rule = BasicRule.from_json(basic_rule_json)
+
+        if basic_rule.rule == Rule.REGEX and cls.is_pathological(basic_rule.value):
+            logger.warning(
+                f"{format(basic_rule, Format.SHORT.value)} uses the regex '{basic_rule.value}', which contains nested or overlapping quantifiers. It may backtrack catastrophically and slow down the sync."
+            )
+
+        return SyncRuleValidationResult.valid_result(rule_id=basic_rule.id_)
+
+    @classmethod
+    def is_pathological(cls, regex):
+        try:
+            parsed = sre_parse.parse(regex)
+        except Exception:
+            # invalid regexes are not this validator's concern
+            return False
+
+        return cls._has_pathological_repeat(parsed, inside_unbounded_repeat=False)
+
+    @classmethod
+    def _has_pathological_repeat(cls, subpattern, inside_unbounded_repeat):
+        for op, av in subpattern:
+            if op in cls.REPEATS:
+                _, max_repeat, item = av
+                unbounded = max_repeat == sre_constants.MAXREPEAT
+                if unbounded and (
+                    inside_unbounded_repeat or cls._has_overlapping_branches(item)
+                ):
+                    return True
+                if cls._has_pathological_repeat(
+                    item, inside_unbounded_repeat or unbounded
+                ):
+                    return True
+            elif op == sre_constants.BRANCH:
+                if any(
+                    cls._has_pathological_repeat(branch, inside_unbounded_repeat)
+                    for branch in av[1]
+                ):
+                    return True
+            elif op == sre_constants.SUBPATTERN:
+                if cls._has_pathological_repeat(av[-1], inside_unbounded_repeat):
+                    return True
+
+        return False
+
+    @classmethod
+    def _has_overlapping_branches(cls, subpattern):
+        for op, av in subpattern:
+            if op == sre_constants.SUBPATTERN:
+                return cls._has_overlapping_branches(av[-1])
+
+            if op == sre_constants.BRANCH:
+                # the parser factors out the common prefix of all alternatives, identical alternatives
+                # end up as several empty branches
+                first_items = [str(branch[0]) for branch in av[1] if len(branch)]
+                empty_branches = len(av[1]) - len(first_items)
+                return empty_branches > 1 or len(first_items) > len(set(first_items))
+
+        return False
+
+
 class BasicRuleAgainstSchemaValidator(BasicRuleValidator):
     """BasicRuleAgainstSchemaValidator can be used to check if basic rule follows specified json schema."""
 
@@ -355,3 +590,12 @@ class AdvancedRulesValidator:
 
     def validate(self, advanced_rules):
         raise NotImplementedError
+
+    def cache_key(self):
+        """Return a key identifying everything the validation depends on besides the advanced rules.
+
+        Advanced rules validators often check the rules against the remote system, so their results
+        are not cached by default. Validators can return f.e. the remote host and the connector configuration
+        to reuse results for unchanged advanced rules.
+        """
+        return None
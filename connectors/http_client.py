@@ -0,0 +1,234 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""
+Process-wide registry of pooled `aiohttp` sessions.
+
+Every session handed out by the registry shares a single `TCPConnector`, so
+sources and services reuse keep-alive connections, TLS sessions and the DNS
+cache instead of opening their own connection pool for every sync job. Its
+`http_max_connections` limit is shared by all concurrent syncs and services,
+`http_max_connections_per_host` keeps a single host from taking all of them.
+"""
+import asyncio
+from collections.abc import Mapping
+
+import aiohttp
+
+from connectors.logger import logger
+from connectors.metrics import metrics
+from connectors.utils import Counters
+
+DEFAULT_MAX_CONNECTIONS = 100
+DEFAULT_MAX_CONNECTIONS_PER_HOST = 0  # no limit
+DEFAULT_KEEPALIVE_TIMEOUT = 15
+DEFAULT_DNS_CACHE_TTL = 300
+
+CONNECTIONS_CREATED = "connections_created"
+CONNECTIONS_REUSED = "connections_reused"
+DNS_CACHE_HITS = "dns_cache_hits"
+DNS_CACHE_MISSES = "dns_cache_misses"
+REQUESTS_SENT = "requests_sent"
+
+HTTP_REQUEST_DURATION = metrics.histogram(
+    "connectors_http_request_duration_seconds",
+    "Duration of HTTP requests sent through the shared connection pool, f.e. source API calls",
+    labelnames=("host", "method", "status"),
+)
+HTTP_CONNECTIONS = {
+    CONNECTIONS_CREATED: metrics.counter(
+        "connectors_http_connections_created",
+        "Connections opened by the shared connection pool",
+    ),
+    CONNECTIONS_REUSED: metrics.counter(
+        "connectors_http_connections_reused",
+        "Requests sent over a connection kept alive by the shared connection pool",
+    ),
+    DNS_CACHE_HITS: metrics.counter(
+        "connectors_http_dns_cache_hits",
+        "Host name resolutions answered by the DNS cache of the shared connection pool",
+    ),
+    DNS_CACHE_MISSES: metrics.counter(
+        "connectors_http_dns_cache_misses",
+        "Host name resolutions missing from the DNS cache of the shared connection pool",
+    ),
+}
+HTTP_TLS_HANDSHAKES = metrics.counter(
+    "connectors_http_tls_handshakes",
+    "Connections opened by the shared connection pool to https hosts",
+    labelnames=("host",),
+)
+
+
+class HttpClientRegistry:
+    """Hands out `aiohttp.ClientSession` objects backed by one shared connection pool.
+
+    Sessions are cached per host, auth and `aiohttp.ClientSession` keyword arguments,
+    callers passing different headers or timeouts get different sessions. Callers must
+    not close the sessions they get, but give them back with `release_session` once
+    they are done: a session is closed when its last caller released it, so sessions
+    of rotated credentials don't stay open. The remaining sessions are closed by
+    `close` when the service shuts down.
+
+    Counters for created and reused connections and for the DNS cache are available
+    through `stats` and as metrics. A created connection to an `https` host costs a
+    TLS handshake, counted per host in `connectors_http_tls_handshakes`.
+    """
+
+    def __init__(self):
+        self.max_connections = DEFAULT_MAX_CONNECTIONS
+        self.max_connections_per_host = DEFAULT_MAX_CONNECTIONS_PER_HOST
+        self.keepalive_timeout = DEFAULT_KEEPALIVE_TIMEOUT
+        self.dns_cache_ttl = DEFAULT_DNS_CACHE_TTL
+        self.counters = Counters()
+        self._loop = None
+        self._connector = None
+        self._sessions = {}
+        self._session_users = {}
+
+    def configure(self, service_config):
+        """Reads the connection pool settings from the `service` section of the config."""
+        self.max_connections = service_config.get(
+            "http_max_connections", DEFAULT_MAX_CONNECTIONS
+        )
+        self.max_connections_per_host = service_config.get(
+            "http_max_connections_per_host", DEFAULT_MAX_CONNECTIONS_PER_HOST
+        )
+        self.keepalive_timeout = service_config.get(
+            "http_keepalive_timeout", DEFAULT_KEEPALIVE_TIMEOUT
+        )
+        self.dns_cache_ttl = service_config.get(
+            "http_dns_cache_ttl", DEFAULT_DNS_CACHE_TTL
+        )
+
+    def _trace_config(self):
+        async def _count(key, *args):
+            self.counters.increment(key)
+            if key in HTTP_CONNECTIONS:
+                HTTP_CONNECTIONS[key].inc()
+
+        async def _connection_created(session, trace_config_ctx, params):
+            await _count(CONNECTIONS_CREATED)
+            # connections are opened for the request the context belongs to
+            url = getattr(trace_config_ctx, "url", None)
+            if url is not None and url.scheme == "https":
+                HTTP_TLS_HANDSHAKES.inc(host=url.host)
+
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(_connection_created)
+        trace_config.on_connection_reuseconn.append(
+            lambda *args: _count(CONNECTIONS_REUSED)
+        )
+        trace_config.on_dns_cache_hit.append(lambda *args: _count(DNS_CACHE_HITS))
+        trace_config.on_dns_cache_miss.append(lambda *args: _count(DNS_CACHE_MISSES))
+        trace_config.on_request_start.append(lambda *args: _count(REQUESTS_SENT))
+
+        async def _request_start(session, trace_config_ctx, params):
+            trace_config_ctx.start = asyncio.get_running_loop().time()
+            trace_config_ctx.url = params.url
+
+        async def _request_done(session, trace_config_ctx, params, status):
+            HTTP_REQUEST_DURATION.observe(
+                asyncio.get_running_loop().time() - trace_config_ctx.start,
+                host=params.url.host,
+                method=params.method,
+                status=status,
+            )
+
+        trace_config.on_request_start.append(_request_start)
+        trace_config.on_request_end.append(
+            lambda session, ctx, params: _request_done(
+                session, ctx, params, params.response.status
+            )
+        )
+        trace_config.on_request_exception.append(
+            lambda session, ctx, params: _request_done(session, ctx, params, "error")
+        )
+        return trace_config
+
+    def _get_connector(self):
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            # connectors and sessions can't be shared between event loops
+            self._loop = loop
+            self._connector = None
+            self._sessions = {}
+            self._session_users = {}
+
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.max_connections,
+                limit_per_host=self.max_connections_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=self.dns_cache_ttl,
+                use_dns_cache=True,
+            )
+        return self._connector
+
+    def get_session(self, host, auth=None, **session_kwargs):
+        """Returns the pooled session for `host` and `auth`, creating it if needed.
+
+        Args:
+            host (str): host the session talks to, e.g. `api.bitbucket.org`
+            auth (aiohttp.BasicAuth, optional): credentials used by the session
+            session_kwargs: extra `aiohttp.ClientSession` arguments (headers, timeout...)
+        """
+        connector = self._get_connector()
+        key = (host, auth, _hashable(session_kwargs))
+        session = self._sessions.get(key)
+        if session is None or session.closed:
+            session = aiohttp.ClientSession(
+                connector=connector,
+                connector_owner=False,
+                auth=auth,
+                trace_configs=[self._trace_config()],
+                **session_kwargs,
+            )
+            self._sessions[key] = session
+            self._session_users[key] = 0
+        self._session_users[key] += 1
+        return session
+
+    async def release_session(self, session):
+        """Gives back a session returned by `get_session`, closing it if no one else uses it."""
+        key = next(
+            (key for key, cached in self._sessions.items() if cached is session), None
+        )
+        if key is None:
+            return
+
+        self._session_users[key] -= 1
+        if self._session_users[key] <= 0:
+            del self._sessions[key]
+            del self._session_users[key]
+            await session.close()
+
+    def stats(self):
+        return self.counters.to_dict()
+
+    async def close(self):
+        """Closes every session and the shared connection pool."""
+        sessions, self._sessions = self._sessions, {}
+        self._session_users = {}
+        for session in sessions.values():
+            await session.close()
+
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+        logger.debug(f"Closed shared HTTP connection pool. Stats: {self.stats()}")
+
+
+def _hashable(value):
+    # session arguments like headers are dicts, which can't be part of a cache key
+    if isinstance(value, Mapping):
+        return tuple(sorted((key, _hashable(item)) for key, item in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(_hashable(item) for item in value)
+    return value
+
+
+http_client_registry = HttpClientRegistry()
@@ -6,9 +6,12 @@
 """
 Logger -- sets the logging and provides a `logger` global object.
 """
+import atexit
 import contextlib
 import inspect
 import logging
+import logging.handlers
+import queue
 import time
 from functools import cached_property, wraps
 from typing import AsyncGenerator
@@ -16,8 +19,19 @@ from typing import AsyncGenerator
 import ecs_logging
 
 from connectors import __version__
+from connectors.metrics import metrics
 
 logger = None
+# the handler writing the logs, called from a background thread when logs are queued
+_stream_handler = None
+_queue_listener = None
+
+DEFAULT_LOG_QUEUE_SIZE = 0  # logs are written synchronously
+
+SERVICE_EXTRA = {
+    "service.type": "connectors-python",
+    "service.version": __version__,
+}
 
 
 class ColorFormatter(logging.Formatter):
@@ -69,7 +83,32 @@ class ColorFormatter(logging.Formatter):
         return formatter.format(record)
 
 
+class LogSampler:
+    """Rate limits logs of frequent events, f.e. one log per document.
+
+    Lets the first `first` events through, then one in `every`. Pass it as `sampler`
+    to a log call, the message of a skipped event is never built:
+
+        logger.debug(lambda: f"Document {doc_id} skipped", sampler=sampler)
+    """
+
+    def __init__(self, first=100, every=1000):
+        self.first = first
+        self.every = every
+        self.count = 0
+
+    def sample(self):
+        self.count += 1
+        return self.count <= self.first or (self.count - self.first) % self.every == 0
+
+
 class DocumentLogger:
+    """Logger adding a prefix and extra fields to the logs of a document (connector, sync job...)
+
+    Like the `connectors` logger, messages can be callables returning the message, which are
+    only called if the log level is enabled, and log calls accept a `LogSampler` as `sampler`.
+    """
+
     def __init__(self, prefix, extra):
         self._prefix = prefix
         self._extra = extra
@@ -143,26 +182,62 @@ class DocumentLogger:
 
 
 class ExtraLogger(logging.Logger):
-    def _log(self, level, msg, args, exc_info=None, prefix=None, extra=None):
+    def _log(
+        self, level, msg, args, exc_info=None, prefix=None, extra=None, sampler=None
+    ):
+        # only called for enabled levels, so sampled out or lazy messages are never built
+        if sampler is not None and not sampler.sample():
+            return
+        if callable(msg):
+            msg = msg()
+
         if (
             not (hasattr(self, "filebeat") and self.filebeat)  # pyright: ignore
             and prefix
         ):
             msg = f"{prefix} {msg}"
 
+        # the extra fields are copied to the log record, so the shared dict is never modified
         if extra is None:
-            extra = {}
-        extra.update(
-            {
-                "service.type": "connectors-python",
-                "service.version": __version__,
-            }
-        )
+            extra = SERVICE_EXTRA
+        else:
+            extra.update(SERVICE_EXTRA)
         super(ExtraLogger, self)._log(level, msg, args, exc_info, extra)
 
 
-def set_logger(log_level=logging.INFO, filebeat=False):
-    global logger
+class DroppingQueueHandler(logging.handlers.QueueHandler):
+    """Enqueues log records for a `QueueListener` writing them from a background thread.
+
+    Records are not formatted on the caller's side. When the bounded queue is full, records below
+    WARNING are dropped and counted in `dropped`, the others wait for room in the queue.
+    """
+
+    def __init__(self, queue_):
+        super().__init__(queue_)
+        self.dropped = 0
+
+    def prepare(self, record):
+        # formatting is left to the handler of the listener
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            if record.levelno < logging.WARNING:
+                self.dropped += 1
+            else:
+                self.queue.put(record)
+
+
+def set_logger(log_level=logging.INFO, filebeat=False, queue_size=None):
+    """Sets the level and format of the `connectors` logger.
+
+    A `queue_size` over 0 enables queued logging: records are enqueued on the caller's
+    thread and formatted and written by a background thread. 0 writes logs synchronously,
+    `None` keeps the current mode.
+    """
+    global logger, _stream_handler
     if filebeat:
         formatter = ecs_logging.StdlibFormatter()
     else:
@@ -171,18 +246,59 @@ def set_logger(log_level=logging.INFO, filebeat=False):
     if logger is None:
         logging.setLoggerClass(ExtraLogger)
         logger = logging.getLogger("connectors")
+        _stop_log_queue()
         logger.handlers.clear()
-        handler = logging.StreamHandler()
-        logger.addHandler(handler)
+        _stream_handler = logging.StreamHandler()
+        logger.addHandler(_stream_handler)
 
     logger.propagate = False
     logger.setLevel(log_level)
-    logger.handlers[0].setLevel(log_level)
-    logger.handlers[0].setFormatter(formatter)
+    _stream_handler.setLevel(log_level)  # pyright: ignore
+    _stream_handler.setFormatter(formatter)  # pyright: ignore
     logger.filebeat = filebeat  # pyright: ignore
+
+    if queue_size is not None:
+        _stop_log_queue()
+        if queue_size > 0:
+            _start_log_queue(queue_size)
     return logger
 
 
+def _start_log_queue(queue_size):
+    global _queue_listener
+    queue_handler = DroppingQueueHandler(queue.Queue(maxsize=queue_size))
+    _queue_listener = logging.handlers.QueueListener(
+        queue_handler.queue, _stream_handler, respect_handler_level=True
+    )
+    logger.handlers = [queue_handler]  # pyright: ignore
+    _queue_listener.start()
+
+
+def _stop_log_queue():
+    """Writes the queued logs and goes back to synchronous logging."""
+    global _queue_listener
+    if _queue_listener is None:
+        return
+
+    _queue_listener.stop()
+    _queue_listener = None
+    if logger is not None:
+        dropped = dropped_logs()
+        logger.handlers = [_stream_handler]
+        if dropped:
+            logger.warning(f"{dropped} logs were dropped as the log queue was full")
+
+
+def dropped_logs():
+    """Number of logs dropped because the log queue was full."""
+    if logger is None or not isinstance(logger.handlers[0], DroppingQueueHandler):
+        return 0
+    return logger.handlers[0].dropped
+
+
+atexit.register(_stop_log_queue)
+
+
 def set_extra_logger(logger, log_level=logging.INFO, prefix="BYOC", filebeat=False):
     if isinstance(logger, str):
         logger = logging.getLogger(logger)
@@ -200,13 +316,20 @@ def set_extra_logger(logger, log_level=logging.INFO, prefix="BYOC", filebeat=Fal
 #
 # metrics APIs that follow the open-telemetry APIs
 #
-# For now everything is dropped into the logger, but later on
-# we will use the otel API and exporter
+# Spans are logged in DEBUG and their duration is recorded in the
+# `metrics` registry, exported by `connectors.metrics.MetricsExporter`
+
+
+SPAN_DURATION = metrics.histogram(
+    "connectors_span_duration_seconds",
+    "Duration of traced functions",
+    labelnames=("span", "function"),
+)
 
 
 @contextlib.contextmanager
-def timed_execution(name, func_name, slow_log=None, canceled=None):
-    """Context manager to log time execution in DEBUG
+def timed_execution(name, func_name, slow_log=None, canceled=None, function=None):
+    """Context manager to log time execution in DEBUG and record it in the `connectors_span_duration_seconds` metric
 
     - name: prefix used for the log message
     - func_name: additional prefix for the function name
@@ -214,6 +337,7 @@ def timed_execution(name, func_name, slow_log=None, canceled=None):
       is emited
     - canceled: if provided a callable to cancel the timer. Used in nested
       calls.
+    - function: function label of the metric, defaults to `func_name`
     """
     start = time.time()
     try:
@@ -222,6 +346,7 @@ def timed_execution(name, func_name, slow_log=None, canceled=None):
         do_not_track = canceled is not None and canceled()
         if not do_not_track:
             delta = time.time() - start
+            SPAN_DURATION.observe(delta, span=name, function=function or func_name)
             if slow_log is None or (slow_log is not None and delta > slow_log):
                 logger.debug(  # pyright: ignore
                     f"[{name}] {func_name} took {delta} seconds."
@@ -242,7 +367,10 @@ class _TracedAsyncGenerator:
     async def __anext__(self):
         try:
             with timed_execution(
-                self.name, f"{self.counter}-{self.func_name}", self.slow_log
+                self.name,
+                f"{self.counter}-{self.func_name}",
+                self.slow_log,
+                function=self.func_name,
             ):
                 return await self.gen.__anext__()
         finally:
@@ -0,0 +1,126 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""
+Event loop lag monitor.
+
+Synchronous work on the event loop (parsing, conversions, file IO...) delays every
+other coroutine, like heartbeats and job checks of concurrent syncs. `LoopMonitor`
+measures how late the loop runs a periodic task and reports what blocks it.
+"""
+import asyncio
+import sys
+import threading
+import time
+import traceback
+
+from connectors.logger import logger
+from connectors.metrics import metrics
+
+DEFAULT_LOOP_MONITOR_INTERVAL = 0.5
+DEFAULT_LOOP_MONITOR_THRESHOLD = 1
+
+LOOP_LAG = metrics.histogram(
+    "connectors_event_loop_lag_seconds",
+    "Delay between the expected and the actual wake up of a task on the event loop",
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30),
+)
+LOOP_STALLS = metrics.counter(
+    "connectors_event_loop_stalls",
+    "Times the event loop was blocked for longer than the loop monitor threshold",
+)
+
+
+class LoopMonitor:
+    """Measures the event loop lag and logs the stack of the code blocking the loop.
+
+    - a task wakes up every `interval` seconds and records how late it woke up in the
+      `connectors_event_loop_lag_seconds` histogram
+    - a watchdog thread checks the task keeps waking up. When the loop did not run it
+      for more than `threshold` seconds, the current stack of the loop thread, i.e. the
+      code blocking the loop, and the running task are logged once per stall.
+    """
+
+    def __init__(
+        self,
+        interval=DEFAULT_LOOP_MONITOR_INTERVAL,
+        threshold=DEFAULT_LOOP_MONITOR_THRESHOLD,
+    ):
+        self.interval = interval
+        self.threshold = threshold
+        self.max_lag = 0
+        self.stalls = 0
+        self._loop = None
+        self._loop_thread_id = None
+        self._last_tick = None
+        self._task = None
+        self._watchdog = None
+        self._stopped = threading.Event()
+
+    @classmethod
+    def from_config(cls, service_config):
+        return cls(
+            interval=service_config.get(
+                "loop_monitor_interval", DEFAULT_LOOP_MONITOR_INTERVAL
+            ),
+            threshold=service_config.get(
+                "loop_monitor_threshold", DEFAULT_LOOP_MONITOR_THRESHOLD
+            ),
+        )
+
+    def start(self):
+        """Starts monitoring the running loop, must be called from a coroutine."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = asyncio.create_task(self._tick())
+        self._watchdog = threading.Thread(
+            target=self._watch, name="loop-monitor", daemon=True
+        )
+        self._watchdog.start()
+
+    async def stop(self):
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._watchdog is not None:
+            await asyncio.to_thread(self._watchdog.join)
+            self._watchdog = None
+
+    async def _tick(self):
+        while True:
+            expected = self._loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            lag = max(0, self._loop.time() - expected)
+            self._last_tick = time.monotonic()
+            LOOP_LAG.observe(lag)
+            self.max_lag = max(self.max_lag, lag)
+
+    def _watch(self):
+        reported_tick = None
+        while not self._stopped.wait(self.interval):
+            last_tick = self._last_tick
+            blocked_for = time.monotonic() - last_tick - self.interval
+            if blocked_for > self.threshold and last_tick != reported_tick:
+                reported_tick = last_tick
+                self._report_stall(blocked_for)
+
+    def _report_stall(self, blocked_for):
+        self.stalls += 1
+        LOOP_STALLS.inc()
+
+        frame = sys._current_frames().get(self._loop_thread_id)
+        stack = "".join(traceback.format_stack(frame)) if frame is not None else ""
+        task = asyncio.current_task(self._loop)
+        task_name = task.get_name() if task is not None else None
+        logger.warning(
+            f"Event loop blocked for more than {blocked_for:.2f} seconds by task {task_name}, stack:\n{stack}"
+        )
@@ -0,0 +1,392 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""
+In-process metrics -- counters, gauges and histograms, and their exporter.
+
+Metrics are recorded in the `metrics` registry. `MetricsExporter` serves them in
+the Prometheus text format over HTTP and/or dumps them periodically to a JSON file.
+
+Metrics can be updated from other threads than the event loop's (f.e. the watchdog
+thread of `LoopMonitor`), their values are updated and read under a lock.
+"""
+import asyncio
+import bisect
+import json
+import math
+import os
+import threading
+import time
+
+# in seconds, from fast function calls to full syncs
+DEFAULT_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1,
+    2.5,
+    5,
+    10,
+    30,
+    60,
+    300,
+    900,
+    3600,
+)
+
+DEFAULT_METRICS_HOST = "127.0.0.1"
+DEFAULT_METRICS_DUMP_INTERVAL = 60
+
+
+def _format_labels(labelnames, labelvalues, extra=None):
+    pairs = list(zip(labelnames, labelvalues, strict=True))
+    if extra is not None:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+
+    def _escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """Base class of metrics, values are kept per combination of label values."""
+
+    type = None  # noqa: A003
+
+    def __init__(self, name, help_, labelnames=()):
+        self.name = name
+        self.help = help_
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if not self.labelnames:
+            return ()
+        return tuple(labels[name] for name in self.labelnames)
+
+    def samples(self):
+        """Yields `(name suffix, label values, extra label, value)` tuples."""
+        raise NotImplementedError
+
+    def to_prometheus(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        for suffix, labelvalues, extra, value in self.samples():
+            labels = _format_labels(self.labelnames, labelvalues, extra)
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return "\n".join(lines)
+
+    def to_dict(self):
+        return {
+            "type": self.type,
+            "help": self.help,
+            "values": [
+                {
+                    "labels": dict(zip(self.labelnames, labelvalues, strict=True)),
+                    "value": value,
+                }
+                for labelvalues, value in self._export_values()
+            ],
+        }
+
+    def _items(self):
+        # a copy, values may be updated from another thread while they are exported
+        with self._lock:
+            return list(self._values.items())
+
+    def _export_values(self):
+        return self._items()
+
+
+class Counter(Metric):
+    type = "counter"  # noqa: A003
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def samples(self):
+        for labelvalues, value in self._items():
+            yield "_total", labelvalues, None, value
+
+
+class Gauge(Metric):
+    """Gauge set by the code, or read from a function when metrics are collected."""
+
+    type = "gauge"  # noqa: A003
+
+    def __init__(self, name, help_, labelnames=()):
+        super().__init__(name, help_, labelnames)
+        self._function = None
+
+    def set(self, value, **labels):  # noqa: A003
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, value=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def dec(self, value=1, **labels):
+        self.inc(-value, **labels)
+
+    def set_function(self, function):
+        """Reads the (unlabeled) value from `function` when the gauge is collected."""
+        self._function = function
+
+    def get(self, **labels):
+        if self._function is not None:
+            return self._function()
+        return self._values.get(self._key(labels), 0)
+
+    def _export_values(self):
+        if self._function is not None:
+            return [((), self._function())]
+        return self._items()
+
+    def samples(self):
+        for labelvalues, value in self._export_values():
+            yield "", labelvalues, None, value
+
+
+class _HistogramValue:
+    __slots__ = ("counts", "sum", "count")
+
+    def __init__(self, buckets_count):
+        self.counts = [0] * buckets_count
+        self.sum = 0
+        self.count = 0
+
+
+class Histogram(Metric):
+    type = "histogram"  # noqa: A003
+
+    def __init__(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        bucket = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            histogram_value = self._values.get(key)
+            if histogram_value is None:
+                histogram_value = self._values[key] = _HistogramValue(len(self.buckets))
+
+            # counts are kept per bucket and made cumulative on export
+            histogram_value.counts[bucket] += 1
+            histogram_value.sum += value
+            histogram_value.count += 1
+
+    def get(self, **labels):
+        """Returns `(count, sum)` of the observed values."""
+        with self._lock:
+            histogram_value = self._values.get(self._key(labels))
+            if histogram_value is None:
+                return 0, 0
+            return histogram_value.count, histogram_value.sum
+
+    def _items(self):
+        with self._lock:
+            items = []
+            for labelvalues, histogram_value in self._values.items():
+                copy = _HistogramValue(len(self.buckets))
+                copy.counts = list(histogram_value.counts)
+                copy.sum = histogram_value.sum
+                copy.count = histogram_value.count
+                items.append((labelvalues, copy))
+            return items
+
+    def _cumulative_counts(self, histogram_value):
+        cumulative = 0
+        for bound, count in zip(self.buckets, histogram_value.counts, strict=True):
+            cumulative += count
+            yield bound, cumulative
+
+    def _export_values(self):
+        for labelvalues, histogram_value in self._items():
+            yield labelvalues, {
+                "count": histogram_value.count,
+                "sum": histogram_value.sum,
+                "buckets": {
+                    _format_value(bound): count
+                    for bound, count in self._cumulative_counts(histogram_value)
+                },
+            }
+
+    def samples(self):
+        for labelvalues, histogram_value in self._items():
+            for bound, count in self._cumulative_counts(histogram_value):
+                yield "_bucket", labelvalues, ("le", _format_value(bound)), count
+            yield "_sum", labelvalues, None, histogram_value.sum
+            yield "_count", labelvalues, None, histogram_value.count
+
+
+class MetricsRegistry:
+    """Holds the metrics of the process, metrics are created on first use."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_or_create(self, klass, name, help_, labelnames, **kwargs):
+        with self._lock:
+            metric = self._metrics.get(name)
+            if metric is None:
+                metric = self._metrics[name] = klass(name, help_, labelnames, **kwargs)
+        if not isinstance(metric, klass):
+            msg = f"Metric {name} is already registered as a {metric.type}"
+            raise ValueError(msg)
+        return metric
+
+    def counter(self, name, help_, labelnames=()):
+        return self._get_or_create(Counter, name, help_, labelnames)
+
+    def gauge(self, name, help_, labelnames=()):
+        return self._get_or_create(Gauge, name, help_, labelnames)
+
+    def histogram(self, name, help_, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._get_or_create(Histogram, name, help_, labelnames, buckets=buckets)
+
+    def get(self, name):
+        return self._metrics.get(name)
+
+    def _all(self):
+        with self._lock:
+            return list(self._metrics.items())
+
+    def to_prometheus(self):
+        return "\n".join(metric.to_prometheus() for _, metric in self._all()) + "\n"
+
+    def to_dict(self):
+        return {name: metric.to_dict() for name, metric in self._all()}
+
+
+metrics = MetricsRegistry()
+
+
+class MetricsExporter:
+    """Exposes metrics on a local HTTP endpoint and/or dumps them to a file.
+
+    - with `port`, metrics are served in the Prometheus text format on `http://host:port/metrics`
+    - with `dump_path`, metrics are written as JSON to `dump_path` every `dump_interval` seconds
+      and when the exporter stops
+    """
+
+    def __init__(
+        self,
+        registry=metrics,
+        host=DEFAULT_METRICS_HOST,
+        port=None,
+        dump_path=None,
+        dump_interval=DEFAULT_METRICS_DUMP_INTERVAL,
+    ):
+        self.registry = registry
+        self.host = host
+        self.port = port
+        self.dump_path = dump_path
+        self.dump_interval = dump_interval
+        self._runner = None
+        self._dump_task = None
+
+    @classmethod
+    def from_config(cls, service_config):
+        return cls(
+            host=service_config.get("metrics_host", DEFAULT_METRICS_HOST),
+            port=service_config.get("metrics_port"),
+            dump_path=service_config.get("metrics_dump_path"),
+            dump_interval=service_config.get(
+                "metrics_dump_interval", DEFAULT_METRICS_DUMP_INTERVAL
+            ),
+        )
+
+    def enabled(self):
+        return self.port is not None or self.dump_path is not None
+
+    async def _handle_metrics(self, request):
+        from aiohttp import web
+
+        return web.Response(
+            text=self.registry.to_prometheus(),
+            content_type="text/plain",
+            headers={"X-Content-Type-Options": "nosniff"},
+        )
+
+    async def start(self):
+        if self.port is not None:
+            # aiohttp.web is only imported when the endpoint is enabled
+            from aiohttp import web
+
+            app = web.Application()
+            app.router.add_get("/metrics", self._handle_metrics)
+            self._runner = web.AppRunner(app, access_log=None)
+            await self._runner.setup()
+            await web.TCPSite(self._runner, self.host, self.port).start()
+
+        if self.dump_path is not None:
+            self._dump_task = asyncio.create_task(self._dump_periodically())
+
+    async def _dump_periodically(self):
+        while True:
+            await asyncio.sleep(self.dump_interval)
+            try:
+                # metrics are collected on the event loop, which updates them, and written in a thread
+                await asyncio.to_thread(self._write_dump, self._collect_dump())
+            except Exception as e:
+                # the next dump may succeed, f.e. once the disk has free space again
+                self._log_dump_error(e)
+
+    def _collect_dump(self):
+        return {"timestamp": time.time(), "metrics": self.registry.to_dict()}
+
+    def _write_dump(self, dump):
+        temp_path = f"{self.dump_path}.tmp"
+        with open(temp_path, "w") as f:
+            json.dump(dump, f)
+        # readers never see a partially written file
+        os.replace(temp_path, self.dump_path)
+
+    def _log_dump_error(self, error):
+        # imported here, as the logger module records its spans in `metrics`
+        from connectors.logger import logger
+
+        logger.error(f"Could not dump metrics to {self.dump_path}: {error}")
+
+    def dump(self):
+        """Writes the metrics as JSON to `dump_path`."""
+        self._write_dump(self._collect_dump())
+
+    async def stop(self):
+        if self._dump_task is not None:
+            self._dump_task.cancel()
+            self._dump_task = None
+            # the service is shutting down, a failed last dump must not hide why
+            try:
+                self.dump()
+            except Exception as e:
+                self._log_dump_error(e)
+
+        if self._runner is not None:
+            await self._runner.cleanup()
+            self._runner = None
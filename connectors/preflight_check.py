@@ -4,9 +4,12 @@
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
 
+from urllib.parse import urlsplit
+
 import aiohttp
 
 from connectors.es.management_client import ESManagementClient
+from connectors.http_client import http_client_registry
 from connectors.logger import logger
 from connectors.protocol import CONCRETE_CONNECTORS_INDEX, CONCRETE_JOBS_INDEX
 from connectors.utils import CancellableSleeps
@@ -63,12 +66,12 @@ class PreflightCheck:
             )
             return
 
-        timeout = aiohttp.ClientTimeout(total=5)
-        session = aiohttp.ClientSession(timeout=timeout)
+        host = self.extraction_config["host"]
+        session = http_client_registry.get_session(urlsplit(host).netloc)
 
         try:
             async with session.get(
-                f"{self.extraction_config['host']}/ping/"
+                f"{host}/ping/", timeout=aiohttp.ClientTimeout(total=5)
             ) as response:
                 if response.status != 200:
                     logger.warning(
@@ -87,7 +90,7 @@ class PreflightCheck:
                 f"Unexpected error occurred while attempting to connect to data extraction service at {self.extraction_config['host']}. {e}."
             )
         finally:
-            await session.close()
+            await http_client_registry.release_session(session)
 
     async def _check_system_indices_with_retries(self):
         attempts = 0
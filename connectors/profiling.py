@@ -0,0 +1,204 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+"""
+Per sync job profiling.
+
+`SyncJobProfiler` samples the stacks of the tasks of one sync job and traces the
+memory allocated while it runs, without profiling the rest of the service:
+
+- stacks are sampled from a thread every `interval` seconds, only when the task
+  running on the event loop was created, directly or not, by the profiled job. They
+  are written in the collapsed format of flame graph tools, to `<job id>.collapsed`
+- allocations are traced with `tracemalloc`, which is process wide: the sites that
+  allocated the most memory while the job ran, including by concurrent jobs, are
+  written to `<job id>.allocations.txt`
+"""
+import asyncio
+import contextvars
+import os
+import sys
+import tempfile
+import threading
+import tracemalloc
+import weakref
+from collections import Counter
+
+from connectors.logger import logger
+
+DEFAULT_PROFILING_INTERVAL = 0.005
+DEFAULT_TOP_ALLOCATIONS = 50
+
+ASYNCIO_EVENTS_FILE = asyncio.events.__file__
+
+# the profiler of the job the current task belongs to, inherited by the tasks it creates
+_current_profiler = contextvars.ContextVar("current_profiler", default=None)
+
+# number of running profilers, when tracemalloc was started by them
+_tracemalloc_users = 0
+
+
+def _profiled_task_factory(loop, coro, _parent_factory=None, **kwargs):
+    if _parent_factory is not None:
+        task = _parent_factory(loop, coro, **kwargs)
+    else:
+        task = asyncio.Task(coro, loop=loop, **kwargs)
+
+    profiler = _current_profiler.get()
+    if profiler is not None:
+        profiler.add_task(task)
+    return task
+
+
+def _install_task_factory(loop):
+    factory = loop.get_task_factory()
+    if getattr(factory, "profiling", False):
+        return
+
+    def _factory(loop, coro, **kwargs):
+        return _profiled_task_factory(loop, coro, _parent_factory=factory, **kwargs)
+
+    _factory.profiling = True
+    loop.set_task_factory(_factory)
+
+
+def _collapse(frame):
+    """Returns the stack ending at `frame` as `outer;...;inner`, without the event loop frames running the task."""
+    frames = []
+    while frame is not None:
+        frames.append(frame)
+        frame = frame.f_back
+    frames.reverse()
+
+    # the task runs from `Handle._run`, in asyncio/events.py
+    start = 0
+    for i, frame in enumerate(frames):
+        if frame.f_code.co_filename == ASYNCIO_EVENTS_FILE:
+            start = i + 1
+
+    return ";".join(
+        f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})"
+        for frame in frames[start:]
+    )
+
+
+def _start_tracemalloc():
+    global _tracemalloc_users
+    if _tracemalloc_users > 0:
+        _tracemalloc_users += 1
+    elif not tracemalloc.is_tracing():
+        tracemalloc.start()
+        _tracemalloc_users = 1
+
+
+def _stop_tracemalloc():
+    global _tracemalloc_users
+    if _tracemalloc_users > 0:
+        _tracemalloc_users -= 1
+        if _tracemalloc_users == 0:
+            tracemalloc.stop()
+
+
+class SyncJobProfiler:
+    """Profiles the tasks of a sync job, see the module docstring."""
+
+    def __init__(
+        self,
+        job_id,
+        output_dir=None,
+        interval=DEFAULT_PROFILING_INTERVAL,
+        top_allocations=DEFAULT_TOP_ALLOCATIONS,
+    ):
+        self.job_id = job_id
+        self.output_dir = output_dir or tempfile.gettempdir()
+        self.interval = interval
+        self.top_allocations = top_allocations
+        self.stacks = Counter()
+        self.samples = 0
+        self.running = False
+        self._tasks = weakref.WeakSet()
+        self._loop = None
+        self._loop_thread_id = None
+        self._sampler = None
+        self._stopped = threading.Event()
+        self._snapshot = None
+        self._context_token = None
+
+    @classmethod
+    def from_config(cls, job_id, service_config):
+        return cls(
+            job_id,
+            output_dir=service_config.get("profiling_dir"),
+            interval=service_config.get(
+                "profiling_interval", DEFAULT_PROFILING_INTERVAL
+            ),
+        )
+
+    def add_task(self, task):
+        self._tasks.add(task)
+
+    def start(self):
+        """Starts profiling the current task and the tasks it creates from now on."""
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread_id = threading.get_ident()
+        _install_task_factory(self._loop)
+        self.add_task(asyncio.current_task())
+        self._context_token = _current_profiler.set(self)
+
+        _start_tracemalloc()
+        self._snapshot = tracemalloc.take_snapshot()
+
+        self.running = True
+        self._sampler = threading.Thread(
+            target=self._sample, name=f"profiler-{self.job_id}", daemon=True
+        )
+        self._sampler.start()
+
+    def _sample(self):
+        while not self._stopped.wait(self.interval):
+            task = asyncio.current_task(self._loop)
+            if task is None or task not in self._tasks:
+                continue
+            frame = sys._current_frames().get(self._loop_thread_id)
+            if frame is None:
+                continue
+            self.stacks[_collapse(frame)] += 1
+            self.samples += 1
+
+    async def stop(self):
+        """Stops profiling and writes the profile, returns the paths of the files written."""
+        if not self.running:
+            return None
+        self.running = False
+
+        self._stopped.set()
+        await asyncio.to_thread(self._sampler.join)
+        _current_profiler.reset(self._context_token)
+
+        profile = {
+            "stacks": os.path.join(self.output_dir, f"{self.job_id}.collapsed"),
+            "allocations": os.path.join(
+                self.output_dir, f"{self.job_id}.allocations.txt"
+            ),
+        }
+        try:
+            # comparing snapshots takes a while with many allocation sites
+            await asyncio.to_thread(self._write, profile)
+        finally:
+            _stop_tracemalloc()
+        logger.info(
+            f"Profile of sync job {self.job_id} ({self.samples} samples) written to {profile}"
+        )
+        return profile
+
+    def _write(self, profile):
+        allocations = tracemalloc.take_snapshot().compare_to(self._snapshot, "lineno")
+        os.makedirs(self.output_dir, exist_ok=True)
+        with open(profile["stacks"], "w") as f:
+            for stack, count in self.stacks.most_common():
+                f.write(f"{stack} {count}\n")
+        with open(profile["allocations"], "w") as f:
+            for statistic in allocations[: self.top_allocations]:
+                f.write(f"{statistic}\n")
@@ -295,6 +295,10 @@ class SyncJob(ESDocument):
     def job_type(self):
         return JobType(self.get("job_type"))
 
+    @property
+    def profile(self):
+        return self.get("profile", default=False)
+
     def is_content_sync(self):
         return self.job_type in (JobType.FULL, JobType.INCREMENTAL)
 
@@ -626,6 +630,10 @@ class Connector(ESDocument):
     def sync_cursor(self):
         return self.get("sync_cursor")
 
+    @property
+    def profile_syncs(self):
+        return self.get("profile_syncs", default=False)
+
     @property
     def api_key_secret_id(self):
         return self.get("api_key_secret_id")
@@ -23,7 +23,10 @@ from click import ClickException, UsageError
 from connectors import __version__
 from connectors.config import load_config
 from connectors.content_extraction import ContentExtraction
-from connectors.logger import logger, set_logger
+from connectors.file_sink import ELASTICSEARCH_SINK, FILE_SINK
+from connectors.http_client import http_client_registry
+from connectors.logger import DEFAULT_LOG_QUEUE_SIZE, logger, set_logger
+from connectors.metrics import MetricsExporter
 from connectors.preflight_check import PreflightCheck
 from connectors.services import get_services
 from connectors.source import get_source_klass, get_source_klasses
@@ -39,7 +42,22 @@ async def _start_service(actions, config, loop):
     Steps:
     - performs a preflight check using `PreflightCheck`
     - instantiates a `MultiService` instance and runs its `run` async function
+    - exports metrics, if `service.metrics_port` or `service.metrics_dump_path` is set
+    - closes the shared HTTP connection pool once the service stops
     """
+    metrics_exporter = MetricsExporter.from_config(config["service"])
+    if metrics_exporter.enabled():
+        await metrics_exporter.start()
+    try:
+        return await _run_service(actions, config, loop)
+    finally:
+        if metrics_exporter.enabled():
+            await metrics_exporter.stop()
+        await http_client_registry.close()
+        logger.info(f"HTTP connection pool stats: {http_client_registry.stats()}")
+
+
+async def _run_service(actions, config, loop):
     preflight = PreflightCheck(config)
     for sig in (signal.SIGINT, signal.SIGTERM):
         loop.add_signal_handler(sig, functools.partial(preflight.shutdown, sig))
@@ -90,7 +108,7 @@ def get_event_loop(uvloop=False):
     return loop
 
 
-def run(action, config_file, log_level, filebeat, service_type, uvloop):
+def run(action, config_file, log_level, filebeat, service_type, uvloop, sink=None):
     """Loads the config file, sets the logger and executes an action.
 
     Actions:
@@ -106,6 +124,9 @@ def run(action, config_file, log_level, filebeat, service_type, uvloop):
         ContentExtraction.set_extraction_config(
             config.get("extraction_service", None)
         )  # Not perfect, let's revisit
+        http_client_registry.configure(config["service"])
+        if sink is not None:
+            config["service"]["sink"] = sink
     except Exception as e:
         # If something goes wrong while parsing config file, we still want
         # to set up the logger so that Cloud deployments report errors to
@@ -119,6 +140,7 @@ def run(action, config_file, log_level, filebeat, service_type, uvloop):
     set_logger(
         log_level or config["service"]["log_level"] or logging.INFO,
         filebeat=filebeat,
+        queue_size=config["service"].get("log_queue_size", DEFAULT_LOG_QUEUE_SIZE),
     )
 
     # just display the list of connectors
@@ -213,10 +235,16 @@ def run(action, config_file, log_level, filebeat, service_type, uvloop):
     help="Service type to get default configuration for if action is config.",
 )
 @click.option("--uvloop", is_flag=True, default=False, help="Use uvloop if possible.")
-def main(action, config_file, log_level, filebeat, service_type, uvloop):
+@click.option(
+    "--sink",
+    type=click.Choice([ELASTICSEARCH_SINK, FILE_SINK], case_sensitive=False),
+    default=None,
+    help="Where sync jobs write documents to, overrides `service.sink`.",
+)
+def main(action, config_file, log_level, filebeat, service_type, uvloop, sink):
     """Entry point to the service, responsible for all operations.
 
     Parses the arguments and calls `run` with them.
     """
 
-    return run(action, config_file, log_level, filebeat, service_type, uvloop)
+    return run(action, config_file, log_level, filebeat, service_type, uvloop, sink)
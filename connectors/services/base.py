@@ -15,6 +15,7 @@ import time
 from copy import deepcopy
 
 from connectors.logger import DocumentLogger, logger
+from connectors.loop_monitor import LoopMonitor
 from connectors.utils import CancellableSleeps
 
 __all__ = [
@@ -36,9 +37,18 @@ _SERVICES = {}
 def get_services(names, config):
     """Instantiates a list of services given their names and a config.
 
-    returns a `MultiService` instance.
+    returns a `MultiService` instance, monitoring the event loop if
+    `service.loop_monitor_enabled` is set.
     """
-    return MultiService(*[get_service(name, config) for name in names])
+    service_config = config["service"]
+    loop_monitor = (
+        LoopMonitor.from_config(service_config)
+        if service_config.get("loop_monitor_enabled", False)
+        else None
+    )
+    return MultiService(
+        *[get_service(name, config) for name in names], loop_monitor=loop_monitor
+    )
 
 
 def get_service(name, config):
@@ -165,21 +175,31 @@ class BaseService(metaclass=_Registry):
 class MultiService:
     """Wrapper class to run multiple services against the same config."""
 
-    def __init__(self, *services):
+    def __init__(self, *services, loop_monitor=None):
         self._services = services
+        self._loop_monitor = loop_monitor
 
     async def run(self):
         """Runs every service in a task and wait for all tasks."""
-        tasks = [asyncio.create_task(service.run()) for service in self._services]
+        if self._loop_monitor is not None:
+            self._loop_monitor.start()
 
-        done, pending = await asyncio.wait(tasks, return_when=asyncio.FIRST_EXCEPTION)
-
-        for task in pending:
-            task.cancel()
-            try:
-                await task
-            except asyncio.CancelledError:
-                logger.error("Service did not handle cancellation gracefully.")
+        try:
+            tasks = [asyncio.create_task(service.run()) for service in self._services]
+
+            done, pending = await asyncio.wait(
+                tasks, return_when=asyncio.FIRST_EXCEPTION
+            )
+
+            for task in pending:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    logger.error("Service did not handle cancellation gracefully.")
+        finally:
+            if self._loop_monitor is not None:
+                await self._loop_monitor.stop()
 
     def shutdown(self, sig):
         logger.info(f"Caught {sig}. Graceful shutdown.")
@@ -7,8 +7,12 @@
 """
 
 import asyncio
+import base64
+import hashlib
 import importlib
+import os
 import re
+import tempfile
 from contextlib import asynccontextmanager
 from datetime import date, datetime
 from decimal import Decimal
@@ -22,9 +26,11 @@ from aiofiles.tempfile import NamedTemporaryFile
 from bson import Decimal128
 
 from connectors.config import DataSourceFrameworkConfig
-from connectors.content_extraction import ContentExtraction
+from connectors.content_extraction import ContentExtraction, PlainTextExtraction
+from connectors.filtering.basic_rule import parse
 from connectors.filtering.validation import (
     BasicRuleAgainstSchemaValidator,
+    BasicRuleNoCatastrophicBacktrackingValidator,
     BasicRuleNoMatchAllRegexValidator,
     BasicRulesSetSemanticValidator,
     FilteringValidator,
@@ -32,7 +38,8 @@ from connectors.filtering.validation import (
 from connectors.logger import logger
 from connectors.utils import (
     TIKA_SUPPORTED_FILETYPES,
-    convert_to_b64,
+    Format,
+    encode_file_to_b64,
     epoch_timestamp_zulu,
     get_file_extension,
     hash_id,
@@ -376,6 +383,54 @@ class DataSourceConfiguration:
         return True
 
 
+class SpooledTempFile:
+    """Write-only file buffer kept in memory until it grows over `max_size` bytes.
+
+    Over `max_size` the buffered data is written to a named temporary file and following
+    writes go to disk. Small files this way never touch the filesystem.
+    """
+
+    def __init__(self, max_size, suffix=None, dir_=None):
+        self.max_size = max_size
+        self.suffix = suffix
+        self.dir = dir_
+        self.name = None
+        self._chunks = []
+        self._size = 0
+        self._file = None
+
+    def in_memory(self):
+        return self.name is None
+
+    def getvalue(self):
+        return b"".join(self._chunks)
+
+    def size(self):
+        return self._size
+
+    async def write(self, data):
+        if self._file is None and self._size + len(data) > self.max_size:
+            await self._rollover()
+
+        if self._file is not None:
+            await self._file.write(data)
+        else:
+            self._chunks.append(data)
+        self._size += len(data)
+
+    async def _rollover(self):
+        fd, self.name = tempfile.mkstemp(suffix=self.suffix, dir=self.dir)
+        os.close(fd)
+        self._file = await aiofiles.open(self.name, "wb")
+        for chunk in self._chunks:
+            await self._file.write(chunk)
+        self._chunks = []
+
+    async def close(self):
+        if self._file is not None:
+            await self._file.close()
+
+
 class BaseDataSource:
     """Base class, defines a loose contract."""
 
@@ -399,6 +454,8 @@ class BaseDataSource:
         self._features = None
         # A dictionary, the structure of which is connector dependent, to indicate a point where the sync is at
         self._sync_cursor = None
+        # Basic rules applied by the remote system, see push_down_basic_rules()
+        self.pushed_down_basic_rules = []
 
         if self.configuration.get("use_text_extraction_service"):
             self.extraction_service = ContentExtraction()
@@ -406,6 +463,7 @@ class BaseDataSource:
         else:
             self.extraction_service = None
             self.download_dir = None
+        self.plain_text_extraction = PlainTextExtraction()
 
         # this will be overwritten by set_framework_config()
         self.framework_config = DataSourceFrameworkConfig.Builder().build()
@@ -459,6 +517,7 @@ class BaseDataSource:
         return [
             BasicRuleAgainstSchemaValidator,
             BasicRuleNoMatchAllRegexValidator,
+            BasicRuleNoCatastrophicBacktrackingValidator,
             BasicRulesSetSemanticValidator,
         ]
 
@@ -511,6 +570,48 @@ class BaseDataSource:
             self._logger,
         ).validate(filtering)
 
+    def can_push_down_basic_rule(self, basic_rule):
+        """Return `True`, if the basic rule can be translated into a query of the remote system.
+
+        A pushed down rule must exclude exactly the documents the basic rule would match.
+        This method can be overridden by data sources supporting a query language, no rules are pushed down by default.
+        """
+        return False
+
+    def push_down_basic_rules(self, filter_):
+        """Hand the basic rules the remote system can apply over to the data source.
+
+        Basic rules are applied in order and the first matching one wins, so only the leading `EXCLUDE` rules
+        accepted by `can_push_down_basic_rule` are pushed down: a document matching one of them is excluded
+        no matter what comes next. They are stored in `pushed_down_basic_rules` to be used in `get_docs`.
+
+        Returns a copy of `filter_` with the remaining basic rules, which still have to be evaluated by the framework.
+        """
+        pushed_down_basic_rules = []
+        for basic_rule in parse(filter_.basic_rules):
+            if basic_rule.is_include() or not self.can_push_down_basic_rule(basic_rule):
+                break
+            pushed_down_basic_rules.append(basic_rule)
+
+        self.pushed_down_basic_rules = pushed_down_basic_rules
+        if not pushed_down_basic_rules:
+            return filter_
+
+        self._logger.info(
+            f"Pushing down {len(pushed_down_basic_rules)} basic rule(s) to {self.__class__.name}: {', '.join(format(rule, Format.SHORT.value) for rule in pushed_down_basic_rules)}"
+        )
+        pushed_down_ids = {basic_rule.id_ for basic_rule in pushed_down_basic_rules}
+        return type(filter_)(
+            {
+                **filter_,
+                "rules": [
+                    basic_rule
+                    for basic_rule in filter_.basic_rules
+                    if basic_rule["id"] not in pushed_down_ids
+                ],
+            }
+        )
+
     def advanced_rules_validators(self):
         """Return advanced rule validators.
 
@@ -754,19 +855,33 @@ class BaseDataSource:
         will return the original doc upon failure
         """
         try:
-            async with self.create_temp_file(file_extension) as async_buffer:
-                temp_filename = async_buffer.name
-
-                await self.download_to_temp_file(
-                    temp_filename,
+            async with self.create_spooled_temp_file(file_extension) as async_buffer:
+                content_hash = await self.download_to_temp_file(
+                    async_buffer.name,
                     source_filename,
                     async_buffer,
                     download_func,
                 )
 
-                doc = await self.handle_file_content_extraction(
-                    doc, source_filename, temp_filename
-                )
+                if await self.handle_plain_text_extraction(
+                    doc, file_extension, async_buffer
+                ):
+                    self._logger.debug(
+                        lambda: f"Extracted plain text of {source_filename}"
+                    )
+                elif async_buffer.size() == 0 and self.configuration.get(
+                    "use_text_extraction_service"
+                ):
+                    # an empty file has no text, the extraction service is not called
+                    doc["body"] = ""
+                elif async_buffer.in_memory():
+                    doc = await self.handle_content_extraction_in_memory(
+                        doc, source_filename, async_buffer.getvalue(), content_hash
+                    )
+                else:
+                    doc = await self.handle_file_content_extraction(
+                        doc, source_filename, async_buffer.name, content_hash
+                    )
             return doc
         except Exception as e:
             self._logger.warning(
@@ -791,17 +906,50 @@ class BaseDataSource:
             await async_buffer.close()
             await self.remove_temp_file(temp_filename)
 
+    @asynccontextmanager
+    async def create_spooled_temp_file(self, file_extension):
+        """Like `create_temp_file`, but files up to `max_in_memory_file_size` bytes are kept in memory.
+
+        The extraction service reads files from the shared volume when it uses file pointers,
+        so downloads always go to disk then.
+        """
+        max_size = (
+            0
+            if self.download_dir is not None
+            else self.framework_config.max_in_memory_file_size
+        )
+        async_buffer = SpooledTempFile(
+            max_size, suffix=file_extension, dir_=self.download_dir
+        )
+        try:
+            yield async_buffer
+        finally:
+            await async_buffer.close()
+            if not async_buffer.in_memory():
+                await self.remove_temp_file(async_buffer.name)
+
     async def download_to_temp_file(
         self, temp_filename, source_filename, async_buffer, chunked_download_func
     ):
-        self._logger.debug(f"Download beginning for file: {source_filename}.")
+        """Writes the downloaded chunks to the temp file.
+
+        Returns the sha256 hex digest of the content if the extraction service is used, `None` otherwise.
+        """
+        # the extraction service caches extracted text by content hash
+        content_hash = hashlib.sha256() if self.extraction_service is not None else None
+
+        self._logger.debug(lambda: f"Download beginning for file: {source_filename}.")
         async for data in chunked_download_func():
+            if content_hash is not None:
+                content_hash.update(data)
             await async_buffer.write(data)
 
-        self._logger.debug(f"Download completed for file: {source_filename}.")
+        self._logger.debug(lambda: f"Download completed for file: {source_filename}.")
         # close tempfile here so file content is accessible within async context
         await async_buffer.close()
 
+        return None if content_hash is None else content_hash.hexdigest()
+
     async def generic_chunked_download_func(self, download_func):
         """
         This provides a wrapper for chunked download funcs that
@@ -812,10 +960,13 @@ class BaseDataSource:
             async for data in response.content.iter_chunked(CHUNK_SIZE):
                 yield data
 
-    async def handle_file_content_extraction(self, doc, source_filename, temp_filename):
+    async def handle_file_content_extraction(
+        self, doc, source_filename, temp_filename, content_hash=None
+    ):
         """
         Determines if file content should be extracted locally,
         or converted to b64 for pipeline extraction.
+        `content_hash` lets the extraction service reuse the text of identical files.
 
         Returns the `doc` arg with a new field:
             - `body` if local content extraction was used
@@ -824,14 +975,62 @@ class BaseDataSource:
         if self.configuration.get("use_text_extraction_service"):
             if self.extraction_service._check_configured():
                 doc["body"] = await self.extraction_service.extract_text(
-                    temp_filename, source_filename
+                    temp_filename, source_filename, content_hash=content_hash
+                )
+        else:
+            self._logger.debug(lambda: f"Encoding file to base64: {source_filename}")
+            doc["_attachment"] = await asyncio.to_thread(
+                encode_file_to_b64, temp_filename
+            )
+
+        return doc
+
+    async def handle_plain_text_extraction(self, doc, file_extension, async_buffer):
+        """
+        Extracts the text of plain text formats locally into the `body` field of `doc`,
+        without the extraction service or the ingest pipeline.
+
+        Returns `True` if the text was extracted.
+        """
+        if not (
+            self.framework_config.plain_text_extraction
+            and self.plain_text_extraction.can_extract(
+                file_extension, async_buffer.size()
+            )
+        ):
+            return False
+
+        if async_buffer.in_memory():
+            text = await self.plain_text_extraction.extract_text(
+                file_extension, content=async_buffer.getvalue()
+            )
+        else:
+            text = await self.plain_text_extraction.extract_text(
+                file_extension, filepath=async_buffer.name
+            )
+
+        if text is None:
+            return False
+
+        doc["body"] = text
+        return True
+
+    async def handle_content_extraction_in_memory(
+        self, doc, source_filename, content, content_hash=None
+    ):
+        """
+        Same as `handle_file_content_extraction` for file content kept in memory.
+        """
+        if self.configuration.get("use_text_extraction_service"):
+            if self.extraction_service._check_configured():
+                doc["body"] = await self.extraction_service.extract_text(
+                    None, source_filename, content_hash=content_hash, data=content
                 )
         else:
-            self._logger.debug(f"Calling convert_to_b64 for file : {source_filename}")
-            await asyncio.to_thread(convert_to_b64, source=temp_filename)
-            async with aiofiles.open(file=temp_filename, mode="r") as async_buffer:
-                # base64 on macOS will add a EOL, so we strip() here
-                doc["_attachment"] = (await async_buffer.read()).strip()
+            self._logger.debug(lambda: f"Encoding file to base64: {source_filename}")
+            doc["_attachment"] = await asyncio.to_thread(
+                lambda: base64.b64encode(content).decode()
+            )
 
         return doc
 
@@ -1,9 +1,17 @@
+import asyncio
+import json
+import math
+from collections import deque
+from functools import partial
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
 import aiohttp
-from aiohttp.client_exceptions import ServerDisconnectedError
 
+from connectors.filtering.basic_rule import Rule
+from connectors.http_client import http_client_registry
 from connectors.logger import logger
 from connectors.source import BaseDataSource, ConfigurableFieldValueError
-from connectors.utils import CancellableSleeps, iso_utc
+from connectors.utils import CancellableSleeps, Counters, iso_utc
 
 WILDCARD = "*"
 BLOB = "blob"
@@ -15,10 +23,16 @@ SELECTED_WORKSPACES = "selected_workspaces"
 
 PING_URL = "https://api.bitbucket.org/2.0/user"
 BASE_URL = "https://api.bitbucket.org/2.0/"
-PAGELEN = "?pagelen=100"
+PAGELEN = 100
+# Bitbucket rejects pull request listings with a `pagelen` above 50
+PULL_REQUEST_PAGELEN = 50
 
 RETRIES = 3
 RETRY_INTERVAL = 2
+PREFETCH_PAGES = 5
+# levels of nested directories returned by a single `src` listing
+SRC_MAX_DEPTH = 3
+CONCURRENT_DIRECTORY_LISTINGS = 5
 
 PULL_REQUEST_SCHEMA = {
     "_id": "id",
@@ -35,6 +49,48 @@ COMMIT_SCHEMA = {
     "message": "message",
 }
 
+PAGINATION_FIELDS = ["next", "page", "pagelen", "size"]
+COMMIT_EXTRA_FIELDS = ["repository.full_name", "author.user.display_name"]
+FILE_FIELDS = ["path", "type", "size", "mimetype", "links.self.href"]
+COMMIT_DIRECTORY = "commit_directory"
+
+BYTES_RECEIVED = "bytes_received"
+DOCUMENTS_FETCHED = "documents_fetched"
+
+
+def fields_projection(schema=None, extra_fields=None):
+    """Builds the value of a Bitbucket `fields=` query parameter.
+
+    Only the pagination fields and the fields of each listed value referenced by
+    `schema` and `extra_fields` are returned by the API.
+    """
+    value_fields = list((schema or {}).values()) + list(extra_fields or [])
+    return ",".join(PAGINATION_FIELDS + [f"values.{field}" for field in value_fields])
+
+
+def set_query_params(url, **params):
+    scheme, netloc, path, query, fragment = urlsplit(url)
+    query_params = dict(parse_qsl(query))
+    query_params.update({key: str(value) for key, value in params.items()})
+    return urlunsplit(
+        (scheme, netloc, path, urlencode(query_params, safe=","), fragment)
+    )
+
+
+def bbql_string(value):
+    """Quotes a value for Bitbucket's query language (used by the `q` query parameter)."""
+    escaped = str(value).replace("\\", "\\\\").replace('"', '\\"')
+    return f'"{escaped}"'
+
+
+def listing_url(path, fields, pagelen=PAGELEN):
+    return set_query_params(f"{BASE_URL}{path}", pagelen=pagelen, fields=fields)
+
+
+COMMIT_FIELDS = fields_projection(COMMIT_SCHEMA, COMMIT_EXTRA_FIELDS)
+PULL_REQUEST_FIELDS = fields_projection(PULL_REQUEST_SCHEMA)
+FILE_LISTING_FIELDS = fields_projection(extra_fields=FILE_FIELDS)
+
 
 class BitBucketClient:
     def __init__(self, configuration) -> None:
@@ -43,6 +99,8 @@ class BitBucketClient:
         self._logger = logger
         self.data_source_type = self.configuration["data_source"]
         self.retry_count = self.configuration["retry_count"]
+        self.prefetch_pages = PREFETCH_PAGES
+        self.counters = Counters()
         self.session = None
 
     def _get_session(self):
@@ -56,7 +114,8 @@ class BitBucketClient:
 
         basic_auth = aiohttp.BasicAuth(login=auth[0], password=auth[1])
         timeout = aiohttp.ClientTimeout(total=None)  # pyright: ignore
-        self.session = aiohttp.ClientSession(
+        self.session = http_client_registry.get_session(
+            urlsplit(BASE_URL).netloc,
             auth=basic_auth,
             headers={
                 "accept": "application/json",
@@ -67,6 +126,14 @@ class BitBucketClient:
         )
         return self.session
 
+    async def close(self):
+        self._sleeps.cancel()
+        if self.session is None:
+            return
+
+        await http_client_registry.release_session(self.session)
+        self.session = None
+
     async def api_call(self, url):
         retry_counter = 0
         while True:
@@ -77,11 +144,8 @@ class BitBucketClient:
                     yield response
                     break
             except Exception as exception:
-                if isinstance(
-                    exception,
-                    ServerDisconnectedError,
-                ):
-                    await self.session.close()  # pyright: ignore
+                # on ServerDisconnectedError the shared pool drops the broken
+                # connection, the next attempt picks a fresh one
                 retry_counter += 1
                 if retry_counter > self.retry_count:
                     raise exception
@@ -90,23 +154,102 @@ class BitBucketClient:
                 )
                 await self._sleeps.sleep(RETRY_INTERVAL**retry_counter)
 
-    async def paginated_api_call(self, url):
-        while True:
+    async def _get_json(self, url):
+        json_response = None
+        async for response in self.api_call(url=url):
+            body = await response.read()
+            self.counters.increment(BYTES_RECEIVED, len(body))
+            json_response = json.loads(body)
+        return json_response
+
+    def _remaining_page_urls(self, url, json_response):
+        """Computes the URLs of the pages left after `json_response`.
+
+        Returns None if the response doesn't expose `size`, `page` and `pagelen`,
+        in which case the pages can only be discovered by following `next` links.
+        """
+        size = json_response.get("size")
+        page = json_response.get("page")
+        pagelen = json_response.get("pagelen")
+        if not all(isinstance(value, int) for value in (size, page, pagelen)):
+            return None
+        if pagelen <= 0:
+            return None
+
+        total_pages = math.ceil(size / pagelen)
+        return [
+            set_query_params(url, page=number)
+            for number in range(page + 1, total_pages + 1)
+        ]
+
+    async def _walk_next_links(self, url):
+        while url is not None:
             try:
-                async for response in self.api_call(
-                    url=url,
-                ):
-                    json_response = await response.json()
-                    next_page_url = json_response.get("next")
-                    yield json_response
-                    if next_page_url is None:
-                        return
-                    url = next_page_url
+                json_response = await self._get_json(url=url)
             except Exception as exception:
                 self._logger.warning(
                     f"Skipping data from {url}. Exception: {exception}."
                 )
-                break
+                return
+            yield json_response
+            url = json_response.get("next")
+
+    async def _prefetch_pages(self, page_urls):
+        """Fetches up to `prefetch_pages` pages concurrently and yields them in order."""
+        page_urls = iter(page_urls)
+        pending = deque()
+
+        def _schedule_next_page():
+            page_url = next(page_urls, None)
+            if page_url is not None:
+                pending.append(
+                    (page_url, asyncio.create_task(self._get_json(url=page_url)))
+                )
+
+        try:
+            for _ in range(self.prefetch_pages):
+                _schedule_next_page()
+
+            while pending:
+                page_url, task = pending.popleft()
+                try:
+                    json_response = await task
+                except Exception as exception:
+                    self._logger.warning(
+                        f"Skipping data from {page_url}. Exception: {exception}."
+                    )
+                    return
+                _schedule_next_page()
+                yield json_response
+        finally:
+            for _, task in pending:
+                task.cancel()
+
+    async def paginated_api_call(self, url):
+        """Yields every page of a listing endpoint.
+
+        When the first page reports the total `size`, the remaining pages are requested
+        with an explicit `page=` parameter and prefetched concurrently. Otherwise the
+        `next` links are followed one page at a time.
+        """
+        try:
+            json_response = await self._get_json(url=url)
+        except Exception as exception:
+            self._logger.warning(f"Skipping data from {url}. Exception: {exception}.")
+            return
+        yield json_response
+
+        next_page_url = json_response.get("next")
+        if next_page_url is None:
+            return
+
+        page_urls = self._remaining_page_urls(url, json_response)
+        if page_urls is None:
+            async for json_response in self._walk_next_links(next_page_url):
+                yield json_response
+        else:
+            async for json_response in self._prefetch_pages(page_urls):
+                yield json_response
 
 
 class BitBucketDataSource(BaseDataSource):
@@ -118,6 +261,9 @@ class BitBucketDataSource(BaseDataSource):
         self.repositories = self.configuration["repositories"]
         self.bitbucket_client = BitBucketClient(configuration=configuration)
 
+    async def close(self):
+        await self.bitbucket_client.close()
+
     @classmethod
     def get_default_configuration(cls):
         return {
@@ -161,6 +307,24 @@ class BitBucketDataSource(BaseDataSource):
                 "type": "int",
                 "ui_restrictions": ["advanced"],
             },
+            "max_tree_depth": {
+                "display": "numeric",
+                "label": "Maximum directory depth of repository files",
+                "order": 6,
+                "required": False,
+                "tooltip": "Files nested deeper than this number of directories are skipped. Leave empty for no limit.",
+                "type": "int",
+                "ui_restrictions": ["advanced"],
+            },
+            "max_file_count": {
+                "display": "numeric",
+                "label": "Maximum number of files per repository",
+                "order": 7,
+                "required": False,
+                "tooltip": "Leave empty for no limit.",
+                "type": "int",
+                "ui_restrictions": ["advanced"],
+            },
         }
 
     async def ping(self):
@@ -184,7 +348,10 @@ class BitBucketDataSource(BaseDataSource):
             return
         repository_name_list = []
         async for response in self.bitbucket_client.paginated_api_call(
-            url=f"{BASE_URL}user/permissions/repositories"
+            url=listing_url(
+                "user/permissions/repositories",
+                fields=fields_projection(extra_fields=["repository.full_name"]),
+            )
         ):
             for repository in response.get("values", []):
                 repository_name = repository.get("repository", {}).get("full_name")
@@ -197,7 +364,9 @@ class BitBucketDataSource(BaseDataSource):
 
     async def _fetch_workspaces(self):
         async for response in self.bitbucket_client.paginated_api_call(
-            url=f"{BASE_URL}workspaces{PAGELEN}"
+            url=listing_url(
+                "workspaces", fields=fields_projection(extra_fields=["slug"])
+            )
         ):
             for workspace in response.get("values", []):
                 yield workspace["slug"]
@@ -211,7 +380,10 @@ class BitBucketDataSource(BaseDataSource):
     async def _fetch_repository_name(self):
         async for workspace_name in self._fetch_workspaces():
             async for response in self.bitbucket_client.paginated_api_call(
-                url=f"{BASE_URL}repositories/{workspace_name}{PAGELEN}"
+                url=listing_url(
+                    f"repositories/{workspace_name}",
+                    fields=fields_projection(extra_fields=["full_name"]),
+                )
             ):
                 for repository_data in response.get("values", []):
                     yield repository_data
@@ -220,7 +392,11 @@ class BitBucketDataSource(BaseDataSource):
         if self.repositories == [WILDCARD]:
             async for repository_name in self._fetch_repository_name():
                 async for response in self.bitbucket_client.paginated_api_call(
-                    url=f'{BASE_URL}repositories/{repository_name.get("full_name")}/pullrequests'
+                    url=listing_url(
+                        f'repositories/{repository_name.get("full_name")}/pullrequests',
+                        fields=PULL_REQUEST_FIELDS,
+                        pagelen=PULL_REQUEST_PAGELEN,
+                    )
                 ):
                     for pull_request_data in response.get("values", []):
                         yield self._prepare_pull_request_doc(
@@ -229,7 +405,11 @@ class BitBucketDataSource(BaseDataSource):
         else:
             for repository_name in self.repositories:
                 async for response in self.bitbucket_client.paginated_api_call(
-                    url=f"{BASE_URL}repositories/{repository_name}/pullrequests"
+                    url=listing_url(
+                        f"repositories/{repository_name}/pullrequests",
+                        fields=PULL_REQUEST_FIELDS,
+                        pagelen=PULL_REQUEST_PAGELEN,
+                    )
                 ):
                     for pull_request_data in response.get("values", []):
                         yield self._prepare_pull_request_doc(
@@ -255,7 +435,10 @@ class BitBucketDataSource(BaseDataSource):
         if self.repositories == [WILDCARD]:
             async for repository_name in self._fetch_repository_name():
                 async for commit_data in self.bitbucket_client.paginated_api_call(
-                    url=f"{BASE_URL}repositories/{repository_name}/commits"
+                    url=listing_url(
+                        f'repositories/{repository_name.get("full_name")}/commits',
+                        fields=COMMIT_FIELDS,
+                    )
                 ):
                     for commit in commit_data.get("values", []):
                         yield self._prepare_commit_doc(commit, COMMIT_SCHEMA)
@@ -263,57 +446,186 @@ class BitBucketDataSource(BaseDataSource):
         else:
             for repository_name in self.repositories:
                 async for commit_data in self.bitbucket_client.paginated_api_call(
-                    url=f"{BASE_URL}repositories/{repository_name}/commits"
+                    url=listing_url(
+                        f"repositories/{repository_name}/commits", fields=COMMIT_FIELDS
+                    )
                 ):
                     for commit in commit_data.get("values", []):
                         yield self._prepare_commit_doc(commit, COMMIT_SCHEMA)
 
-    def _prepare_file_doc(self, file_data):
+    def _prepare_file_doc(self, file_data, repository_name):
         return {
-            "_id": file_data.get("path"),
+            "_id": f'{repository_name}/{file_data.get("path")}',
             "_timestamp": iso_utc(),
             "type": file_data.get("type"),
+            "path": file_data.get("path"),
+            "repository_name": repository_name,
         }
 
-    async def _fetch_files_from_folder(self, folder):
+    async def get_content(self, file_data, document_id, timestamp=None, doit=False):
+        """Downloads the raw content of a repository file and extracts its text.
+
+        Args:
+            file_data (dict): `commit_file` entry of a `src` listing
+            document_id (str): id of the file document
+            timestamp (timestamp, optional): Timestamp of the file document. Defaults to None.
+            doit (boolean, optional): Boolean value for whether to get content or not. Defaults to False.
+
+        Returns:
+            dict: Document with the `_attachment` or `body` of the file
+        """
+        file_size = int(file_data.get("size") or 0)
+        if not (doit and file_size > 0):
+            return
+
+        filename = file_data["path"].rpartition("/")[2]
+        file_extension = self.get_file_extension(filename)
+        if not self.can_file_be_downloaded(file_extension, filename, file_size):
+            return
+
+        document = {"_id": document_id, "_timestamp": timestamp}
+        return await self.download_and_extract_file(
+            document,
+            filename,
+            file_extension,
+            partial(
+                self.generic_chunked_download_func,
+                partial(
+                    self.bitbucket_client.api_call,
+                    url=file_data.get("links", {}).get("self", {}).get("href"),
+                ),
+            ),
+        )
+
+    def can_push_down_basic_rule(self, basic_rule):
+        """Files excluded by their path are filtered out of the source tree listings."""
+        return basic_rule.field == "path" and basic_rule.rule == Rule.EQUALS
+
+    def _source_tree_query(self):
+        """Returns the `q` filter of the source tree listings for the pushed down basic rules.
+
+        Directories are always listed, as they aren't documents themselves.
+        """
+        if not self.pushed_down_basic_rules:
+            return None
+
+        excluded_paths = " AND ".join(
+            f"path != {bbql_string(basic_rule.value)}"
+            for basic_rule in self.pushed_down_basic_rules
+        )
+        return f'type = "{COMMIT_DIRECTORY}" OR ({excluded_paths})'
+
+    def _directory_url(self, url):
+        params = {
+            "pagelen": PAGELEN,
+            "fields": FILE_LISTING_FIELDS,
+            "max_depth": SRC_MAX_DEPTH,
+        }
+        if query := self._source_tree_query():
+            params["q"] = query
+        return set_query_params(url, **params)
+
+    async def _list_directory(self, url):
+        entries = []
         async for response in self.bitbucket_client.paginated_api_call(
-            url=folder.get("links", {}).get("self", {}).get("href")
+            url=self._directory_url(url)
         ):
-            for data in response.get("values", []):
-                if data.get("type") == "commit_directory":
-                    async for file_data in self._fetch_files_from_folder(data):
-                        yield file_data
-                else:
-                    yield self._prepare_file_doc(data)
+            entries.extend(response.get("values", []))
+        return entries
+
+    async def _walk_source_tree(self, url):
+        """Walks a repository source tree breadth-first and yields its file entries.
+
+        Directory listings are taken from a work queue, up to `CONCURRENT_DIRECTORY_LISTINGS`
+        at a time. Each listing returns `SRC_MAX_DEPTH` levels of nested directories, so only
+        directories whose content is missing from a listing are requested separately.
+        """
+        max_tree_depth = self.configuration["max_tree_depth"]
+        max_file_count = self.configuration["max_file_count"]
+        file_count = 0
+        directories = deque([url])
+        listings = set()
+
+        try:
+            while directories or listings:
+                while directories and len(listings) < CONCURRENT_DIRECTORY_LISTINGS:
+                    listings.add(
+                        asyncio.create_task(self._list_directory(directories.popleft()))
+                    )
+
+                done, listings = await asyncio.wait(
+                    listings, return_when=asyncio.FIRST_COMPLETED
+                )
+                for listing in done:
+                    entries = listing.result()
+                    listed_directories = {
+                        entry["path"].rpartition("/")[0]
+                        for entry in entries
+                        if "/" in entry.get("path", "")
+                    }
+                    for entry in entries:
+                        depth = entry.get("path", "").count("/")
+                        if max_tree_depth is not None and depth > max_tree_depth:
+                            continue
+
+                        if entry.get("type") == COMMIT_DIRECTORY:
+                            if entry.get("path") in listed_directories or (
+                                max_tree_depth is not None and depth >= max_tree_depth
+                            ):
+                                continue
+                            directories.append(
+                                entry.get("links", {}).get("self", {}).get("href")
+                            )
+                            continue
+
+                        yield entry
+                        file_count += 1
+                        if max_file_count and file_count >= max_file_count:
+                            self._logger.info(
+                                f"Reached the maximum of {max_file_count} files for {url}"
+                            )
+                            return
+        finally:
+            for listing in listings:
+                listing.cancel()
+
+    async def _fetch_repository_files(self, repository_name):
+        async for file_data in self._walk_source_tree(
+            f"{BASE_URL}repositories/{repository_name}/src"
+        ):
+            document = self._prepare_file_doc(file_data, repository_name)
+            yield document, partial(self.get_content, file_data, document["_id"])
 
     async def _fetch_files(self):
         if self.configuration.get("repositories") == [WILDCARD]:
-            async for workspace in self._fetch_workspaces():
-                async for response in self.bitbucket_client.paginated_api_call(
-                    url=f"{BASE_URL}repositories/{workspace}/src",
+            async for repository in self._fetch_repository_name():
+                async for document, lazy_download in self._fetch_repository_files(
+                    repository.get("full_name")
                 ):
-                    for data in response.get("values", []):
-                        if data.get("type") == "commit_directory":
-                            async for file_data in self._fetch_files_from_folder(data):
-                                yield file_data
-                        else:
-                            yield self._prepare_file_doc(data)
+                    yield document, lazy_download
         else:
             for repository_name in self.configuration.get("repositories"):
-                async for response in self.bitbucket_client.paginated_api_call(
-                    url=f"{BASE_URL}repositories/{repository_name}/src",
+                async for document, lazy_download in self._fetch_repository_files(
+                    repository_name
                 ):
-                    for data in response.get("values", []):
-                        if data.get("type") == "commit_directory":
-                            async for file_data in self._fetch_files_from_folder(data):
-                                yield file_data
-                        else:
-                            yield self._prepare_file_doc(data)
+                    yield document, lazy_download
+
+    def bytes_per_document(self):
+        counters = self.bitbucket_client.counters
+        documents = counters.get(DOCUMENTS_FETCHED)
+        if documents == 0:
+            return 0
+        return counters.get(BYTES_RECEIVED) / documents
 
     async def get_docs(self, filtering=None):
         async for doc in self._fetch_commits():
+            self.bitbucket_client.counters.increment(DOCUMENTS_FETCHED)
             yield doc, None
         # async for doc in self._fetch_pull_request():
         #     yield doc, None
-        # async for doc in self._fetch_files():
-        #     yield doc, None
+        async for doc, lazy_download in self._fetch_files():
+            self.bitbucket_client.counters.increment(DOCUMENTS_FETCHED)
+            yield doc, lazy_download
+        self._logger.info(
+            f"Received {self.bitbucket_client.counters.get(BYTES_RECEIVED)} bytes from Bitbucket for {self.bitbucket_client.counters.get(DOCUMENTS_FETCHED)} documents ({round(self.bytes_per_document())} bytes per document)"
+        )
@@ -14,7 +14,10 @@ from elasticsearch import (
     NotFoundError as ElasticNotFoundError,
 )
 
-from connectors.config import DataSourceFrameworkConfig
+from connectors.config import (
+    DEFAULT_MAX_IN_MEMORY_FILE_SIZE,
+    DataSourceFrameworkConfig,
+)
 from connectors.es.client import License, with_concurrency_control
 from connectors.es.index import DocumentNotFoundError
 from connectors.es.license import requires_platinum_license
@@ -27,7 +30,15 @@ from connectors.es.sink import (
     SyncOrchestrator,
     UnsupportedJobType,
 )
+from connectors.file_sink import ELASTICSEARCH_SINK, FILE_SINK, FileSyncOrchestrator
+from connectors.filtering.basic_rule import (
+    PROFILE_SYNC_RULES,
+    SLOWEST_SYNC_RULES,
+    SYNC_RULES_STATS,
+)
 from connectors.logger import logger
+from connectors.metrics import metrics
+from connectors.profiling import SyncJobProfiler
 from connectors.protocol import JobStatus, JobType
 from connectors.protocol.connectors import (
     DELETED_DOCUMENT_COUNT,
@@ -43,6 +54,20 @@ JOB_REPORTING_INTERVAL = 10
 JOB_CHECK_INTERVAL = 1
 ES_ID_SIZE_LIMIT = 512
 
+SYNC_JOBS = metrics.counter(
+    "connectors_sync_jobs", "Finished sync jobs", labelnames=("job_type", "status")
+)
+SYNC_JOB_DURATION = metrics.histogram(
+    "connectors_sync_job_duration_seconds",
+    "Duration of sync jobs",
+    labelnames=("job_type",),
+)
+SYNC_JOB_DOCUMENTS = metrics.counter(
+    "connectors_sync_job_documents",
+    "Documents queued for ingestion by sync jobs",
+    labelnames=("job_type", "operation"),
+)
+
 
 class SyncJobRunningError(Exception):
     pass
@@ -114,6 +139,7 @@ class SyncJobRunner:
         self.service_config = service_config
         self.sync_orchestrator = None
         self.job_reporting_task = None
+        self.profiler = None
         self.bulk_options = self.es_config.get("bulk", {})
         self._start_time = None
         self.running = False
@@ -143,6 +169,13 @@ class SyncJobRunner:
 
         self.sync_job.log_debug("Successfully claimed the sync job.")
 
+        if self.sync_job.profile or self.connector.profile_syncs:
+            self.sync_job.log_info("Profiling the sync job")
+            self.profiler = SyncJobProfiler.from_config(
+                self.sync_job.id, self.service_config
+            )
+            self.profiler.start()
+
         try:
             self.data_provider = self.source_klass(
                 configuration=self.sync_job.configuration
@@ -173,6 +206,9 @@ class SyncJobRunner:
             # allows the data provider to change the bulk options
             bulk_options = self.bulk_options.copy()
             self.data_provider.tweak_bulk_options(bulk_options)
+            bulk_options[PROFILE_SYNC_RULES] = self.service_config.get(
+                "profile_sync_rules", False
+            )
 
             if (
                 self.connector.native
@@ -181,9 +217,7 @@ class SyncJobRunner:
                 # Update the config so native connectors can use API key authentication during sync
                 await self._update_native_connector_authentication()
 
-            self.sync_orchestrator = SyncOrchestrator(
-                self.es_config, self.sync_job.logger
-            )
+            self.sync_orchestrator = self._create_sync_orchestrator()
 
             if job_type in [JobType.INCREMENTAL, JobType.FULL]:
                 self.sync_job.log_info(f"Executing {job_type.value} sync")
@@ -221,6 +255,30 @@ class SyncJobRunner:
                 await self.sync_orchestrator.close()
             if self.data_provider is not None:
                 await self.data_provider.close()
+            await self._stop_profiler()
+
+    async def _stop_profiler(self):
+        """Stops profiling the job, returns the paths of the profile, or None if it could not be written."""
+        if self.profiler is None:
+            return None
+        try:
+            return await self.profiler.stop()
+        except Exception as e:
+            # a profile is not worth failing the sync for
+            self.sync_job.log_error(
+                f"Could not write the profile of the sync job: {e}", exc_info=True
+            )
+            return None
+
+    def _create_sync_orchestrator(self):
+        if self.service_config.get("sink", ELASTICSEARCH_SINK) == FILE_SINK:
+            self.sync_job.log_info(
+                "Writing documents to files instead of Elasticsearch"
+            )
+            return FileSyncOrchestrator.from_config(
+                self.service_config, self.sync_job.id, self.sync_job.logger
+            )
+        return SyncOrchestrator(self.es_config, self.sync_job.logger)
 
     async def _update_native_connector_authentication(self):
         """
@@ -250,8 +308,17 @@ class SyncJobRunner:
             await es_management_client.close()
 
     def _data_source_framework_config(self):
-        builder = DataSourceFrameworkConfig.Builder().with_max_file_size(
-            self.service_config.get("max_file_download_size")
+        builder = (
+            DataSourceFrameworkConfig.Builder()
+            .with_max_file_size(self.service_config.get("max_file_download_size"))
+            .with_max_in_memory_file_size(
+                self.service_config.get(
+                    "max_in_memory_file_size", DEFAULT_MAX_IN_MEMORY_FILE_SIZE
+                )
+            )
+            .with_plain_text_extraction(
+                self.service_config.get("plain_text_extraction", True)
+            )
         )
         return builder.build()
 
@@ -306,8 +373,11 @@ class SyncJobRunner:
             raise UnsupportedJobType(msg)
 
         sync_rules_enabled = self.connector.features.sync_rules_enabled()
+        filtering = self.sync_job.filtering
         if sync_rules_enabled:
             await self.sync_job.validate_filtering(validator=self.data_provider)
+            # rules applied by the remote system don't need to be evaluated again
+            filtering = self.data_provider.push_down_basic_rules(filtering)
 
         logger.debug("Preparing the content index")
 
@@ -320,7 +390,7 @@ class SyncJobRunner:
             self.prepare_docs(),
             self.sync_job.pipeline,
             job_type,
-            filter_=self.sync_job.filtering,
+            filter_=filtering,
             sync_rules_enabled=sync_rules_enabled,
             content_extraction_enabled=self._content_extraction_enabled(
                 self.sync_job.configuration, self.sync_job.pipeline
@@ -351,6 +421,7 @@ class SyncJobRunner:
             if self.sync_orchestrator is None
             else self.sync_orchestrator.ingestion_stats()
         )
+        profile = await self._stop_profiler()
         persisted_stats = {
             INDEXED_DOCUMENT_COUNT: ingestion_stats.get(INDEXED_DOCUMENT_COUNT, 0),
             INDEXED_DOCUMENT_VOLUME: ingestion_stats.get(INDEXED_DOCUMENT_VOLUME, 0),
@@ -363,6 +434,34 @@ class SyncJobRunner:
                     "total_document_count"
                 ] = await self.connector.document_count()
 
+            connector_metadata = {}
+
+            # per basic rule match counts (and evaluation cost, if sync rules are profiled)
+            if sync_rules_stats := ingestion_stats.get(SYNC_RULES_STATS):
+                self.sync_job.log_info(f"Sync rules stats: {sync_rules_stats}")
+                if slowest_sync_rules := ingestion_stats.get(SLOWEST_SYNC_RULES):
+                    self.sync_job.log_info(f"Slowest sync rules: {slowest_sync_rules}")
+                connector_metadata[SYNC_RULES_STATS] = sync_rules_stats
+
+            # where the profile of the sync job was written, if it was profiled
+            if profile is not None:
+                connector_metadata["profile"] = profile
+
+            # stored in one update, so they are either both recorded or not at all
+            if connector_metadata:
+                await self.sync_job.update_metadata(
+                    connector_metadata=connector_metadata
+                )
+
+            # per sync throughput and queue wait of the local extraction service
+            if (
+                self.data_provider is not None
+                and self.data_provider.extraction_service is not None
+            ):
+                self.sync_job.log_info(
+                    f"Content extraction stats: {self.data_provider.extraction_service.stats()}"
+                )
+
             if sync_status == JobStatus.ERROR:
                 await self.sync_job.fail(sync_error, ingestion_stats=persisted_stats)
             elif sync_status == JobStatus.SUSPENDED:
@@ -383,6 +482,8 @@ class SyncJobRunner:
                 cursor=sync_cursor,
             )
 
+        self._record_metrics(sync_status, ingestion_stats)
+
         self.sync_job.log_info(
             f"Sync ended with status {sync_status.value} -- "
             f"created: {ingestion_stats.get(CREATES_QUEUED, 0)} | "
@@ -392,6 +493,20 @@ class SyncJobRunner:
         )
         self.log_counters(ingestion_stats)
 
+    def _record_metrics(self, sync_status, ingestion_stats):
+        job_type = self.sync_job.job_type.value
+        SYNC_JOBS.inc(job_type=job_type, status=sync_status.value)
+        if self._start_time is not None:
+            SYNC_JOB_DURATION.observe(time.time() - self._start_time, job_type=job_type)
+        for operation, key in (
+            ("create", CREATES_QUEUED),
+            ("update", UPDATES_QUEUED),
+            ("delete", DELETES_QUEUED),
+        ):
+            SYNC_JOB_DOCUMENTS.inc(
+                ingestion_stats.get(key, 0), job_type=job_type, operation=operation
+            )
+
     def log_counters(self, counters):
         """
         Logs out a dump of everything in "counters"
@@ -5,15 +5,13 @@
 #
 import asyncio
 import base64
+import binascii
 import functools
 import hashlib
 import inspect
 import os
-import platform
 import re
-import shutil
 import ssl
-import subprocess
 import time
 import urllib.parse
 from copy import deepcopy
@@ -21,14 +19,11 @@ from datetime import datetime, timedelta, timezone
 from enum import Enum
 from time import strftime
 
-import dateutil.parser as parser
-from base64io import Base64IO
-from bs4 import BeautifulSoup
-from cstriggers.core.trigger import QuartzCron
-from pympler import asizeof
-
 from connectors.logger import logger
 
+# dateutil, bs4 (with lxml), cstriggers and pympler are slow to import, and this
+# module is imported by almost every module: they are imported on first use
+
 ACCESS_CONTROL_INDEX_PREFIX = ".search-acl-filter-"
 DEFAULT_CHUNK_SIZE = 500
 DEFAULT_QUEUE_SIZE = 1024
@@ -84,7 +79,9 @@ class Format(Enum):
 
 
 def parse_datetime_string(datetime):
-    return parser.parse(datetime)
+    import dateutil.parser
+
+    return dateutil.parser.parse(datetime)
 
 
 def iso_utc(when=None):
@@ -105,6 +102,8 @@ def epoch_timestamp_zulu():
 
 def next_run(quartz_definition, now):
     """Returns the datetime of the next run."""
+    from cstriggers.core.trigger import QuartzCron
+
     cron_obj = QuartzCron(quartz_definition, now)
     return cron_obj.next_trigger()
 
@@ -170,6 +169,8 @@ class CancellableSleeps:
 
 def get_size(ob):
     """Returns size in Bytes"""
+    from pympler import asizeof
+
     return asizeof.asizeof(ob)
 
 
@@ -195,20 +196,71 @@ def decode_base64_value(content):
     return base64.b64decode(content)
 
 
-_BASE64 = shutil.which("base64")
+# a multiple of 3, so that chunks are encoded without padding
+B64_CHUNK_SIZE = 3 * 64 * 1024
+
+
+def _read_full(f, view):
+    """Fills `view` from the file `f`, returns the number of read bytes (less only at the end of the file)."""
+    read = 0
+    while read < len(view):
+        count = f.readinto(view[read:])
+        if not count:
+            break
+        read += count
+    return read
+
+
+def iter_b64_chunks(source, chunk_size=B64_CHUNK_SIZE):
+    """Yields the base64 encoded content of the `source` file chunk by chunk.
+
+    The file is read into one buffer reused for every chunk, `chunk_size` must be a multiple of 3.
+    """
+    buffer = bytearray(chunk_size)
+    view = memoryview(buffer)
+    with open(source, "rb") as f:
+        while read := _read_full(f, view):
+            yield binascii.b2a_base64(view[:read], newline=False)
+
+
+def encode_file_to_b64(source, target=None, chunk_size=B64_CHUNK_SIZE):
+    """Encodes the `source` file to base64 in process, without line breaks.
+
+    If `target` is provided, a writable binary stream (f.e. a request body buffer), the encoded
+    chunks are written to it and the number of written bytes is returned.
+    Otherwise the encoded content is assembled in a buffer allocated for the whole file and
+    returned as a str.
+
+    This function blocks -- if you want to avoid blocking the event
+    loop, call it through `asyncio.to_thread`
+    """
+    if target is not None:
+        written = 0
+        for chunk in iter_b64_chunks(source, chunk_size):
+            target.write(chunk)
+            written += len(chunk)
+        return written
+
+    encoded = bytearray(4 * ((os.path.getsize(source) + 2) // 3))
+    offset = 0
+    for chunk in iter_b64_chunks(source, chunk_size):
+        encoded[offset : offset + len(chunk)] = chunk
+        offset += len(chunk)
+
+    if offset != len(encoded):
+        # the file changed while it was encoded
+        del encoded[offset:]
+    return encoded.decode("ascii")
 
 
 def convert_to_b64(source, target=None, overwrite=False):
-    """Converts a `source` file to base64 using the system's `base64`
+    """Converts a `source` file to base64, see `encode_file_to_b64`
 
     When `target` is not provided, done in-place.
 
     If `overwrite` is `True` and `target` exists, overwrites it.
     If `False` and it exists, raises an `IOError`
 
-    If the `base64` utility could not be found, falls back to pure Python
-    using base64io.
-
     This function blocks -- if you want to avoid blocking the event
     loop, call it through `loop.run_in_executor`
 
@@ -220,25 +272,8 @@ def convert_to_b64(source, target=None, overwrite=False):
         msg = f"{target} already exists."
         raise IOError(msg)
 
-    if _BASE64 is not None:
-        if platform.system() == "Darwin":
-            version = int(platform.mac_ver()[0].split(".")[0])
-            # MacOS 13 has changed base64 util
-            if version >= 13:
-                cmd = f"{_BASE64} -i {source} -o {temp_target}"
-            else:
-                cmd = f"{_BASE64} {source} > {temp_target}"
-        else:
-            # In Linuces, avoid line wrapping
-            cmd = f"{_BASE64} -w 0 {source} > {temp_target}"
-        logger.debug(f"Calling {cmd}")
-        subprocess.check_call(cmd, shell=True)  # noqa S602
-    else:
-        # Pure Python version
-        with open(source, "rb") as sf, open(temp_target, "wb") as tf:
-            with Base64IO(tf) as encoded_target:
-                for line in sf:
-                    encoded_target.write(line)
+    with open(temp_target, "wb") as tf:
+        encode_file_to_b64(source, target=tf)
 
     # success, let's move the file to the right place
     if inplace:
@@ -810,6 +845,9 @@ class CacheWithTimeout:
 def html_to_text(html):
     if not html:
         return html
+
+    from bs4 import BeautifulSoup
+
     try:
         return BeautifulSoup(html, "lxml").get_text(separator="\n")
     except Exception:
@@ -0,0 +1,135 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+Microbenchmark of `BasicRuleEngine.should_ingest`.
+
+Runs the compiled engine over `--documents` documents, one by one and in batches
+of 1000 documents (`should_ingest_many`), and compares it with
+evaluating every rule in order through `BasicRule.matches` (the behavior before
+rules were compiled). Evaluating rules one by one is slow, so the reference only
+runs over `--reference-documents` documents and its throughput is extrapolated.
+
+    python scripts/benchmarks/basic_rule_engine.py --rules 1000 --documents 1000000
+"""
+import logging
+import random
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from connectors.filtering.basic_rule import BasicRule, BasicRuleEngine, Policy, Rule
+from connectors.logger import set_logger
+
+FIELDS = 20
+STRING_RULES = [Rule.EQUALS, Rule.STARTS_WITH, Rule.ENDS_WITH, Rule.CONTAINS]
+
+
+def generate_rules(count, seed):
+    rng = random.Random(seed)
+    rules = []
+
+    for i in range(count):
+        field = f"field_{rng.randrange(FIELDS)}"
+        policy = rng.choice([Policy.INCLUDE, Policy.EXCLUDE])
+
+        match rng.randrange(10):
+            case 0:
+                rule, value = Rule.REGEX, f"^value_{rng.randrange(1000)}.*"
+            case 1:
+                rule, value = Rule.GREATER_THAN, str(rng.randrange(990_000, 1_000_000))
+                field = "size"
+            case _:
+                rule, value = (
+                    rng.choice(STRING_RULES),
+                    f"value_{rng.randrange(100_000)}",
+                )
+
+        rules.append(
+            BasicRule(
+                id_=str(i), order=i, policy=policy, field=field, rule=rule, value=value
+            )
+        )
+
+    return rules
+
+
+def generate_documents(count, seed):
+    rng = random.Random(seed)
+
+    for i in range(count):
+        document = {"id": i, "size": rng.randrange(1_000_000)}
+        for _ in range(5):
+            document[
+                f"field_{rng.randrange(FIELDS)}"
+            ] = f"value_{rng.randrange(100_000)}"
+        yield document
+
+
+def run_reference(rules, documents):
+    for document in documents:
+        for rule in rules:
+            if rule.matches(document):
+                break
+
+
+def run_compiled(rules, documents):
+    engine = BasicRuleEngine(rules)
+    for document in documents:
+        engine.should_ingest(document)
+
+
+def run_batched(rules, documents, batch_size=1000):
+    engine = BasicRuleEngine(rules)
+    for start in range(0, len(documents), batch_size):
+        engine.should_ingest_many(documents[start : start + batch_size])
+
+
+def measure(label, func, rules, documents_count, seed):
+    documents = list(generate_documents(documents_count, seed))
+
+    start = time.perf_counter()
+    func(rules, documents)
+    duration = time.perf_counter() - start
+
+    rate = documents_count / duration
+    print(
+        f"{label}: {documents_count} documents in {duration:.2f}s ({rate:.0f} docs/s)"
+    )
+    return rate
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--rules", type=int, default=1000, help="Number of rules")
+    parser.add_argument(
+        "--documents", type=int, default=1_000_000, help="Number of documents"
+    )
+    parser.add_argument(
+        "--reference-documents",
+        type=int,
+        default=10_000,
+        help="Number of documents evaluated rule by rule",
+    )
+    parser.add_argument("--seed", type=int, default=42, help="Random seed")
+    args = parser.parse_args(args=args)
+
+    # per document debug logs would dominate the measurement
+    set_logger(logging.INFO)
+
+    rules = generate_rules(args.rules, args.seed)
+    print(f"{args.rules} rules on {FIELDS + 1} fields")
+
+    reference_rate = measure(
+        "rule by rule", run_reference, rules, args.reference_documents, args.seed
+    )
+    compiled_rate = measure("compiled", run_compiled, rules, args.documents, args.seed)
+    batched_rate = measure("batched", run_batched, rules, args.documents, args.seed)
+    print(f"speedup: {compiled_rate / reference_rate:.1f}x (compiled)")
+    print(f"speedup: {batched_rate / reference_rate:.1f}x (batched)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+Microbenchmark of per-document debug logs.
+
+Compares the per-document cost of a debug log built eagerly with an f-string
+(the behavior before lazy logging) with a lazy, sampled log, at INFO level
+(logs disabled) and at DEBUG level (logs written to a discarded stream).
+Also measures `BasicRuleEngine.should_ingest`, which logs once per document.
+
+    python scripts/benchmarks/document_logging.py --documents 1000000
+"""
+import io
+import logging
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+import connectors.logger
+from connectors.filtering.basic_rule import BasicRule, BasicRuleEngine, Policy, Rule
+from connectors.logger import LogSampler, set_logger
+
+
+def run_eager(logger, documents):
+    for document in documents:
+        logger.debug(
+            f"Document (id: '{document.get('id')}') didn't match any basic rule. Document will be included"
+        )
+
+
+def run_lazy(logger, documents):
+    sampler = LogSampler()
+    for document in documents:
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug(
+                lambda document=document: f"Document (id: '{document.get('id')}') didn't match any basic rule. Document will be included",
+                sampler=sampler,
+            )
+
+
+def run_should_ingest(logger, documents):
+    rule = BasicRule(
+        id_="1",
+        order=0,
+        policy=Policy.EXCLUDE,
+        field="path",
+        rule=Rule.STARTS_WITH,
+        value="/private",
+    )
+    engine = BasicRuleEngine([rule])
+    for document in documents:
+        engine.should_ingest(document)
+
+
+def measure(label, func, logger, documents):
+    start = time.perf_counter()
+    func(logger, documents)
+    duration = time.perf_counter() - start
+
+    print(
+        f"{label}: {duration / len(documents) * 1e9:.0f} ns/document ({duration:.2f}s)"
+    )
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--documents", type=int, default=1_000_000, help="Number of documents"
+    )
+    args = parser.parse_args(args=args)
+
+    documents = [{"id": i, "path": f"/docs/{i}"} for i in range(args.documents)]
+
+    for level in (logging.INFO, logging.DEBUG):
+        logger = set_logger(level)
+        connectors.logger._stream_handler.setStream(io.StringIO())
+        print(f"{logging.getLevelName(level)} level")
+
+        measure("  eager f-string", run_eager, logger, documents)
+        measure("  lazy, sampled", run_lazy, logger, documents)
+        measure("  should_ingest", run_should_ingest, logger, documents)
+
+
+if __name__ == "__main__":
+    main()
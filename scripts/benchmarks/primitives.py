@@ -0,0 +1,277 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+Microbenchmarks of the framework primitives that run once per document.
+
+Every benchmark runs a primitive on a realistic input (a document of a typical
+connector, an HTML page...) in rounds of `--min-time` seconds and reports the
+median time per call over `--rounds` rounds. Results are printed and can be
+written as JSON (`--output`), and compared with a previous JSON file
+(`--baseline`): the run fails when a primitive is slower than its baseline by
+more than `--tolerance`.
+
+    PYTHONPATH=. python scripts/benchmarks/primitives.py --output results.json
+    PYTHONPATH=. python scripts/benchmarks/primitives.py --baseline results.json -k html
+"""
+import asyncio
+import datetime
+import json
+import logging
+import platform
+import statistics
+import sys
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from decimal import Decimal
+
+from connectors.filtering.basic_rule import BasicRule, BasicRuleEngine, Policy, Rule
+from connectors.logger import set_logger
+from connectors.source import BaseDataSource, DataSourceConfiguration
+from connectors.utils import (
+    ConcurrentTasks,
+    MemQueue,
+    get_size,
+    hash_id,
+    html_to_text,
+    iso_utc,
+    parse_datetime_string,
+)
+
+DEFAULT_TOLERANCE = 0.2
+# calls per batch of the async benchmarks, so that the event loop overhead is amortized
+ASYNC_BATCH_SIZE = 1000
+
+BENCHMARKS = {}
+
+
+def benchmark(name, batch_size=1):
+    """Registers `setup`, which returns the function to measure, running `batch_size` calls."""
+
+    def _register(setup):
+        BENCHMARKS[name] = (setup, batch_size)
+        return setup
+
+    return _register
+
+
+def make_document(i=0):
+    """A document like the ones of a file storage connector."""
+    return {
+        "_id": f"drive-{i:08d}",
+        "_timestamp": "2023-06-01T10:15:30.123456+00:00",
+        "title": f"Quarterly report {i}.docx",
+        "path": f"/shared/finance/reports/2023/Q2/Quarterly report {i}.docx",
+        "size": 123456 + i,
+        "mime_type": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
+        "author": {"name": "Jane Doe", "email": "jane.doe@example.com"},
+        "created_at": datetime.datetime(
+            2023, 4, 1, 8, 30, tzinfo=datetime.timezone.utc
+        ),
+        "tags": ["finance", "reports", "2023", "quarterly"],
+        "permissions": [f"group:finance-{j}" for j in range(5)],
+        "score": Decimal("12.5"),
+        "body": "Revenue grew steadily over the quarter. " * 20,
+    }
+
+
+HTML_PAGE = (
+    "<html><head><title>Release notes</title><style>p {color: red}</style></head><body>"
+    + "".join(
+        f"<h2>Section {i}</h2><p>Some <b>bold</b> and <a href='/link/{i}'>linked</a> "
+        f"text, with a list:</p><ul><li>first item</li><li>second item</li></ul>"
+        for i in range(50)
+    )
+    + "</body></html>"
+)
+
+
+class _Source(BaseDataSource):
+    @classmethod
+    def get_default_configuration(cls):
+        return {}
+
+
+@benchmark("memqueue_put_get", batch_size=ASYNC_BATCH_SIZE)
+def _memqueue_put_get():
+    loop = asyncio.new_event_loop()
+    queue = MemQueue(maxsize=0, maxmemsize=1024 * 1024 * 1024)
+    document = make_document()
+
+    async def _put_get():
+        for _ in range(ASYNC_BATCH_SIZE):
+            await queue.put(document)
+            await queue.get()
+
+    return lambda: loop.run_until_complete(_put_get())
+
+
+@benchmark("get_size")
+def _get_size():
+    document = make_document()
+    return lambda: get_size(document)
+
+
+@benchmark("serialize")
+def _serialize():
+    source = _Source(DataSourceConfiguration({}))
+    document = make_document()
+    return lambda: source.serialize(document)
+
+
+@benchmark("should_ingest")
+def _should_ingest():
+    rules = [
+        BasicRule(
+            id_=str(i),
+            order=i,
+            policy=Policy.EXCLUDE,
+            field="path",
+            rule=Rule.STARTS_WITH,
+            value=f"/private/{i}",
+        )
+        for i in range(20)
+    ]
+    engine = BasicRuleEngine(rules)
+    document = make_document()
+    return lambda: engine.should_ingest(document)
+
+
+@benchmark("hash_id")
+def _hash_id():
+    _id = make_document()["path"]
+    return lambda: hash_id(_id)
+
+
+@benchmark("iso_utc")
+def _iso_utc():
+    return iso_utc
+
+
+@benchmark("parse_datetime_string")
+def _parse_datetime_string():
+    timestamp = make_document()["_timestamp"]
+    return lambda: parse_datetime_string(timestamp)
+
+
+@benchmark("html_to_text")
+def _html_to_text():
+    return lambda: html_to_text(HTML_PAGE)
+
+
+@benchmark("concurrent_tasks_put", batch_size=ASYNC_BATCH_SIZE)
+def _concurrent_tasks_put():
+    loop = asyncio.new_event_loop()
+
+    async def _noop():
+        pass
+
+    async def _put():
+        pool = ConcurrentTasks(max_concurrency=10)
+        for _ in range(ASYNC_BATCH_SIZE):
+            await pool.put(_noop)
+        await pool.join()
+
+    return lambda: loop.run_until_complete(_put())
+
+
+def measure(func, batch_size, rounds, min_time):
+    """Returns the median time per call in seconds, and the number of calls per round."""
+    # calibrate the number of calls so that a round lasts at least `min_time`
+    calls = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        if time.perf_counter() - start >= min_time:
+            break
+        calls *= 2
+
+    timings = []
+    for _ in range(rounds):
+        start = time.perf_counter()
+        for _ in range(calls):
+            func()
+        timings.append((time.perf_counter() - start) / (calls * batch_size))
+    return statistics.median(timings), calls * batch_size
+
+
+def compare(results, baseline, tolerance):
+    """Prints the change from the baseline, returns the names of the regressed benchmarks."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["seconds_per_call"]
+        change = result["seconds_per_call"] / before - 1
+        flag = " REGRESSION" if change > tolerance else ""
+        print(
+            f"{name}: {before * 1e9:.0f} -> {result['seconds_per_call'] * 1e9:.0f} ns ({change:+.1%}){flag}"
+        )
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "-k", dest="keyword", help="Only run the benchmarks whose name contains this"
+    )
+    parser.add_argument("--rounds", type=int, default=5, help="Rounds per benchmark")
+    parser.add_argument(
+        "--min-time",
+        type=float,
+        default=0.2,
+        help="Minimum duration of a round, in seconds",
+    )
+    parser.add_argument("--output", help="JSON file to write the results to")
+    parser.add_argument("--baseline", help="JSON results to compare with")
+    parser.add_argument(
+        "--tolerance",
+        type=float,
+        default=DEFAULT_TOLERANCE,
+        help="Slowdown from the baseline considered a regression",
+    )
+    args = parser.parse_args(args=args)
+
+    # per document debug logs would be measured too
+    set_logger(logging.INFO)
+
+    results = {}
+    for name, (setup, batch_size) in BENCHMARKS.items():
+        if args.keyword and args.keyword not in name:
+            continue
+        seconds_per_call, calls = measure(
+            setup(), batch_size, args.rounds, args.min_time
+        )
+        results[name] = {"seconds_per_call": seconds_per_call, "calls_per_round": calls}
+        print(f"{name}: {seconds_per_call * 1e9:.0f} ns/call")
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(
+                {
+                    "python": platform.python_version(),
+                    "machine": platform.machine(),
+                    "results": results,
+                },
+                f,
+                indent=2,
+            )
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)["results"]
+        if regressions := compare(results, baseline, args.tolerance):
+            print(f"Slower than the baseline: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
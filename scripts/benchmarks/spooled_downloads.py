@@ -0,0 +1,79 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+Microbenchmark of `BaseDataSource.download_and_extract_file` for small files.
+
+Downloads `--files` files of `--file-size` bytes and converts them to base64,
+once with every file written to a temporary file on disk (the behavior before
+downloads were spooled, `max_in_memory_file_size` of 0) and once with the
+default `max_in_memory_file_size`, keeping small files in memory.
+
+    python scripts/benchmarks/spooled_downloads.py --files 5000 --file-size 4096
+"""
+import asyncio
+import logging
+import os
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+
+from connectors.config import DEFAULT_MAX_IN_MEMORY_FILE_SIZE
+from connectors.logger import set_logger
+from connectors.source import CHUNK_SIZE, BaseDataSource, DataSourceConfiguration
+
+
+class BenchmarkDataSource(BaseDataSource):
+    @classmethod
+    def get_default_configuration(cls):
+        return {}
+
+
+async def run(files, content, max_in_memory_file_size):
+    source = BenchmarkDataSource(configuration=DataSourceConfiguration({}))
+    source.framework_config.max_in_memory_file_size = max_in_memory_file_size
+
+    async def download_func():
+        for start in range(0, len(content), CHUNK_SIZE):
+            yield content[start : start + CHUNK_SIZE]
+
+    for i in range(files):
+        await source.download_and_extract_file(
+            {"id": i}, f"file_{i}.pdf", ".pdf", download_func
+        )
+
+
+def measure(label, files, content, max_in_memory_file_size):
+    start = time.perf_counter()
+    asyncio.run(run(files, content, max_in_memory_file_size))
+    duration = time.perf_counter() - start
+
+    rate = files / duration
+    print(f"{label}: {files} files in {duration:.2f}s ({rate:.0f} files/s)")
+    return rate
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument("--files", type=int, default=5000, help="Number of files")
+    parser.add_argument(
+        "--file-size", type=int, default=4096, help="Size of each file in bytes"
+    )
+    args = parser.parse_args(args=args)
+
+    # per file debug logs would dominate the measurement
+    set_logger(logging.INFO)
+
+    content = os.urandom(args.file_size)
+
+    on_disk_rate = measure("temp files", args.files, content, 0)
+    in_memory_rate = measure(
+        "spooled", args.files, content, DEFAULT_MAX_IN_MEMORY_FILE_SIZE
+    )
+    print(f"speedup: {in_memory_rate / on_disk_rate:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
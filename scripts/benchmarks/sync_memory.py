@@ -0,0 +1,293 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+Memory regression test of long syncs.
+
+Syncs `--docs` synthetic documents against the fake Elasticsearch server of
+`sync_throughput.py`, once per configuration of `queue_max_mem_size` and
+`chunk_max_mem_size`, in a fresh process, the way a sync job moves documents:
+
+- a producer reads `get_docs`, downloads attachments and puts documents in a
+  `MemQueue` bounded by `queue_max_mem_size`, after removing their id from the
+  map of ids already in the index, which starts with every document
+- a consumer batches documents in chunks of at most `chunk_size` documents and
+  `chunk_max_mem_size`, and sends up to `max_concurrency` chunks at once
+
+Traced memory (tracemalloc) and RSS are sampled every `--sample-interval`
+seconds. A configuration fails when its peak traced memory goes over
+`queue_max_mem_size + max_concurrency * chunk_max_mem_size + --allowance-mb`,
+plus `--allowance-per-doc` bytes per document for the map of existing ids,
+and the top allocation sites at the peak are then printed.
+
+    PYTHONPATH=. python scripts/benchmarks/sync_memory.py --docs 1000000
+
+The sync orchestrator and the Elasticsearch sink are not part of this tree, the
+pipeline above mirrors their queue and chunking bounds with `MemQueue` and
+`BulkWriter`.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import resource
+import sys
+import time
+import tracemalloc
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass
+from functools import partial
+
+from sync_throughput import (
+    BenchmarkConfig,
+    BulkWriter,
+    FakeElasticsearch,
+    SyntheticSource,
+)
+
+from connectors.http_client import http_client_registry
+from connectors.logger import set_logger
+from connectors.source import DataSourceConfiguration
+from connectors.utils import ConcurrentTasks, MemQueue, iso_utc
+
+MB = 1024 * 1024
+DEFAULT_ALLOWANCE_MB = 64
+# the map of existing ids takes ~90 bytes per document
+DEFAULT_ALLOWANCE_PER_DOC = 128
+TOP_ALLOCATIONS = 20
+
+
+@dataclass
+class MemoryConfig:
+    queue_max_mem_size: int  # MB
+    chunk_max_mem_size: int  # MB
+    queue_max_size: int = 1024
+    chunk_size: int = 1000
+    max_concurrency: int = 5
+
+    @property
+    def name(self):
+        return f"queue={self.queue_max_mem_size}MB,chunk={self.chunk_max_mem_size}MB"
+
+    def bound(self, docs, allowance_mb, allowance_per_doc):
+        return (
+            self.queue_max_mem_size
+            + self.max_concurrency * self.chunk_max_mem_size
+            + allowance_mb
+        ) * MB + docs * allowance_per_doc
+
+
+CONFIGS = [
+    # the defaults of `elasticsearch.bulk`
+    MemoryConfig(queue_max_mem_size=25, chunk_max_mem_size=5),
+    MemoryConfig(queue_max_mem_size=5, chunk_max_mem_size=1),
+    MemoryConfig(queue_max_mem_size=100, chunk_max_mem_size=20),
+]
+
+
+def current_rss():
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except OSError:
+        # peak instead of current RSS, in kilobytes on Linux and bytes on macOS
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+class MemorySampler:
+    """Samples traced memory and RSS, keeps a snapshot of the allocations at the sampled peak."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.samples = []
+        self.peak = 0
+        self.peak_snapshot = None
+        self._start = time.monotonic()
+
+    def sample(self):
+        traced, _ = tracemalloc.get_traced_memory()
+        self.samples.append(
+            {
+                "elapsed": time.monotonic() - self._start,
+                "traced_mb": traced / MB,
+                "rss_mb": current_rss() / MB,
+            }
+        )
+        if traced > self.peak:
+            self.peak = traced
+            self.peak_snapshot = tracemalloc.take_snapshot()
+
+    async def run(self):
+        while True:
+            self.sample()
+            await asyncio.sleep(self.interval)
+
+
+async def sync(memory_config, docs, url, sample_interval):
+    source = SyntheticSource(
+        DataSourceConfiguration({}), BenchmarkConfig(docs=docs, attachment_ratio=0.01)
+    )
+    writer = BulkWriter(url, memory_config.chunk_size)
+    queue = MemQueue(
+        maxsize=memory_config.queue_max_size,
+        maxmemsize=memory_config.queue_max_mem_size * MB,
+    )
+    downloads = ConcurrentTasks(max_concurrency=10)
+    bulks = ConcurrentTasks(max_concurrency=memory_config.max_concurrency)
+
+    # a full sync starts with the ids and timestamps of every document of the index
+    timestamp = iso_utc()
+    existing_ids = {str(i): timestamp for i in range(docs)}
+
+    sampler = MemorySampler(sample_interval)
+    sampler_task = asyncio.create_task(sampler.run())
+
+    async def _download_and_put(doc, lazy_download):
+        data = await lazy_download(doit=True, timestamp=doc["_timestamp"])
+        if data is not None:
+            doc.update(data)
+        await queue.put(doc)
+
+    async def _produce():
+        async for doc, lazy_download in source.get_docs():
+            existing_ids.pop(doc["_id"], None)
+            if lazy_download is None:
+                await queue.put(doc)
+            else:
+                await downloads.put(partial(_download_and_put, doc, lazy_download))
+        await downloads.join(raise_on_error=True)
+        await queue.put("END_DOCS")
+
+    async def _consume():
+        chunk, chunk_mem_size = [], 0
+        while True:
+            doc_size, doc = await queue.get()
+            if doc == "END_DOCS":
+                break
+            chunk.append(doc)
+            chunk_mem_size += doc_size
+            if (
+                len(chunk) >= memory_config.chunk_size
+                or chunk_mem_size >= memory_config.chunk_max_mem_size * MB
+            ):
+                await bulks.put(partial(writer.send, chunk))
+                chunk, chunk_mem_size = [], 0
+        if chunk:
+            await bulks.put(partial(writer.send, chunk))
+        await bulks.join(raise_on_error=True)
+
+    await asyncio.gather(_produce(), _consume())
+    sampler_task.cancel()
+    sampler.sample()
+    await http_client_registry.close()
+    return sampler
+
+
+def run_config(memory_config, docs, url, sample_interval):
+    """Runs one sync, in a fresh process, returns its memory samples and peak."""
+    set_logger(logging.WARNING)
+    tracemalloc.start()
+    sampler = asyncio.run(sync(memory_config, docs, url, sample_interval))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    top_allocations = [
+        str(statistic)
+        for statistic in sampler.peak_snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+    ]
+    return {
+        "peak_traced_mb": peak / MB,
+        "peak_rss_mb": max(sample["rss_mb"] for sample in sampler.samples),
+        "samples": sampler.samples,
+        "top_allocations": top_allocations,
+    }
+
+
+async def run_suite(configs, docs, sample_interval, allowance_mb, allowance_per_doc):
+    server = FakeElasticsearch()
+    url = await server.start()
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    try:
+        for memory_config in configs:
+            server.configure(BenchmarkConfig(docs=docs))
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = await loop.run_in_executor(
+                    executor, run_config, memory_config, docs, url, sample_interval
+                )
+
+            bound = memory_config.bound(docs, allowance_mb, allowance_per_doc)
+            result["bound_mb"] = bound / MB
+            result["passed"] = result["peak_traced_mb"] * MB <= bound
+            results[memory_config.name] = {"config": asdict(memory_config), **result}
+
+            print(
+                f"{memory_config.name}: peak traced {result['peak_traced_mb']:.0f} MB "
+                f"(bound {result['bound_mb']:.0f} MB), peak RSS {result['peak_rss_mb']:.0f} MB"
+                f"{'' if result['passed'] else ' -- OVER THE BOUND'}"
+            )
+            if not result["passed"]:
+                print("  top allocation sites at the peak:")
+                for allocation in result["top_allocations"]:
+                    print(f"    {allocation}")
+    finally:
+        await server.stop()
+
+    return results
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--docs", type=int, default=1_000_000, help="Number of documents per sync"
+    )
+    parser.add_argument(
+        "--sample-interval",
+        type=float,
+        default=1.0,
+        help="Interval between two memory samples, in seconds",
+    )
+    parser.add_argument(
+        "--allowance-mb",
+        type=int,
+        default=DEFAULT_ALLOWANCE_MB,
+        help="Memory allowed on top of the queue and chunks",
+    )
+    parser.add_argument(
+        "--allowance-per-doc",
+        type=int,
+        default=DEFAULT_ALLOWANCE_PER_DOC,
+        help="Memory allowed per document, in bytes",
+    )
+    parser.add_argument(
+        "--output", help="JSON file to write the results and samples to"
+    )
+    args = parser.parse_args(args=args)
+
+    results = asyncio.run(
+        run_suite(
+            CONFIGS,
+            args.docs,
+            args.sample_interval,
+            args.allowance_mb,
+            args.allowance_per_doc,
+        )
+    )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    return 0 if all(result["passed"] for result in results.values()) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,417 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+# ruff: noqa: T201
+"""
+End-to-end sync throughput benchmark against a local fake Elasticsearch.
+
+Every configuration of the suite syncs a synthetic source, based on
+`tests/fake_sources.py`, with a configurable number of documents, document size
+and share of documents with a binary attachment:
+
+- documents are generated by `get_docs`, attachments are downloaded, spooled and
+  converted to base64 by `download_and_extract_file`, concurrently
+- documents are sent in `_bulk` requests through the shared HTTP connection pool,
+  rejected documents (HTTP 429) are retried
+
+The fake Elasticsearch server implements `_bulk`, `_search`, `_doc` and `_mget`,
+with a configurable latency and share of rejected documents. It runs in this
+process, every sync runs in a fresh process to measure its CPU time and peak RSS
+alone. The results can be stored as a baseline and compared with a later run:
+
+    PYTHONPATH=. python scripts/benchmarks/sync_throughput.py --save-baseline baseline.json
+    PYTHONPATH=. python scripts/benchmarks/sync_throughput.py --baseline baseline.json
+
+The Elasticsearch sink is not part of this tree, bulk requests are sent by
+`BulkWriter`, a minimal stand-in of the sink.
+"""
+import asyncio
+import json
+import logging
+import multiprocessing
+import random
+import resource
+import sys
+import time
+from argparse import ArgumentDefaultsHelpFormatter, ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, replace
+from functools import partial
+
+from aiohttp import web
+
+from connectors.http_client import http_client_registry
+from connectors.logger import set_logger
+from connectors.source import BaseDataSource, DataSourceConfiguration
+from connectors.utils import ConcurrentTasks, iso_utc
+from tests.fake_sources import FakeSource
+
+INDEX_NAME = "search-benchmark"
+DEFAULT_MAX_REGRESSION = 0.1
+
+
+@dataclass
+class BenchmarkConfig:
+    docs: int
+    doc_size: int = 1024
+    attachment_ratio: float = 0.0
+    attachment_size: int = 64 * 1024
+    latency: float = 0.0
+    rejection_rate: float = 0.0
+    bulk_size: int = 500
+    concurrent_downloads: int = 10
+
+
+SUITE = {
+    "small-docs": BenchmarkConfig(docs=20000, doc_size=512),
+    "large-docs": BenchmarkConfig(docs=5000, doc_size=32 * 1024),
+    "attachments": BenchmarkConfig(docs=2000, attachment_ratio=0.5),
+    "slow-elasticsearch": BenchmarkConfig(docs=10000, latency=0.05),
+    "rejections": BenchmarkConfig(docs=10000, rejection_rate=0.05),
+}
+
+
+class FakeElasticsearch:
+    """Stand-in HTTP server for the Elasticsearch endpoints used by the framework."""
+
+    def __init__(self):
+        self.latency = 0
+        self.rejection_rate = 0
+        self.indexed = 0
+        self.rejected = 0
+        self.documents = {}
+        self._rng = random.Random(0)
+        self._runner = None
+
+    def configure(self, config):
+        self.latency = config.latency
+        self.rejection_rate = config.rejection_rate
+        self.indexed = 0
+        self.rejected = 0
+        self.documents = {}
+
+    async def start(self):
+        app = web.Application(client_max_size=1024**3)
+        app.router.add_post("/_bulk", self._bulk)
+        app.router.add_post("/{index}/_bulk", self._bulk)
+        app.router.add_route("*", "/{index}/_search", self._search)
+        app.router.add_get("/{index}/_doc/{doc_id}", self._get_doc)
+        app.router.add_put("/{index}/_doc/{doc_id}", self._put_doc)
+        app.router.add_post("/_mget", self._mget)
+        app.router.add_post("/{index}/_mget", self._mget)
+        self._runner = web.AppRunner(app, access_log=None)
+        await self._runner.setup()
+        site = web.TCPSite(self._runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        await self._runner.cleanup()
+
+    def _response(self, body, status=200):
+        return web.json_response(
+            body, status=status, headers={"X-Elastic-Product": "Elasticsearch"}
+        )
+
+    async def _bulk(self, request):
+        lines = (await request.read()).splitlines()
+        await asyncio.sleep(self.latency)
+
+        items = []
+        # action and source lines alternate, deletes have no source line
+        i = 0
+        while i < len(lines):
+            action, meta = next(iter(json.loads(lines[i]).items()))
+            i += 1 if action == "delete" else 2
+            if self._rng.random() < self.rejection_rate:
+                self.rejected += 1
+                items.append(
+                    {
+                        action: {
+                            "_id": meta["_id"],
+                            "status": 429,
+                            "error": {"type": "es_rejected_execution_exception"},
+                        }
+                    }
+                )
+            else:
+                self.indexed += 1
+                items.append({action: {"_id": meta["_id"], "status": 201}})
+
+        return self._response(
+            {
+                "took": 1,
+                "errors": any(_status(item) >= 300 for item in items),
+                "items": items,
+            }
+        )
+
+    async def _search(self, request):
+        await asyncio.sleep(self.latency)
+        return self._response({"hits": {"total": {"value": self.indexed}, "hits": []}})
+
+    async def _get_doc(self, request):
+        doc_id = request.match_info["doc_id"]
+        source = self.documents.get(doc_id)
+        if source is None:
+            return self._response({"_id": doc_id, "found": False}, status=404)
+        return self._response({"_id": doc_id, "found": True, "_source": source})
+
+    async def _put_doc(self, request):
+        doc_id = request.match_info["doc_id"]
+        self.documents[doc_id] = await request.json()
+        return self._response({"_id": doc_id, "result": "created"}, status=201)
+
+    async def _mget(self, request):
+        body = await request.json()
+        docs = []
+        for doc in body.get("docs", []) or [{"_id": i} for i in body.get("ids", [])]:
+            source = self.documents.get(doc["_id"])
+            docs.append(
+                {"_id": doc["_id"], "found": source is not None, "_source": source}
+            )
+        return self._response({"docs": docs})
+
+
+def _status(item):
+    return next(iter(item.values()))["status"]
+
+
+class SyntheticSource(FakeSource):
+    """Fake source generating `docs` documents, a share of them with an attachment."""
+
+    name = "Synthetic"
+    service_type = "synthetic"
+
+    def __init__(self, configuration, config):
+        BaseDataSource.__init__(self, configuration)
+        self.config = config
+        rng = random.Random(0)
+        self.body = "".join(rng.choice("abcdefghij ") for _ in range(config.doc_size))
+        self.attachment = rng.randbytes(config.attachment_size)
+        self.attachment_every = (
+            round(1 / config.attachment_ratio) if config.attachment_ratio else None
+        )
+
+    async def _download(self):
+        yield self.attachment
+
+    async def _dl(self, doc_id, timestamp=None, doit=None):
+        if not doit:
+            return
+        return await self.download_and_extract_file(
+            {"_id": doc_id, "_timestamp": timestamp},
+            f"{doc_id}.pdf",
+            ".pdf",
+            self._download,
+        )
+
+    async def get_docs(self, filtering=None):
+        timestamp = iso_utc()
+        for i in range(self.config.docs):
+            doc = {"_id": str(i), "_timestamp": timestamp, "body": self.body}
+            if self.attachment_every and i % self.attachment_every == 0:
+                yield doc, partial(self._dl, str(i))
+            else:
+                yield doc, None
+
+
+class BulkWriter:
+    """Sends documents in `_bulk` requests of `bulk_size` documents, retries rejected documents."""
+
+    def __init__(self, url, bulk_size, max_retries=10):
+        self.url = url
+        self.bulk_size = bulk_size
+        self.max_retries = max_retries
+        self.session = http_client_registry.get_session(url)
+        self.pending = []
+        self.bytes_sent = 0
+        self.retries = 0
+
+    async def index(self, doc):
+        self.pending.append(doc)
+        if len(self.pending) >= self.bulk_size:
+            await self.flush()
+
+    async def flush(self):
+        docs, self.pending = self.pending, []
+        await self.send(docs)
+
+    async def send(self, docs):
+        """Sends `docs` in one `_bulk` request, then retries the rejected ones."""
+        for attempt in range(self.max_retries + 1):
+            if not docs:
+                return
+            docs = await self._send(docs)
+            if docs:
+                self.retries += 1
+                await asyncio.sleep(0.01 * 2**attempt)
+        msg = f"{len(docs)} documents rejected after {self.max_retries} retries"
+        raise Exception(msg)
+
+    async def _send(self, docs):
+        body = bytearray()
+        for doc in docs:
+            body += json.dumps(
+                {"index": {"_index": INDEX_NAME, "_id": doc["_id"]}}
+            ).encode()
+            body += b"\n"
+            body += json.dumps(doc).encode()
+            body += b"\n"
+        self.bytes_sent += len(body)
+
+        async with self.session.post(
+            f"{self.url}/_bulk",
+            data=bytes(body),
+            headers={"Content-Type": "application/x-ndjson"},
+        ) as response:
+            result = await response.json()
+
+        if not result["errors"]:
+            return []
+        return [
+            doc
+            for doc, item in zip(docs, result["items"], strict=True)
+            if _status(item) == 429
+        ]
+
+
+async def sync(config, url):
+    source = SyntheticSource(DataSourceConfiguration({}), config)
+    writer = BulkWriter(url, config.bulk_size)
+    downloads = ConcurrentTasks(max_concurrency=config.concurrent_downloads)
+
+    async def _download_and_index(doc, lazy_download):
+        data = await lazy_download(doit=True, timestamp=doc["_timestamp"])
+        if data is not None:
+            doc.update(data)
+        await writer.index(doc)
+
+    async for doc, lazy_download in source.get_docs():
+        if lazy_download is None:
+            await writer.index(doc)
+        else:
+            await downloads.put(partial(_download_and_index, doc, lazy_download))
+
+    await downloads.join(raise_on_error=True)
+    await writer.flush()
+    await http_client_registry.close()
+    return writer
+
+
+def run_config(config, url):
+    """Runs one sync, in a fresh process."""
+    set_logger(logging.WARNING)
+
+    start = time.perf_counter()
+    writer = asyncio.run(sync(config, url))
+    duration = time.perf_counter() - start
+
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return {
+        "docs_per_second": config.docs / duration,
+        "bytes_per_second": writer.bytes_sent / duration,
+        "duration": duration,
+        "cpu_seconds": usage.ru_utime + usage.ru_stime,
+        # kilobytes on Linux, bytes on macOS
+        "peak_rss_mb": usage.ru_maxrss
+        / (1024 * 1024 if sys.platform == "darwin" else 1024),
+        "bulk_retries": writer.retries,
+    }
+
+
+async def run_suite(configs):
+    server = FakeElasticsearch()
+    url = await server.start()
+    loop = asyncio.get_running_loop()
+    results = {}
+
+    try:
+        for name, config in configs.items():
+            server.configure(config)
+            with ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            ) as executor:
+                result = await loop.run_in_executor(executor, run_config, config, url)
+
+            if server.indexed != config.docs:
+                msg = f"{name}: {server.indexed} documents indexed, {config.docs} expected"
+                raise Exception(msg)
+
+            results[name] = {"config": asdict(config), **result}
+            print(
+                f"{name}: {result['docs_per_second']:.0f} docs/s, "
+                f"{result['bytes_per_second'] / 1024 / 1024:.1f} MB/s, "
+                f"{result['cpu_seconds']:.2f}s CPU, "
+                f"{result['peak_rss_mb']:.0f} MB peak RSS, "
+                f"{result['bulk_retries']} bulk retries"
+            )
+    finally:
+        await server.stop()
+
+    return results
+
+
+def compare(results, baseline, max_regression):
+    """Prints the change of throughput from the baseline, returns the regressed configurations."""
+    regressions = []
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        before = baseline[name]["docs_per_second"]
+        change = result["docs_per_second"] / before - 1
+        print(
+            f"{name}: {before:.0f} -> {result['docs_per_second']:.0f} docs/s ({change:+.1%})"
+        )
+        if change < -max_regression:
+            regressions.append(name)
+    return regressions
+
+
+def main(args=None):
+    parser = ArgumentParser(formatter_class=ArgumentDefaultsHelpFormatter)
+    parser.add_argument(
+        "--configs",
+        nargs="+",
+        choices=list(SUITE),
+        default=list(SUITE),
+        help="Configurations to run",
+    )
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="Factor applied to document counts"
+    )
+    parser.add_argument("--baseline", help="Results file to compare with")
+    parser.add_argument("--save-baseline", help="File to write the results to")
+    parser.add_argument(
+        "--max-regression",
+        type=float,
+        default=DEFAULT_MAX_REGRESSION,
+        help="Drop of docs/s from the baseline considered a regression",
+    )
+    args = parser.parse_args(args=args)
+
+    configs = {
+        name: replace(SUITE[name], docs=max(1, int(SUITE[name].docs * args.scale)))
+        for name in args.configs
+    }
+    results = asyncio.run(run_suite(configs))
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as f:
+            json.dump(results, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if regressions := compare(results, baseline, args.max_regression):
+            print(f"Throughput regressed for: {', '.join(regressions)}")
+            return 1
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -82,7 +82,11 @@ def catch_stdout():
 @pytest.fixture
 def patch_logger(silent=True):
     class PatchedLogger(Logger):
-        def info(self, msg, *args, prefix=None, extra=None, exc_info=None):
+        def info(
+            self, msg, *args, prefix=None, extra=None, exc_info=None, sampler=None
+        ):
+            if callable(msg):
+                msg = msg()
             super(PatchedLogger, self).info(msg, *args)
 
     from connectors.logger import logger
@@ -5,6 +5,7 @@
 #
 
 import datetime
+import decimal
 import uuid
 
 import pytest
@@ -1383,3 +1384,311 @@ def test_basic_rule_format():
     short_format_str = format(basic_rule, Format.SHORT.value)
 
     assert len(verbose_format_str) > len(short_format_str)
+
+
+def basic_rule(id_, field, rule, value, policy=Policy.INCLUDE):
+    return BasicRule(
+        id_=id_, order=0, policy=policy, field=field, rule=rule, value=value
+    )
+
+
+def first_match_in_order(rules, document):
+    return next((rule for rule in rules if rule.matches(document)), None)
+
+
+@pytest.mark.parametrize(
+    "document, expected_rule_id",
+    [
+        ({"name": "foo", "size": 10}, "size-less"),
+        ({"name": "foo", "size": 20}, "name-equals-foo"),
+        ({"name": "bar", "size": 20}, "name-starts-with-b"),
+        ({"name": "baz"}, "name-starts-with-b"),
+        ({"name": "qux", "size": 2.0}, "size-less"),
+        ({"size": 20, "name": "baz"}, "name-starts-with-b"),
+        ({"size": 2, "created": datetime.datetime(2023, 1, 1)}, "size-less"),
+        ({"created": datetime.datetime(2023, 1, 1)}, "created-greater"),
+        ({"created": datetime.datetime(2021, 1, 1)}, None),
+        ({"name": "qux", "size": 30}, "name-equals-qux"),
+        ({"size": 20.0}, "size-equals-twenty"),
+        ({"name": None}, None),
+        ({"name": ["foo"]}, None),
+        ({"tags": "python"}, "tags-regex"),
+        ({}, None),
+    ],
+)
+def test_compiled_rules_match_the_first_rule_in_order(document, expected_rule_id):
+    rules = [
+        basic_rule("size-less", "size", Rule.LESS_THAN, "15"),
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        basic_rule("created-greater", "created", Rule.GREATER_THAN, "2022-01-01"),
+        basic_rule("name-starts-with-b", "name", Rule.STARTS_WITH, "ba"),
+        basic_rule("name-equals-qux", "name", Rule.EQUALS, "qux"),
+        basic_rule("size-equals-twenty", "size", Rule.EQUALS, "20"),
+        basic_rule("tags-regex", "tags", Rule.REGEX, "py.*n$"),
+        basic_rule("name-equals-foo-again", "name", Rule.EQUALS, "foo"),
+    ]
+    engine = BasicRuleEngine(rules)
+
+    rule = engine.compiled_rules.first_match(document)
+    expected_rule = first_match_in_order(rules, document)
+
+    assert rule is expected_rule
+    assert (rule.id_ if rule else None) == expected_rule_id
+
+
+def test_compiled_rules_stop_at_default_rule():
+    default_rule = basic_rule(BasicRule.DEFAULT_RULE_ID, "_", Rule.REGEX, ".*")
+    rules = [
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        default_rule,
+        basic_rule("name-equals-bar", "name", Rule.EQUALS, "bar"),
+    ]
+    engine = BasicRuleEngine(rules)
+
+    assert engine.compiled_rules.first_match({"name": "foo"}) is rules[0]
+    assert engine.compiled_rules.first_match({"name": "bar"}) is default_rule
+
+
+def test_engine_ignores_errors_of_rules_after_the_first_match():
+    rules = [
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        # comparing a list with a str raises a TypeError
+        basic_rule("tags-less", "tags", Rule.LESS_THAN, "a"),
+    ]
+    engine = BasicRuleEngine(rules)
+
+    assert engine.should_ingest({"tags": ["a"], "name": "foo"})
+    assert engine.rules_match_stats["name-equals-foo"] == RuleMatchStats(
+        Policy.INCLUDE, 1
+    )
+
+    with pytest.raises(TypeError):
+        engine.should_ingest({"tags": ["a"], "name": "bar"})
+
+
+def test_engine_matches_like_rules_in_order_for_many_rules():
+    rules = []
+    for i in range(50):
+        rules.append(basic_rule(f"equals-{i}", f"field-{i % 5}", Rule.EQUALS, str(i)))
+        rules.append(
+            basic_rule(
+                f"ends-with-{i}",
+                f"field-{i % 3}",
+                Rule.ENDS_WITH,
+                str(i),
+                policy=Policy.EXCLUDE,
+            )
+        )
+    engine = BasicRuleEngine(rules)
+
+    for i in range(200):
+        document = {f"field-{i % 4}": str(i), f"field-{i % 7}": i}
+        expected_rule = first_match_in_order(rules, document)
+
+        assert engine.compiled_rules.first_match(document) is expected_rule
+        assert engine.should_ingest(document) == (
+            expected_rule.is_include() if expected_rule else True
+        )
+
+
+@pytest.mark.parametrize(
+    "values",
+    [
+        ["50", "10", "30", "5", "70"],
+        ["50", "not a number", "30", "5"],
+        ["50", "nan", "30", "5"],
+    ],
+)
+def test_compiled_rules_find_first_greater_and_less_than_rule(values):
+    rules = []
+    for i, value in enumerate(values):
+        rules.append(basic_rule(f"greater-{i}", "size", Rule.GREATER_THAN, value))
+        rules.append(basic_rule(f"less-{i}", "name", Rule.LESS_THAN, value))
+    engine = BasicRuleEngine(rules)
+
+    for document in [
+        {"size": 0},
+        {"size": 7.5},
+        {"size": 40},
+        {"size": 100},
+        {"size": float("nan")},
+        {"name": "1"},
+        {"name": "6"},
+        {"name": "99"},
+    ]:
+        try:
+            expected_rule = first_match_in_order(rules, document)
+        except TypeError:
+            with pytest.raises(TypeError):
+                engine.should_ingest(document)
+        else:
+            assert engine.compiled_rules.first_match(document) is expected_rule
+
+
+def test_should_ingest_many_matches_should_ingest():
+    rules = [
+        basic_rule("size-less", "size", Rule.LESS_THAN, "15", policy=Policy.EXCLUDE),
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        basic_rule("name-starts-with-b", "name", Rule.STARTS_WITH, "b"),
+        basic_rule("size-equals-20", "size", Rule.EQUALS, "20", policy=Policy.EXCLUDE),
+    ]
+    documents = [
+        {"name": "foo", "size": 10},
+        {"name": "foo", "size": 20},
+        {"name": "bar", "size": 20},
+        {"name": "qux", "size": 20.0},
+        {"name": "qux"},
+        {"name": ["foo"]},
+        {},
+    ]
+    engine = BasicRuleEngine(rules)
+    reference_engine = BasicRuleEngine(rules)
+
+    mask, matches_count = engine.should_ingest_many(documents)
+
+    assert mask == [reference_engine.should_ingest(document) for document in documents]
+    assert mask == [False, True, True, False, True, True, True]
+    assert matches_count == {
+        "size-less": 1,
+        "name-equals-foo": 1,
+        "name-starts-with-b": 1,
+        "size-equals-20": 1,
+        BasicRule.DEFAULT_RULE_ID: 3,
+    }
+    assert engine.rules_match_stats == reference_engine.rules_match_stats
+
+
+@pytest.mark.parametrize("rules", [None, []])
+def test_should_ingest_many_without_rules(rules):
+    engine = BasicRuleEngine(rules)
+
+    mask, matches_count = engine.should_ingest_many([DOCUMENT_ONE, DOCUMENT_TWO])
+
+    assert mask == [True, True]
+    assert matches_count == {BasicRule.DEFAULT_RULE_ID: 2}
+    assert engine.rules_match_stats == {
+        BasicRule.DEFAULT_RULE_ID: RuleMatchStats(Policy.INCLUDE, 2)
+    }
+
+
+def test_should_ingest_many_falls_back_to_rules_in_order():
+    rules = [
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        basic_rule("tags-less", "tags", Rule.LESS_THAN, "a"),
+    ]
+    engine = BasicRuleEngine(rules)
+
+    mask, matches_count = engine.should_ingest_many([{"tags": ["a"], "name": "foo"}])
+
+    assert mask == [True]
+    assert matches_count == {"name-equals-foo": 1}
+
+
+def test_should_ingest_many_matches_should_ingest_for_many_rules():
+    rules = []
+    for i in range(50):
+        rules.append(basic_rule(f"less-{i}", f"field-{i % 4}", Rule.LESS_THAN, str(i)))
+        rules.append(
+            basic_rule(
+                f"contains-{i}",
+                f"field-{i % 3}",
+                Rule.CONTAINS,
+                str(i),
+                policy=Policy.EXCLUDE,
+            )
+        )
+    documents = [
+        {f"field-{i % 4}": str(i % 60), f"field-{i % 7}": i % 60} for i in range(300)
+    ]
+    engine = BasicRuleEngine(rules)
+    reference_engine = BasicRuleEngine(rules)
+
+    mask, _ = engine.should_ingest_many(documents)
+
+    assert mask == [reference_engine.should_ingest(document) for document in documents]
+    assert engine.rules_match_stats == reference_engine.rules_match_stats
+
+
+@pytest.mark.parametrize(
+    "value, other_value",
+    [
+        (0.0, -0.0),
+        (decimal.Decimal("1"), decimal.Decimal("1.0")),
+        (
+            datetime.datetime(2023, 1, 1, 12, tzinfo=datetime.timezone.utc),
+            datetime.datetime(
+                2023, 1, 1, 13, tzinfo=datetime.timezone(datetime.timedelta(hours=1))
+            ),
+        ),
+    ],
+)
+def test_should_ingest_many_matches_equal_values_printed_differently(
+    value, other_value
+):
+    # the values are equal, but the string rules match only one of them
+    rules = [
+        basic_rule("starts-with-minus", "field", Rule.STARTS_WITH, "-"),
+        basic_rule("contains-dot", "field", Rule.CONTAINS, ".", policy=Policy.EXCLUDE),
+        basic_rule(
+            "regex-offset", "field", Rule.REGEX, ".*[+]01:00$", policy=Policy.EXCLUDE
+        ),
+        basic_rule("match-all", "field", Rule.REGEX, ".*"),
+    ]
+    documents = [{"field": value}, {"field": other_value}, {"field": value}]
+    engine = BasicRuleEngine(rules)
+    reference_engine = BasicRuleEngine(rules)
+
+    mask, _ = engine.should_ingest_many(documents)
+
+    assert mask == [reference_engine.should_ingest(document) for document in documents]
+    assert mask[0] != mask[1]
+    assert engine.rules_match_stats == reference_engine.rules_match_stats
+
+
+def test_engine_profiles_rules():
+    rules = [
+        basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo"),
+        basic_rule("name-regex", "name", Rule.REGEX, "b.*", policy=Policy.EXCLUDE),
+    ]
+    engine = BasicRuleEngine(rules, profile=True)
+
+    assert engine.should_ingest({"name": "foo"})
+    assert not engine.should_ingest({"name": "bar"})
+    mask, _ = engine.should_ingest_many([{"name": "qux"}, {"other": "field"}])
+    assert mask == [True, True]
+
+    stats = engine.rules_stats()
+
+    assert stats[BasicRule.DEFAULT_RULE_ID] == {"policy": "include", "matches_count": 2}
+    assert stats["name-equals-foo"]["matches_count"] == 1
+    assert stats["name-equals-foo"]["calls"] == 4
+    assert stats["name-regex"]["matches_count"] == 1
+    assert stats["name-regex"]["calls"] == 3
+    for rule_id in ["name-equals-foo", "name-regex"]:
+        assert stats[rule_id]["max_time"] <= stats[rule_id]["total_time"]
+    assert set(engine.slowest_rules(count=2)) == {"name-equals-foo", "name-regex"}
+
+
+def test_engine_profiles_rules_without_matches():
+    engine = BasicRuleEngine(
+        [basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo")], profile=True
+    )
+
+    engine.should_ingest({"name": "bar"})
+
+    assert engine.rules_stats()["name-equals-foo"]["policy"] == "include"
+    assert engine.rules_stats()["name-equals-foo"]["matches_count"] == 0
+    assert engine.rules_stats()["name-equals-foo"]["calls"] == 1
+
+
+def test_engine_does_not_profile_by_default():
+    engine = BasicRuleEngine(
+        [basic_rule("name-equals-foo", "name", Rule.EQUALS, "foo")]
+    )
+
+    engine.should_ingest({"name": "foo"})
+
+    assert engine.rules_stats() == {
+        BasicRule.DEFAULT_RULE_ID: {"policy": "include", "matches_count": 0},
+        "name-equals-foo": {"policy": "include", "matches_count": 1},
+    }
@@ -4,7 +4,7 @@
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
 
-from unittest.mock import AsyncMock, Mock
+from unittest.mock import AsyncMock, Mock, patch
 
 import pytest
 
@@ -12,6 +12,7 @@ from connectors.filtering.basic_rule import BasicRule
 from connectors.filtering.validation import (
     AdvancedRulesValidator,
     BasicRuleAgainstSchemaValidator,
+    BasicRuleNoCatastrophicBacktrackingValidator,
     BasicRuleNoMatchAllRegexValidator,
     BasicRulesSetSemanticValidator,
     BasicRulesSetValidator,
@@ -21,9 +22,20 @@ from connectors.filtering.validation import (
     FilteringValidator,
     FilterValidationError,
     SyncRuleValidationResult,
+    ValidationResultsCache,
+    rule_content_hash,
+    validation_results_cache,
 )
 from connectors.protocol import Filter
 
+
+@pytest.fixture(autouse=True)
+def clear_validation_results_cache():
+    validation_results_cache.clear()
+    yield
+    validation_results_cache.clear()
+
+
 RULE_ONE_ID = 1
 RULE_ONE_VALIDATION_MESSAGE = "rule 1 is valid"
 
@@ -897,6 +909,54 @@ def test_basic_rule_validate_no_match_all_regex(basic_rule, should_be_valid):
         assert not BasicRuleNoMatchAllRegexValidator.validate(basic_rule).is_valid
 
 
+@pytest.mark.parametrize(
+    "regex, is_pathological",
+    [
+        ("abc", False),
+        ("^abc.*$", False),
+        ("[a-z]+@[a-z]+\\.com", False),
+        ("(foo|bar)+", False),
+        ("x{1,3}y+", False),
+        # invalid regexes are reported by other validators
+        ("(", False),
+        ("(a+)+b", True),
+        ("(?:a*)*", True),
+        ("(.*)*", True),
+        ("^(\\w+\\s?)*$", True),
+        ("(x+x+)+y", True),
+        ("(a|a)*", True),
+    ],
+)
+def test_basic_rule_detect_catastrophic_backtracking(regex, is_pathological):
+    assert (
+        BasicRuleNoCatastrophicBacktrackingValidator.is_pathological(regex)
+        is is_pathological
+    )
+
+
+@pytest.mark.parametrize(
+    "basic_rule, should_warn",
+    [
+        (basic_rule_json(merge_with={"rule": "regex", "value": "abc"}), False),
+        (basic_rule_json(merge_with={"rule": "regex", "value": "(a+)+b"}), True),
+        # only regex rules are evaluated as regexes
+        (basic_rule_json(merge_with={"rule": "contains", "value": "(a+)+b"}), False),
+    ],
+)
+def test_basic_rule_validate_no_catastrophic_backtracking(
+    basic_rule, should_warn, patch_logger
+):
+    # a slow regex is still a valid rule
+    assert BasicRuleNoCatastrophicBacktrackingValidator.validate(basic_rule).is_valid
+
+    if should_warn:
+        patch_logger.assert_present(
+            "uses the regex '(a+)+b', which contains nested or overlapping quantifiers"
+        )
+    else:
+        patch_logger.assert_not_present("may backtrack catastrophically")
+
+
 @pytest.mark.parametrize(
     "basic_rule, should_be_valid",
     [
@@ -1053,3 +1113,177 @@ async def test_filtering_validator_validate_single_advanced_rules_validator():
     )
 
     assert validation_result.state == FilteringValidationState.INVALID
+
+
+def test_rule_content_hash_ignores_key_order():
+    reordered_rule = dict(reversed(list(RULE_ONE.items())))
+
+    assert rule_content_hash(reordered_rule) == rule_content_hash(RULE_ONE)
+    assert rule_content_hash(RULE_ONE) != rule_content_hash(RULE_TWO)
+
+
+def test_validation_results_cache_evicts_least_recently_used():
+    cache = ValidationResultsCache(max_size=2)
+
+    cache.put("one", 1)
+    cache.put("two", 2)
+    assert cache.get("one") == 1
+
+    cache.put("three", 3)
+
+    assert len(cache) == 2
+    assert cache.get("two") is None
+    assert cache.get("one") == 1
+    assert cache.get("three") == 3
+    assert cache.hits == 3
+    assert cache.misses == 1
+
+
+def basic_rule_validator_fake():
+    return type(
+        "fake_basic_rule_validator",
+        (BasicRuleValidator,),
+        {
+            "validate": Mock(
+                side_effect=lambda rule: SyncRuleValidationResult.valid_result(
+                    rule["id"]
+                )
+            )
+        },
+    )
+
+
+def basic_rules_set_validator_fake():
+    return type(
+        "fake_basic_rules_set_validator",
+        (BasicRulesSetValidator,),
+        {"validate": Mock(return_value=[])},
+    )
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_only_validates_new_or_changed_rules():
+    validator = basic_rule_validator_fake()
+    filtering_validator = FilteringValidator([validator], [])
+
+    await filtering_validator.validate(FILTERING_TWO_BASIC_RULES_WITHOUT_ADVANCED_RULE)
+    assert validator.validate.call_count == 2
+
+    changed_rule = RULE_TWO | {"value": "other value"}
+    validation_result = await FilteringValidator([validator], []).validate(
+        Filter({"rules": [RULE_ONE, changed_rule]})
+    )
+
+    assert validation_result.state == FilteringValidationState.VALID
+    assert validator.validate.call_count == 3
+    validator.validate.assert_called_with(changed_rule)
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_revalidates_rules_set_when_a_rule_changes():
+    validator = basic_rules_set_validator_fake()
+
+    for _ in range(2):
+        await FilteringValidator([validator], []).validate(
+            FILTERING_TWO_BASIC_RULES_WITHOUT_ADVANCED_RULE
+        )
+    assert validator.validate.call_count == 1
+
+    await FilteringValidator([validator], []).validate(
+        Filter({"rules": [RULE_ONE, RULE_TWO | {"value": "other value"}]})
+    )
+    assert validator.validate.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_summarizes_only_new_or_changed_rules_of_a_set():
+    rule_summary = Mock(side_effect=BasicRulesSetSemanticValidator.rule_summary)
+    rule_one = RULE_ONE | {"id": "1"}
+    rule_two = RULE_TWO | {"id": "2"}
+
+    with patch.object(BasicRulesSetSemanticValidator, "rule_summary", rule_summary):
+        validation_result = await FilteringValidator(
+            [BasicRulesSetSemanticValidator], []
+        ).validate(Filter({"rules": [rule_one, rule_two | {"value": "other"}]}))
+        assert validation_result.state == FilteringValidationState.VALID
+        assert rule_summary.call_count == 2
+
+        # the edited rule duplicates the unchanged one
+        validation_result = await FilteringValidator(
+            [BasicRulesSetSemanticValidator], []
+        ).validate(Filter({"rules": [rule_one, rule_two]}))
+
+    assert validation_result.state == FilteringValidationState.INVALID
+    assert rule_summary.call_count == 3
+    rule_summary.assert_called_with(rule_two)
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_warns_about_backtracking_on_every_validation(
+    patch_logger,
+):
+    filtering = Filter(
+        {"rules": [basic_rule_json(merge_with={"rule": "regex", "value": "(a+)+b"})]}
+    )
+
+    for _ in range(2):
+        await FilteringValidator(
+            [BasicRuleNoCatastrophicBacktrackingValidator], []
+        ).validate(filtering)
+
+    warnings = [
+        message
+        for message in patch_logger.logs
+        if "may backtrack catastrophically" in str(message)
+    ]
+    assert len(warnings) == 2
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_without_cache():
+    validator = basic_rule_validator_fake()
+
+    for _ in range(2):
+        await FilteringValidator([validator], [], cache=None).validate(
+            FILTERING_TWO_BASIC_RULES_WITHOUT_ADVANCED_RULE
+        )
+
+    assert validator.validate.call_count == 4
+
+
+ADVANCED_RULES_FILTERING = Filter(
+    {
+        "basic_rules": [],
+        "advanced_snippet": {"value": {"query": "SELECT * FROM table;"}},
+    }
+)
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_does_not_cache_advanced_rules_by_default():
+    validator = validator_fakes(
+        [SyncRuleValidationResult.valid_result(ADVANCED_RULE_ONE_ID)],
+        is_basic_rule_validator=False,
+    )[0]()
+
+    for _ in range(2):
+        await FilteringValidator([], [validator]).validate(ADVANCED_RULES_FILTERING)
+
+    assert validator.validate.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_filtering_validator_caches_advanced_rules_with_cache_key():
+    validator = validator_fakes(
+        [SyncRuleValidationResult.valid_result(ADVANCED_RULE_ONE_ID)],
+        is_basic_rule_validator=False,
+    )[0]()
+    validator.cache_key = Mock(return_value="host")
+
+    for _ in range(2):
+        await FilteringValidator([], [validator]).validate(ADVANCED_RULES_FILTERING)
+    assert validator.validate.call_count == 1
+
+    validator.cache_key = Mock(return_value="other host")
+    await FilteringValidator([], [validator]).validate(ADVANCED_RULES_FILTERING)
+    assert validator.validate.call_count == 2
@@ -8,11 +8,12 @@ import functools
 import os
 from collections import defaultdict
 from copy import deepcopy
-from unittest.mock import Mock
+from unittest.mock import AsyncMock, Mock
 
 import pytest
 
 from connectors.config import load_config
+from connectors.loop_monitor import LoopMonitor
 from connectors.services.base import BaseService, MultiService, get_services
 
 HERE = os.path.dirname(__file__)
@@ -179,6 +180,34 @@ async def test_multiservice_stop_gracefully_stops_service_that_takes_too_long_to
     )  # we're not supposed to cancel it as it's already stopping
 
 
+@pytest.mark.asyncio
+async def test_multiservice_run_starts_and_stops_loop_monitor():
+    service = StubService()
+    loop_monitor = Mock()
+    loop_monitor.stop = AsyncMock()
+
+    multiservice = MultiService(service, loop_monitor=loop_monitor)
+
+    asyncio.get_event_loop().call_later(
+        0.1, functools.partial(multiservice.shutdown, "SIGTERM")
+    )
+
+    await multiservice.run()
+
+    loop_monitor.start.assert_called_once()
+    loop_monitor.stop.assert_awaited_once()
+
+
+def test_get_services_with_loop_monitor():
+    local_config = defaultdict(dict)
+    local_config["service"] = {"loop_monitor_enabled": True}
+
+    multiservice = get_services([], config=local_config)
+
+    assert isinstance(multiservice._loop_monitor, LoopMonitor)
+    assert get_services([], config=defaultdict(dict))._loop_monitor is None
+
+
 config = {
     "elasticsearch": {},
     "service": {},
@@ -1,17 +1,25 @@
+import json
 from contextlib import asynccontextmanager
 from copy import copy
 from unittest import mock
-from unittest.mock import AsyncMock, patch
+from unittest.mock import AsyncMock, Mock, patch
+from urllib.parse import parse_qs, urlsplit
 
 import pytest
 
+from connectors.filtering.basic_rule import BasicRule, Policy, Rule
 from connectors.sources.bitbucket import (
     BITBUCKET_CLOUD,
+    BYTES_RECEIVED,
+    COMMIT_FIELDS,
     COMMIT_SCHEMA,
     PULL_REQUEST_SCHEMA,
     BitBucketClient,
     BitBucketDataSource,
     ConfigurableFieldValueError,
+    bbql_string,
+    fields_projection,
+    listing_url,
 )
 from tests.commons import AsyncIterator
 from tests.sources.support import create_source
@@ -25,6 +33,9 @@ class JSONAsyncMock(AsyncMock):
     async def json(self):
         return self._json
 
+    async def read(self):
+        return json.dumps(self._json).encode()
+
 
 RESPONSE_WORKSPACE = {
     "values": [
@@ -79,6 +90,7 @@ RESPONSE_COMMIT = {
 }
 
 EXPECTED_WORKSPACE = "connectortrail"
+TIMESTAMP = "2024-03-27T13:06:46.636917+00:00"
 
 
 EXPECTED_PULL_REQUEST = {
@@ -242,6 +254,131 @@ async def test_get_session():
         assert first_session is second_session
 
 
+@pytest.mark.asyncio
+async def test_close_releases_session():
+    async with create_bitbucket_source() as source:
+        session = source.bitbucket_client._get_session()
+
+        await source.close()
+
+        assert session.closed
+        assert source.bitbucket_client.session is None
+
+
+@pytest.mark.asyncio
+async def test_paginated_api_call_prefetches_remaining_pages_in_order():
+    first_url = "https://api.bitbucket.org/2.0/workspaces?pagelen=2"
+    pages = {
+        first_url: {"values": [1, 2], "size": 5, "page": 1, "pagelen": 2, "next": "x"},
+        f"{first_url}&page=2": {"values": [3, 4], "page": 2},
+        f"{first_url}&page=3": {"values": [5], "page": 3},
+    }
+
+    async def _get_json(url):
+        return pages[url]
+
+    async with create_bitbucket_source() as source:
+        client = source.bitbucket_client
+        with patch.object(client, "_get_json", side_effect=_get_json) as get_json:
+            responses = [
+                response async for response in client.paginated_api_call(first_url)
+            ]
+
+        assert [response["values"] for response in responses] == [[1, 2], [3, 4], [5]]
+        assert get_json.call_count == 3
+
+
+@pytest.mark.asyncio
+async def test_paginated_api_call_follows_next_links_when_size_is_unknown():
+    pages = {
+        "first": {"values": [1], "next": "second"},
+        "second": {"values": [2], "next": "third"},
+        "third": {"values": [3]},
+    }
+
+    async def _get_json(url):
+        return pages[url]
+
+    async with create_bitbucket_source() as source:
+        client = source.bitbucket_client
+        with patch.object(client, "_get_json", side_effect=_get_json):
+            responses = [
+                response async for response in client.paginated_api_call("first")
+            ]
+
+        assert [response["values"] for response in responses] == [[1], [2], [3]]
+
+
+@pytest.mark.asyncio
+async def test_paginated_api_call_stops_when_prefetched_page_fails():
+    first_url = "https://api.bitbucket.org/2.0/workspaces"
+    pages = {
+        first_url: {"values": [1], "size": 3, "page": 1, "pagelen": 1, "next": "x"},
+        f"{first_url}?page=3": {"values": [3], "page": 3},
+    }
+
+    async def _get_json(url):
+        return pages[url]
+
+    async with create_bitbucket_source() as source:
+        client = source.bitbucket_client
+        with patch.object(client, "_get_json", side_effect=_get_json):
+            responses = [
+                response async for response in client.paginated_api_call(first_url)
+            ]
+
+        assert [response["values"] for response in responses] == [[1]]
+
+
+def test_fields_projection():
+    assert (
+        fields_projection(COMMIT_SCHEMA, ["repository.full_name"])
+        == "next,page,pagelen,size,values.hash,values.date,values.type,values.message,values.repository.full_name"
+    )
+
+
+def test_listing_url():
+    assert (
+        listing_url("repositories/workspace/repo/commits", fields=COMMIT_FIELDS)
+        == f"https://api.bitbucket.org/2.0/repositories/workspace/repo/commits?pagelen=100&fields={COMMIT_FIELDS}"
+    )
+
+
+@pytest.mark.asyncio
+async def test_get_json_records_bytes_received():
+    async with create_bitbucket_source() as source:
+        client = source.bitbucket_client
+        async_response = AsyncMock()
+        async_response.__aenter__ = AsyncMock(
+            return_value=JSONAsyncMock(RESPONSE_COMMIT)
+        )
+        with mock.patch("aiohttp.ClientSession.get", return_value=async_response):
+            assert await client._get_json("url") == RESPONSE_COMMIT
+
+        assert client.counters.get(BYTES_RECEIVED) == len(
+            json.dumps(RESPONSE_COMMIT).encode()
+        )
+
+
+@pytest.mark.asyncio
+async def test_bytes_per_document():
+    async with create_bitbucket_source() as source:
+        assert source.bytes_per_document() == 0
+
+        source.bitbucket_client.counters.increment(BYTES_RECEIVED, 1000)
+        with mock.patch.object(
+            BitBucketDataSource,
+            "_fetch_commits",
+            return_value=AsyncIterator([copy(EXPECTED_COMMIT), copy(EXPECTED_COMMIT)]),
+        ), mock.patch.object(
+            BitBucketDataSource, "_fetch_files", return_value=AsyncIterator([])
+        ):
+            async for _ in source.get_docs():
+                pass
+
+        assert source.bytes_per_document() == 500
+
+
 @pytest.mark.asyncio
 async def test_fetch_workspaces():
     async with create_bitbucket_source() as source:
@@ -308,7 +445,7 @@ async def test_prepare_commit_doc():
 @patch.object(
     BitBucketDataSource,
     "_fetch_repository_name",
-    return_value=AsyncIterator([EXPECTED_REPOSITORY_NAME1]),
+    return_value=AsyncIterator([{"full_name": EXPECTED_REPOSITORY_NAME1}]),
 )
 async def test_fetch_commits_when_wildcard(workspace_patch):
     async with create_bitbucket_source() as source:
@@ -316,10 +453,15 @@ async def test_fetch_commits_when_wildcard(workspace_patch):
             BitBucketClient,
             "paginated_api_call",
             return_value=AsyncIterator([RESPONSE_COMMIT]),
-        ):
+        ) as paginated_api_call:
             async for response in source._fetch_commits():
                 assert response == EXPECTED_COMMIT
 
+        url = paginated_api_call.call_args.kwargs["url"]
+        assert urlsplit(url).path.endswith(
+            f"/repositories/{EXPECTED_REPOSITORY_NAME1}/commits"
+        )
+
 
 @pytest.mark.asyncio
 async def test_fetch_commits_when_not_wildcard():
@@ -356,52 +498,53 @@ async def test_fetch_repository_name(self):
 @pytest.mark.asyncio
 @patch.object(
     BitBucketDataSource,
-    "_fetch_workspaces",
-    return_value=AsyncIterator([EXPECTED_WORKSPACE]),
-)
-@patch.object(
-    BitBucketDataSource,
-    "_fetch_files_from_folder",
-    return_value=AsyncIterator([EXPECTED_FILE_INSIDE_FOLDER]),
+    "_fetch_repository_name",
+    return_value=AsyncIterator([RESPONSE_REPOSITORY.get("values")[0]]),
 )
-async def test_fetch_files_inside_a_folder_when_repository_input_is_wildcard(
-    workspace_patch, files_inside_folder_patch
+@patch("connectors.sources.bitbucket.iso_utc", return_value=TIMESTAMP)
+async def test_fetch_files_when_repository_input_is_wildcard(
+    iso_utc_patch, repository_patch
 ):
     async with create_bitbucket_source() as source:
         with mock.patch.object(
-            BitBucketClient,
-            "paginated_api_call",
-            return_value=AsyncIterator([RESPONSE_FILE_INSIDE_FOLDER]),
-        ):
-            async for file in source._fetch_files():
-                assert file == EXPECTED_FILE_INSIDE_FOLDER
+            BitBucketDataSource,
+            "_walk_source_tree",
+            return_value=AsyncIterator([EXPECTED_FILE_INSIDE_FOLDER]),
+        ) as walk_source_tree:
+            files = [file async for file, _ in source._fetch_files()]
+
+        assert files == [EXPECTED_FILE_DOC]
+        walk_source_tree.assert_called_once_with(
+            "https://api.bitbucket.org/2.0/repositories/connectortrail/repo1/src"
+        )
 
 
 @pytest.mark.asyncio
-@patch.object(
-    BitBucketDataSource,
-    "_fetch_workspaces",
-    return_value=AsyncIterator([EXPECTED_WORKSPACE]),
-)
-@patch.object(
-    BitBucketDataSource,
-    "_fetch_files_from_folder",
-    return_value=AsyncIterator([EXPECTED_FILE_INSIDE_FOLDER]),
-)
-async def test_fetch_files_inside_a_folder_when_repository_input_is_not_wildcard(
-    workspace_patch, files_inside_folder_patch
-):
+@patch("connectors.sources.bitbucket.iso_utc", return_value=TIMESTAMP)
+async def test_fetch_files_when_repository_input_is_not_wildcard(iso_utc_patch):
     async with create_bitbucket_source() as source:
         source.configuration.get_field("repositories").value = ["connectortrail/repo1"]
         with mock.patch.object(
-            BitBucketClient,
-            "paginated_api_call",
-            return_value=AsyncIterator([RESPONSE_FILE_INSIDE_FOLDER]),
-        ):
-            async for file in source._fetch_files():
-                assert file == EXPECTED_FILE_INSIDE_FOLDER
+            BitBucketDataSource,
+            "_walk_source_tree",
+            return_value=AsyncIterator([EXPECTED_FILE_INSIDE_FOLDER]),
+        ) as walk_source_tree:
+            files = [file async for file, _ in source._fetch_files()]
+
+        assert files == [EXPECTED_FILE_DOC]
+        walk_source_tree.assert_called_once_with(
+            "https://api.bitbucket.org/2.0/repositories/connectortrail/repo1/src"
+        )
 
 
+EXPECTED_FILE_DOC = {
+    "_id": "connectortrail/repo1/om/first.py",
+    "_timestamp": TIMESTAMP,
+    "type": "commit_file",
+    "path": "om/first.py",
+    "repository_name": "connectortrail/repo1",
+}
+
 RESPONSE_FOLDER = {
     "path": "om",
     "type": "commit_directory",
@@ -412,19 +555,6 @@ RESPONSE_FOLDER = {
     },
 }
 
-
-@pytest.mark.asyncio
-async def test_fetch_files_from_folder_when_file_is_inside_more_than_one_folder():
-    async with create_bitbucket_source() as source:
-        with mock.patch.object(
-            BitBucketClient,
-            "paginated_api_call",
-            return_value=AsyncIterator([RESPONSE_FILE_INSIDE_FOLDER]),
-        ):
-            async for file in source._fetch_files_from_folder(RESPONSE_FOLDER):
-                assert file == EXPECTED_FILE_INSIDE_FOLDER
-
-
 RESPONSE_FILE = {
     "values": [
         {
@@ -443,27 +573,191 @@ RESPONSE_FILE = {
     ]
 }
 
-EXPECTED_FILE = {
-    "_id": "-9172225332661435081",
-    "_timestamp": "2024-03-27T13:06:46.636917+00:00",
-    "filename": "ContextManagerExample.py",
-    "type": "commit_file",
-    "file_type": "text/x-python",
-    "file_size": 546,
-    "path": "ContextManagerExample.py",
+SOURCE_TREE_ROOT = "https://api.bitbucket.org/2.0/repositories/connectortrail/repo1/src"
+SOURCE_TREE = {
+    # the root listing already contains the content of "om", but not of "om/deep"
+    SOURCE_TREE_ROOT: [
+        RESPONSE_FILE["values"][0],
+        RESPONSE_FOLDER,
+        {"path": "om/first.py", "type": "commit_file"},
+        {
+            "path": "om/deep",
+            "type": "commit_directory",
+            "links": {"self": {"href": "deep"}},
+        },
+    ],
+    "deep": [{"path": "om/deep/second.py", "type": "commit_file"}],
 }
 
 
-# @pytest.mark.asyncio
-# async def test_fetch_files_from_folder_when_file_is_inside_one_folder():
-#     async with create_bitbucket_source() as source:
-#         with mock.patch.object(
-#             BitBucketClient,
-#             "paginated_api_call",
-#             return_value=AsyncIterator([RESPONSE_FILE]),
-#         ):
-#             async for file in source._fetch_files_from_folder(RESPONSE_FOLDER):
-#                 assert file == EXPECTED_FILE
+async def list_source_tree(url):
+    return SOURCE_TREE[url]
+
+
+@pytest.mark.asyncio
+async def test_walk_source_tree_only_lists_directories_missing_from_a_listing():
+    async with create_bitbucket_source() as source:
+        with mock.patch.object(
+            source, "_list_directory", side_effect=list_source_tree
+        ) as list_directory:
+            files = [
+                file["path"]
+                async for file in source._walk_source_tree(SOURCE_TREE_ROOT)
+            ]
+
+        assert files == ["ContextManagerExample.py", "om/first.py", "om/deep/second.py"]
+        assert list_directory.call_count == 2
+
+
+@pytest.mark.asyncio
+async def test_walk_source_tree_with_max_tree_depth():
+    async with create_bitbucket_source() as source:
+        source.configuration.get_field("max_tree_depth").value = 1
+        with mock.patch.object(
+            source, "_list_directory", side_effect=list_source_tree
+        ) as list_directory:
+            files = [
+                file["path"]
+                async for file in source._walk_source_tree(SOURCE_TREE_ROOT)
+            ]
+
+        assert files == ["ContextManagerExample.py", "om/first.py"]
+        list_directory.assert_called_once()
+
+
+@pytest.mark.asyncio
+async def test_walk_source_tree_with_max_file_count():
+    async with create_bitbucket_source() as source:
+        source.configuration.get_field("max_file_count").value = 2
+        with mock.patch.object(source, "_list_directory", side_effect=list_source_tree):
+            files = [
+                file["path"]
+                async for file in source._walk_source_tree(SOURCE_TREE_ROOT)
+            ]
+
+        assert files == ["ContextManagerExample.py", "om/first.py"]
+
+
+@pytest.mark.asyncio
+async def test_list_directory_requests_nested_directories():
+    async with create_bitbucket_source() as source:
+        with mock.patch.object(
+            BitBucketClient,
+            "paginated_api_call",
+            return_value=AsyncIterator([RESPONSE_FILE_INSIDE_FOLDER, RESPONSE_FILE]),
+        ) as paginated_api_call:
+            entries = await source._list_directory(SOURCE_TREE_ROOT)
+
+        assert (
+            entries == RESPONSE_FILE_INSIDE_FOLDER["values"] + RESPONSE_FILE["values"]
+        )
+        assert "max_depth=3" in paginated_api_call.call_args.kwargs["url"]
+        assert "q=" not in paginated_api_call.call_args.kwargs["url"]
+
+
+def test_bbql_string():
+    assert bbql_string('docs/"quoted"\\name.md') == '"docs/\\"quoted\\"\\\\name.md"'
+
+
+def path_rule(rule=Rule.EQUALS, field="path", value="README.md"):
+    return BasicRule(
+        id_="1", order=1, policy=Policy.EXCLUDE, field=field, rule=rule, value=value
+    )
+
+
+@pytest.mark.parametrize(
+    "basic_rule, can_push_down",
+    [
+        (path_rule(), True),
+        (path_rule(rule=Rule.STARTS_WITH), False),
+        (path_rule(field="repository_name"), False),
+    ],
+)
+@pytest.mark.asyncio
+async def test_can_push_down_basic_rule(basic_rule, can_push_down):
+    async with create_bitbucket_source() as source:
+        assert source.can_push_down_basic_rule(basic_rule) is can_push_down
+
+
+@pytest.mark.asyncio
+async def test_list_directory_filters_pushed_down_paths():
+    async with create_bitbucket_source() as source:
+        source.pushed_down_basic_rules = [
+            path_rule(value="README.md"),
+            path_rule(value="docs/index.md"),
+        ]
+        with mock.patch.object(
+            BitBucketClient,
+            "paginated_api_call",
+            return_value=AsyncIterator([RESPONSE_FILE]),
+        ) as paginated_api_call:
+            await source._list_directory(SOURCE_TREE_ROOT)
+
+        query = parse_qs(urlsplit(paginated_api_call.call_args.kwargs["url"]).query)
+        assert query["q"] == [
+            'type = "commit_directory" OR (path != "README.md" AND path != "docs/index.md")'
+        ]
+
+
+@pytest.mark.asyncio
+async def test_get_content():
+    async with create_bitbucket_source() as source:
+        with mock.patch.object(
+            source,
+            "download_and_extract_file",
+            return_value={"_id": "id", "_timestamp": TIMESTAMP, "body": "content"},
+        ) as download_and_extract_file:
+            content = await source.get_content(
+                RESPONSE_FILE["values"][0], "id", timestamp=TIMESTAMP, doit=True
+            )
+
+        assert content == {"_id": "id", "_timestamp": TIMESTAMP, "body": "content"}
+        document, filename, file_extension, _ = download_and_extract_file.call_args.args
+        assert document == {"_id": "id", "_timestamp": TIMESTAMP}
+        assert filename == "ContextManagerExample.py"
+        assert file_extension == ".py"
+
+
+@pytest.mark.asyncio
+async def test_get_content_streams_file_from_self_link():
+    async with create_bitbucket_source() as source:
+        response = Mock()
+        response.content.iter_chunked = Mock(return_value=AsyncIterator([b"chunk"]))
+        with mock.patch.object(
+            BitBucketClient, "api_call", return_value=AsyncIterator([response])
+        ) as api_call, mock.patch.object(
+            source,
+            "handle_content_extraction_in_memory",
+            side_effect=lambda doc, *_: doc | {"body": "chunk"},
+        ):
+            content = await source.get_content(
+                RESPONSE_FILE["values"][0], "id", timestamp=TIMESTAMP, doit=True
+            )
+
+        assert content == {"_id": "id", "_timestamp": TIMESTAMP, "body": "chunk"}
+        api_call.assert_called_once_with(
+            url=RESPONSE_FILE["values"][0]["links"]["self"]["href"]
+        )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "file_data, doit",
+    [
+        (RESPONSE_FILE["values"][0], False),
+        ({"path": "empty.py", "size": 0}, True),
+        ({"path": "archive.zip", "size": 10}, True),
+        ({"path": "huge.txt", "size": 100 * 1024 * 1024}, True),
+    ],
+)
+async def test_get_content_when_file_cannot_be_downloaded(file_data, doit):
+    async with create_bitbucket_source() as source:
+        with mock.patch.object(
+            source, "download_and_extract_file"
+        ) as download_and_extract_file:
+            assert await source.get_content(file_data, "id", doit=doit) is None
+
+        download_and_extract_file.assert_not_called()
 
 
 @pytest.mark.asyncio
@@ -472,10 +766,18 @@ EXPECTED_FILE = {
     "_fetch_commits",
     return_value=AsyncIterator([[copy(EXPECTED_COMMIT), None]]),
 )
-async def test_get_docs(commit_patch):
+@mock.patch.object(
+    BitBucketDataSource,
+    "_fetch_files",
+    return_value=AsyncIterator([(EXPECTED_FILE_DOC, "lazy_download")]),
+)
+async def test_get_docs(files_patch, commit_patch):
     async with create_bitbucket_source() as source:
-        expected_responses = [[EXPECTED_COMMIT, None]]
+        expected_responses = [
+            ([EXPECTED_COMMIT, None], None),
+            (EXPECTED_FILE_DOC, "lazy_download"),
+        ]
         documents = []
-        async for item, _ in source.get_docs():
-            documents.append(item)
+        async for item, lazy_download in source.get_docs():
+            documents.append((item, lazy_download))
         assert documents == expected_responses
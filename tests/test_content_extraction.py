@@ -3,11 +3,23 @@
 # or more contributor license agreements. Licensed under the Elastic License 2.0;
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
-from unittest.mock import mock_open, patch
+import asyncio
+from unittest.mock import AsyncMock, mock_open, patch
 
 import pytest
 
-from connectors.content_extraction import ContentExtraction
+from connectors.content_extraction import (
+    EXTRACTED_BYTES,
+    EXTRACTED_FILES,
+    MAX_QUEUE_WAIT_TIME,
+    MB,
+    TEXT_CACHE_HITS,
+    ContentExtraction,
+    ExtractedTextCache,
+    ExtractionScheduler,
+    PlainTextExtraction,
+    decode_text,
+)
 
 
 @pytest.mark.parametrize(
@@ -141,3 +153,242 @@ async def test_extract_text_when_response_is_200_with_error_logs_warning(
         patch_logger.assert_present(
             "Extraction service could not parse `notreal.txt'. Status: [200]; oh no!: I'm all messed up..."
         )
+
+
+def test_timeout_for_grows_with_file_size():
+    with patch(
+        "connectors.content_extraction.ContentExtraction.get_extraction_config",
+        return_value={
+            "host": "http://localhost:8090",
+            "timeout": 10,
+            "timeout_per_mb": 3,
+        },
+    ):
+        extraction_service = ContentExtraction()
+
+    assert extraction_service.timeout_for(0) == 10
+    assert extraction_service.timeout_for(10 * MB) == 40
+
+
+@pytest.mark.asyncio
+async def test_extract_text_records_stats(tmp_path):
+    filepath = tmp_path / "file.txt"
+    filepath.write_bytes(b"x" * 1024)
+
+    with patch(
+        "connectors.content_extraction.ContentExtraction.get_extraction_config",
+        return_value={"host": "http://localhost:8090", "timeout": 10},
+    ):
+        extraction_service = ContentExtraction()
+
+    extraction_service.send_file = AsyncMock(return_value="text")
+
+    for _ in range(2):
+        assert await extraction_service.extract_text(str(filepath), "file.txt") == (
+            "text"
+        )
+
+    stats = extraction_service.stats()
+    assert stats[EXTRACTED_FILES] == 2
+    assert stats[EXTRACTED_BYTES] == 2048
+    assert stats[MAX_QUEUE_WAIT_TIME] >= 0
+    extraction_service.send_file.assert_awaited_with(
+        str(filepath), "file.txt", timeout=10 + 2 * 1024 / MB, data=None
+    )
+
+
+async def _hold_slot(scheduler, key, started, release):
+    async with scheduler.slot(key):
+        started.append(key)
+        await release.wait()
+
+
+@pytest.mark.asyncio
+async def test_scheduler_bounds_in_flight_requests():
+    scheduler = ExtractionScheduler(max_concurrent_requests=2)
+    started = []
+    release = asyncio.Event()
+
+    tasks = [
+        asyncio.create_task(_hold_slot(scheduler, "sync", started, release))
+        for _ in range(5)
+    ]
+    await asyncio.sleep(0)
+
+    assert len(started) == 2
+    assert scheduler.in_flight() == 2
+    assert scheduler.queued() == 3
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert len(started) == 5
+    assert scheduler.in_flight() == 0
+    assert scheduler.queued() == 0
+
+
+@pytest.mark.asyncio
+async def test_scheduler_takes_turns_between_syncs():
+    scheduler = ExtractionScheduler(max_concurrent_requests=1)
+    started = []
+    release = asyncio.Event()
+
+    # the first sync queues all of its files before the second sync starts
+    keys = ["first"] * 4 + ["second"] * 2
+    tasks = []
+    for key in keys:
+        tasks.append(asyncio.create_task(_hold_slot(scheduler, key, started, release)))
+        await asyncio.sleep(0)
+
+    release.set()
+    await asyncio.gather(*tasks)
+
+    assert started == ["first", "first", "second", "first", "second", "first"]
+
+
+@pytest.mark.asyncio
+async def test_scheduler_skips_cancelled_requests():
+    scheduler = ExtractionScheduler(max_concurrent_requests=1)
+    started = []
+    release = asyncio.Event()
+
+    first = asyncio.create_task(_hold_slot(scheduler, "first", started, release))
+    await asyncio.sleep(0)
+    cancelled = asyncio.create_task(_hold_slot(scheduler, "second", started, release))
+    third = asyncio.create_task(_hold_slot(scheduler, "third", started, release))
+    await asyncio.sleep(0)
+
+    cancelled.cancel()
+    await asyncio.sleep(0)
+    assert scheduler.queued() == 1
+
+    release.set()
+    await asyncio.gather(first, third)
+
+    assert started == ["first", "third"]
+    assert scheduler.in_flight() == 0
+
+
+def test_extracted_text_cache_evicts_least_recently_used():
+    cache = ExtractedTextCache(max_size=100)
+    cache.put("one", "a" * 1000)
+    cache.put("two", "b" * 1000)
+    assert cache.get("one") == "a" * 1000
+
+    # compressed texts are small, a random-ish text takes most of the cache
+    cache.put("three", "".join(str(i) for i in range(60)))
+
+    assert cache.size() <= 100
+    assert cache.get("two") is None
+    assert cache.get("one") == "a" * 1000
+
+
+def test_extracted_text_cache_skips_texts_larger_than_cache():
+    cache = ExtractedTextCache(max_size=0)
+    cache.put("one", "text")
+
+    assert cache.get("one") is None
+    assert len(cache) == 0
+
+
+@pytest.mark.asyncio
+async def test_extract_text_uses_text_cache(tmp_path):
+    filepath = tmp_path / "file.txt"
+    filepath.write_bytes(b"content")
+
+    with patch(
+        "connectors.content_extraction.ContentExtraction.get_extraction_config",
+        return_value={"host": "http://localhost:8090"},
+    ):
+        extraction_service = ContentExtraction(text_cache=ExtractedTextCache())
+
+    extraction_service.send_file = AsyncMock(side_effect=["text", "other text"])
+
+    for _ in range(2):
+        text = await extraction_service.extract_text(
+            str(filepath), "file.txt", content_hash="hash"
+        )
+        assert text == "text"
+
+    extraction_service.send_file.assert_awaited_once()
+    assert extraction_service.stats()[TEXT_CACHE_HITS] == 1
+
+    # content without hash is always extracted
+    assert (
+        await extraction_service.extract_text(str(filepath), "file.txt") == "other text"
+    )
+
+
+@pytest.mark.asyncio
+async def test_extract_text_sends_data_kept_in_memory():
+    with patch(
+        "connectors.content_extraction.ContentExtraction.get_extraction_config",
+        return_value={
+            "host": "http://localhost:8090",
+            "timeout": 10,
+            "use_file_pointers": True,
+        },
+    ):
+        extraction_service = ContentExtraction()
+
+    extraction_service.send_file = AsyncMock(return_value="text")
+    extraction_service.send_filepointer = AsyncMock()
+
+    assert await extraction_service.extract_text(None, "file.txt", data=b"data") == (
+        "text"
+    )
+
+    extraction_service.send_filepointer.assert_not_awaited()
+    extraction_service.send_file.assert_awaited_once_with(
+        None, "file.txt", timeout=10 + 2 * 4 / MB, data=b"data"
+    )
+    assert extraction_service.stats()[EXTRACTED_BYTES] == 4
+
+
+@pytest.mark.parametrize(
+    "content, expected_text",
+    [
+        (b"plain", "plain"),
+        ("zażółć".encode(), "zażółć"),
+        ("café".encode("cp1252"), "café"),
+        (b"\xef\xbb\xbfwith bom", "with bom"),
+        ("utf-16".encode("utf-16"), "utf-16"),
+        ("utf-32".encode("utf-32"), "utf-32"),
+        (b"\x81\x8d", "\x81\x8d"),
+        (b"PK\x03\x04\x00\x00", None),
+    ],
+)
+def test_decode_text(content, expected_text):
+    assert decode_text(content) == expected_text
+
+
+@pytest.mark.parametrize(
+    "file_extension, file_size, can_extract",
+    [
+        (".txt", 10, True),
+        (".MD", 10, True),
+        (".html", 10, True),
+        (".pdf", 10, False),
+        (".txt", 11, False),
+    ],
+)
+def test_plain_text_extraction_can_extract(file_extension, file_size, can_extract):
+    assert (
+        PlainTextExtraction(max_file_size=10).can_extract(file_extension, file_size)
+        is can_extract
+    )
+
+
+@pytest.mark.asyncio
+async def test_plain_text_extraction_extract_text(tmp_path):
+    filepath = tmp_path / "index.html"
+    filepath.write_bytes(b"<html><body><p>Hello</p></body></html>")
+    plain_text_extraction = PlainTextExtraction()
+
+    assert await plain_text_extraction.extract_text(".md", content=b"# Title") == (
+        "# Title"
+    )
+    assert (
+        await plain_text_extraction.extract_text(".html", filepath=str(filepath))
+    ).strip() == "Hello"
+    assert await plain_text_extraction.extract_text(".txt", content=b"\x00\x01") is None
@@ -0,0 +1,319 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+import asyncio
+import datetime
+import gzip
+import json
+from unittest.mock import patch
+
+import pytest
+
+from connectors.es.sink import (
+    BIN_DOCS_DOWNLOADED,
+    CREATES_QUEUED,
+    DELETES_QUEUED,
+    OP_DELETE,
+    OP_INDEX,
+    OP_UPDATE,
+    UPDATES_QUEUED,
+)
+from connectors.file_sink import (
+    DOCS_FILTERED,
+    SYNC_RULES_BATCH_SIZE,
+    FileSyncOrchestrator,
+    SegmentWriter,
+    bulk_lines,
+)
+from connectors.filtering.basic_rule import (
+    PROFILE_SYNC_RULES,
+    SLOWEST_SYNC_RULES,
+    SYNC_RULES_STATS,
+    BasicRuleEngine,
+)
+from connectors.protocol import Filter, JobType, Pipeline
+from connectors.protocol.connectors import (
+    DELETED_DOCUMENT_COUNT,
+    INDEXED_DOCUMENT_COUNT,
+    INDEXED_DOCUMENT_VOLUME,
+)
+from tests.commons import AsyncIterator
+
+INDEX = "search-some-index"
+JOB_ID = "job-1"
+
+
+def read_lines(path):
+    opener = gzip.open if str(path).endswith(".gz") else open
+    with opener(path, "rt") as f:
+        return [json.loads(line) for line in f]
+
+
+async def run_sync(orchestrator, docs, **kwargs):
+    await orchestrator.async_bulk(
+        INDEX, AsyncIterator(docs), Pipeline({}), JobType.FULL, **kwargs
+    )
+    while not orchestrator.done():
+        await asyncio.sleep(0.01)
+
+
+def test_bulk_lines():
+    timestamp = datetime.datetime(2023, 1, 1)
+
+    assert bulk_lines(
+        INDEX, {"_id": "1", "title": "one", "_timestamp": timestamp}, OP_INDEX
+    ) == (
+        b'{"index": {"_index": "search-some-index", "_id": "1"}}\n'
+        b'{"title": "one", "_timestamp": "2023-01-01T00:00:00"}\n'
+    )
+    assert bulk_lines(INDEX, {"_id": "2", "title": "two"}, OP_UPDATE) == (
+        b'{"update": {"_index": "search-some-index", "_id": "2"}}\n'
+        b'{"doc": {"title": "two"}, "doc_as_upsert": true}\n'
+    )
+    assert (
+        bulk_lines(INDEX, {"_id": "3"}, OP_DELETE)
+        == b'{"delete": {"_index": "search-some-index", "_id": "3"}}\n'
+    )
+
+
+@pytest.mark.parametrize("compress", [False, True])
+def test_segment_writer_rolls_over(tmp_path, compress):
+    writer = SegmentWriter(tmp_path, JOB_ID, segment_size=11, compress=compress)
+
+    writer.write(b"12345\n")
+    writer.write(b"1234\n")
+    # bigger than a segment, still written as a whole
+    writer.write(b"123456789012\n")
+    writer.close()
+
+    extension = ".ndjson.gz" if compress else ".ndjson"
+    assert writer.segments == [
+        str(tmp_path / f"{JOB_ID}-00001{extension}"),
+        str(tmp_path / f"{JOB_ID}-00002{extension}"),
+    ]
+    opener = gzip.open if compress else open
+    with opener(writer.segments[0], "rb") as f:
+        assert f.read() == b"12345\n1234\n"
+    with opener(writer.segments[1], "rb") as f:
+        assert f.read() == b"123456789012\n"
+    assert writer.bytes_written == 24
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_writes_bulk_lines(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+
+    async def _download(doit=True, timestamp=None):
+        return {"_id": "1", "_timestamp": timestamp, "body": "downloaded"}
+
+    docs = [
+        ({"_id": "1", "_timestamp": "2023-01-01", "title": "one"}, _download, OP_INDEX),
+        ({"_id": "2", "title": "two"}, None, OP_UPDATE),
+        ({"_id": "3"}, None, OP_DELETE),
+    ]
+    await run_sync(orchestrator, docs)
+
+    assert orchestrator.get_error() is None
+    lines = read_lines(tmp_path / INDEX / f"{JOB_ID}-00001.ndjson")
+    # the download completes after the documents without one
+    assert lines == [
+        {"update": {"_index": INDEX, "_id": "2"}},
+        {"doc": {"title": "two"}, "doc_as_upsert": True},
+        {"delete": {"_index": INDEX, "_id": "3"}},
+        {"index": {"_index": INDEX, "_id": "1"}},
+        {"_timestamp": "2023-01-01", "title": "one", "body": "downloaded"},
+    ]
+
+    stats = orchestrator.ingestion_stats()
+    assert stats[CREATES_QUEUED] == 1
+    assert stats[UPDATES_QUEUED] == 1
+    assert stats[DELETES_QUEUED] == 1
+    assert stats[BIN_DOCS_DOWNLOADED] == 1
+    assert stats[INDEXED_DOCUMENT_COUNT] == 2
+    assert stats[INDEXED_DOCUMENT_VOLUME] == 0
+    assert stats[DELETED_DOCUMENT_COUNT] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_applies_sync_rules(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+    filter_ = Filter(
+        {
+            "rules": [
+                {
+                    "id": "1",
+                    "order": 1,
+                    "policy": "exclude",
+                    "field": "title",
+                    "rule": "equals",
+                    "value": "secret",
+                }
+            ]
+        }
+    )
+    docs = [
+        ({"_id": "1", "title": "secret"}, None, OP_INDEX),
+        ({"_id": "2", "title": "public"}, None, OP_INDEX),
+    ]
+
+    await run_sync(orchestrator, docs, filter_=filter_, sync_rules_enabled=True)
+
+    lines = read_lines(tmp_path / INDEX / f"{JOB_ID}-00001.ndjson")
+    assert lines == [{"index": {"_index": INDEX, "_id": "2"}}, {"title": "public"}]
+    stats = orchestrator.ingestion_stats()
+    assert stats[DOCS_FILTERED] == 1
+    assert stats[SYNC_RULES_STATS]["1"]["matches_count"] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_applies_sync_rules_in_batches(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+    filter_ = Filter(
+        {
+            "rules": [
+                {
+                    "id": "1",
+                    "order": 1,
+                    "policy": "exclude",
+                    "field": "title",
+                    "rule": "equals",
+                    "value": "secret",
+                }
+            ]
+        }
+    )
+    docs = [
+        ({"_id": str(i), "title": "secret" if i % 2 else "public"}, None, OP_INDEX)
+        for i in range(SYNC_RULES_BATCH_SIZE + 10)
+    ]
+    # deletes are never filtered
+    docs.append(({"_id": "1", "title": "secret"}, None, OP_DELETE))
+
+    with patch.object(
+        BasicRuleEngine,
+        "should_ingest_many",
+        autospec=True,
+        side_effect=BasicRuleEngine.should_ingest_many,
+    ) as should_ingest_many:
+        await run_sync(orchestrator, docs, filter_=filter_, sync_rules_enabled=True)
+
+    assert should_ingest_many.call_count == 2
+    stats = orchestrator.ingestion_stats()
+    assert stats[DOCS_FILTERED] == (SYNC_RULES_BATCH_SIZE + 10) // 2
+    assert stats[CREATES_QUEUED] == (SYNC_RULES_BATCH_SIZE + 10) // 2
+    assert stats[DELETES_QUEUED] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_profiles_sync_rules(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+    filter_ = Filter(
+        {
+            "rules": [
+                {
+                    "id": "1",
+                    "order": 1,
+                    "policy": "exclude",
+                    "field": "title",
+                    "rule": "regex",
+                    "value": "secret.*",
+                }
+            ]
+        }
+    )
+
+    await run_sync(
+        orchestrator,
+        [({"_id": "1", "title": "public"}, None, OP_INDEX)],
+        filter_=filter_,
+        sync_rules_enabled=True,
+        options={PROFILE_SYNC_RULES: True},
+    )
+
+    stats = orchestrator.ingestion_stats()
+    assert stats[SYNC_RULES_STATS]["1"]["calls"] == 1
+    assert stats[SLOWEST_SYNC_RULES] == ["1"]
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_skips_downloads_without_content_extraction(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+
+    async def _download(doit=True, timestamp=None):
+        msg = "should not download"
+        raise AssertionError(msg)
+
+    await run_sync(
+        orchestrator,
+        [({"_id": "1"}, _download, OP_INDEX)],
+        content_extraction_enabled=False,
+    )
+
+    assert orchestrator.get_error() is None
+    assert orchestrator.ingestion_stats()[CREATES_QUEUED] == 1
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_splits_chunks_into_segments(tmp_path):
+    orchestrator = FileSyncOrchestrator(
+        str(tmp_path), JOB_ID, segment_size=100, compress=True
+    )
+    docs = [({"_id": str(i), "body": "x" * 50}, None, OP_INDEX) for i in range(4)]
+
+    await run_sync(orchestrator, docs, options={"chunk_size": 1})
+
+    segments = orchestrator.writer.segments
+    assert len(segments) == 4
+    assert all(segment.endswith(".ndjson.gz") for segment in segments)
+    assert [read_lines(segment)[0]["index"]["_id"] for segment in segments] == [
+        "0",
+        "1",
+        "2",
+        "3",
+    ]
+
+
+@pytest.mark.asyncio
+async def test_async_bulk_reports_errors(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+    error = Exception("download failed")
+
+    async def _download(doit=True, timestamp=None):
+        raise error
+
+    await run_sync(orchestrator, [({"_id": "1"}, _download, OP_INDEX)])
+
+    assert orchestrator.get_error() is error
+
+
+@pytest.mark.asyncio
+async def test_cancel(tmp_path):
+    orchestrator = FileSyncOrchestrator(str(tmp_path), JOB_ID)
+
+    async def _docs():
+        yield {"_id": "1"}, None, OP_INDEX
+        await asyncio.sleep(10)
+
+    await orchestrator.async_bulk(INDEX, _docs(), Pipeline({}), JobType.FULL)
+    await asyncio.sleep(0.01)
+    await orchestrator.cancel()
+
+    assert orchestrator.canceled
+    assert orchestrator.done()
+
+
+def test_from_config(tmp_path):
+    orchestrator = FileSyncOrchestrator.from_config(
+        {
+            "file_sink_dir": str(tmp_path),
+            "file_sink_segment_size": 1024,
+            "file_sink_compress": True,
+        },
+        JOB_ID,
+    )
+
+    assert orchestrator.output_dir == str(tmp_path)
+    assert orchestrator.segment_size == 1024
+    assert orchestrator.compress
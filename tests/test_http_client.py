@@ -0,0 +1,189 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+from contextlib import asynccontextmanager
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+from connectors.http_client import (
+    CONNECTIONS_CREATED,
+    CONNECTIONS_REUSED,
+    DEFAULT_KEEPALIVE_TIMEOUT,
+    HTTP_CONNECTIONS,
+    HTTP_REQUEST_DURATION,
+    HTTP_TLS_HANDSHAKES,
+    REQUESTS_SENT,
+    HttpClientRegistry,
+)
+
+
+async def _ping(request):
+    return web.json_response({"ok": True})
+
+
+@asynccontextmanager
+async def local_server():
+    app = web.Application()
+    app.router.add_get("/ping", _ping)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    try:
+        yield f"http://127.0.0.1:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def test_configure():
+    registry = HttpClientRegistry()
+    registry.configure({"http_max_connections": 10, "http_dns_cache_ttl": 5})
+
+    assert registry.max_connections == 10
+    assert registry.dns_cache_ttl == 5
+    assert registry.keepalive_timeout == DEFAULT_KEEPALIVE_TIMEOUT
+
+
+@pytest.mark.asyncio
+async def test_get_session_is_cached_per_host_and_auth():
+    registry = HttpClientRegistry()
+    auth = aiohttp.BasicAuth("user", "password")
+
+    session = registry.get_session("api.bitbucket.org", auth=auth)
+
+    assert registry.get_session("api.bitbucket.org", auth=auth) is session
+    assert registry.get_session("api.bitbucket.org") is not session
+    assert registry.get_session("localhost:8090") is not session
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_get_session_is_cached_per_session_arguments():
+    registry = HttpClientRegistry()
+    timeout = aiohttp.ClientTimeout(total=None)
+
+    session = registry.get_session(
+        "api.bitbucket.org", headers={"accept": "application/json"}, timeout=timeout
+    )
+
+    assert (
+        registry.get_session(
+            "api.bitbucket.org",
+            headers={"accept": "application/json"},
+            timeout=aiohttp.ClientTimeout(total=None),
+        )
+        is session
+    )
+    other_session = registry.get_session(
+        "api.bitbucket.org", headers={"accept": "text/plain"}, timeout=timeout
+    )
+    assert other_session is not session
+    assert other_session.headers["accept"] == "text/plain"
+    assert (
+        registry.get_session("api.bitbucket.org", raise_for_status=True) is not session
+    )
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_release_session_closes_it_after_the_last_user():
+    registry = HttpClientRegistry()
+    auth = aiohttp.BasicAuth("user", "password")
+    session = registry.get_session("api.bitbucket.org", auth=auth)
+    registry.get_session("api.bitbucket.org", auth=auth)
+    connector = session.connector
+
+    await registry.release_session(session)
+    assert not session.closed
+
+    await registry.release_session(session)
+    assert session.closed
+    assert not connector.closed
+
+    # rotated credentials get a new session
+    rotated_session = registry.get_session(
+        "api.bitbucket.org", auth=aiohttp.BasicAuth("user", "rotated")
+    )
+    assert rotated_session is not session
+    assert registry.get_session("api.bitbucket.org", auth=auth) is not session
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_sessions_share_one_connector():
+    registry = HttpClientRegistry()
+
+    first = registry.get_session("api.bitbucket.org")
+    second = registry.get_session("localhost:8090")
+
+    assert first.connector is second.connector
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_close_closes_sessions_and_connector():
+    registry = HttpClientRegistry()
+    session = registry.get_session("api.bitbucket.org")
+    connector = session.connector
+
+    await registry.close()
+
+    assert session.closed
+    assert connector.closed
+    assert registry.get_session("api.bitbucket.org") is not session
+
+    await registry.close()
+
+
+@pytest.mark.asyncio
+async def test_connections_are_reused():
+    registry = HttpClientRegistry()
+    created_before = HTTP_CONNECTIONS[CONNECTIONS_CREATED].get()
+    reused_before = HTTP_CONNECTIONS[CONNECTIONS_REUSED].get()
+
+    async with local_server() as server_url:
+        for _ in range(3):
+            session = registry.get_session(server_url)
+            async with session.get(f"{server_url}/ping") as response:
+                assert await response.json() == {"ok": True}
+
+        await registry.close()
+
+    stats = registry.stats()
+    assert stats[REQUESTS_SENT] == 3
+    assert stats[CONNECTIONS_CREATED] == 1
+    assert stats[CONNECTIONS_REUSED] == 2
+    assert HTTP_CONNECTIONS[CONNECTIONS_CREATED].get() == created_before + 1
+    assert HTTP_CONNECTIONS[CONNECTIONS_REUSED].get() == reused_before + 2
+    # no TLS handshake for a plain http host
+    assert HTTP_TLS_HANDSHAKES.get(host="127.0.0.1") == 0
+
+
+@pytest.mark.asyncio
+async def test_request_durations_are_recorded():
+    registry = HttpClientRegistry()
+
+    async with local_server() as server_url:
+        count_before, _ = HTTP_REQUEST_DURATION.get(
+            host="127.0.0.1", method="GET", status=200
+        )
+        session = registry.get_session(server_url)
+        async with session.get(f"{server_url}/ping") as response:
+            await response.json()
+
+        await registry.close()
+
+    count, duration = HTTP_REQUEST_DURATION.get(
+        host="127.0.0.1", method="GET", status=200
+    )
+    assert count == count_before + 1
+    assert duration > 0
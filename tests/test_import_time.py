@@ -0,0 +1,49 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+import json
+import subprocess
+import sys
+
+import pytest
+
+# imported on first use, see connectors/utils.py
+LAZY_DEPENDENCIES = ("bs4", "lxml", "pympler", "dateutil", "cstriggers", "aiohttp.web")
+
+
+def imported_modules(module):
+    """Returns the names in `sys.modules` after importing `module` in a fresh interpreter.
+
+    The test process already imported most dependencies, so the import runs in a subprocess.
+    """
+    result = subprocess.run(
+        [
+            sys.executable,
+            "-c",
+            f"import json, sys, {module}; print(json.dumps(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return json.loads(result.stdout)
+
+
+@pytest.mark.parametrize(
+    "module",
+    ["connectors.logger", "connectors.utils", "connectors.config", "connectors.source"],
+)
+def test_lazy_dependencies_are_not_imported(module):
+    modules = imported_modules(module)
+
+    assert module in modules
+    assert [
+        name
+        for name in modules
+        if any(
+            name == dependency or name.startswith(f"{dependency}.")
+            for dependency in LAZY_DEPENDENCIES
+        )
+    ] == []
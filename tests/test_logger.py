@@ -6,13 +6,24 @@
 import asyncio
 import json
 import logging
+import queue
 import time
 from contextlib import contextmanager
 
 import pytest
 
 import connectors.logger
-from connectors.logger import ColorFormatter, logger, set_logger, tracer
+from connectors.logger import (
+    SPAN_DURATION,
+    ColorFormatter,
+    DocumentLogger,
+    DroppingQueueHandler,
+    LogSampler,
+    dropped_logs,
+    logger,
+    set_logger,
+    tracer,
+)
 
 
 @contextmanager
@@ -72,6 +83,19 @@ def test_tracer():
         assert data["message"].startswith("[trace me] traceable took 0.1")
 
 
+def test_tracer_records_span_duration():
+    @tracer.start_as_current_span("measure me")
+    def traceable():
+        time.sleep(0.01)
+
+    count_before, _ = SPAN_DURATION.get(span="measure me", function="traceable")
+    traceable()
+
+    count, duration = SPAN_DURATION.get(span="measure me", function="traceable")
+    assert count == count_before + 1
+    assert duration >= 0.01
+
+
 @pytest.mark.asyncio
 async def test_async_tracer():
     with unset_logger():
@@ -193,3 +217,105 @@ def test_colored_logging_with_filebeat():
         assert len(logs) == 5
         for log in logs:
             assert not log.startswith("\x1b")
+
+
+def test_queued_logging():
+    with unset_logger():
+        logger = set_logger(logging.DEBUG, filebeat=True, queue_size=10)
+        logs = []
+
+        def _w(msg):
+            logs.append(msg)
+
+        try:
+            assert isinstance(logger.handlers[0], DroppingQueueHandler)
+            connectors.logger._stream_handler.stream.write = _w
+
+            logger.info("queued")
+        finally:
+            # stopping the queue writes the remaining logs
+            set_logger(logging.DEBUG, filebeat=True, queue_size=0)
+
+        assert not isinstance(logger.handlers[0], DroppingQueueHandler)
+        assert len(logs) == 1
+        data = json.loads(logs[0])
+        assert data["message"] == "queued"
+        assert data["service"]["type"] == "connectors-python"
+
+
+def test_queued_logging_drops_logs_when_queue_is_full():
+    handler = DroppingQueueHandler(queue.Queue(maxsize=1))
+
+    for level in (logging.DEBUG, logging.INFO):
+        handler.handle(logging.LogRecord("test", level, "", 0, "msg", None, None))
+
+    assert handler.dropped == 1
+    assert handler.queue.qsize() == 1
+
+
+def test_dropped_logs_without_queue():
+    with unset_logger():
+        set_logger(logging.DEBUG, queue_size=0)
+
+        assert dropped_logs() == 0
+
+
+def test_log_sampler():
+    sampler = LogSampler(first=2, every=3)
+
+    assert [sampler.sample() for _ in range(8)] == [
+        True,
+        True,
+        False,
+        False,
+        True,
+        False,
+        False,
+        True,
+    ]
+
+
+def test_lazy_and_sampled_logging():
+    with unset_logger():
+        logger = set_logger(logging.INFO, filebeat=True)
+        logs = []
+
+        def _w(msg):
+            logs.append(msg)
+
+        logger.handlers[0].stream.write = _w
+        built = []
+
+        def message():
+            built.append(True)
+            return "built"
+
+        # disabled level, the message is not built
+        logger.debug(message)
+        assert built == []
+
+        sampler = LogSampler(first=1, every=10)
+        for _ in range(5):
+            logger.info(message, sampler=sampler)
+
+        assert len(built) == 1
+        assert len(logs) == 1
+        assert json.loads(logs[0])["message"] == "built"
+
+
+def test_document_logger_lazy_message():
+    with unset_logger():
+        logger = set_logger(logging.DEBUG, filebeat=True)
+        logs = []
+
+        def _w(msg):
+            logs.append(msg)
+
+        logger.handlers[0].stream.write = _w
+
+        document_logger = DocumentLogger("[prefix]", {"labels.index_name": "index"})
+        document_logger.debug(lambda: "lazy", sampler=LogSampler())
+
+        data = json.loads(logs[0])
+        assert data["message"] == "lazy"
+        assert data["labels"]["index_name"] == "index"
@@ -0,0 +1,72 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+import asyncio
+import time
+
+import pytest
+
+from connectors.loop_monitor import (
+    DEFAULT_LOOP_MONITOR_INTERVAL,
+    LOOP_LAG,
+    LOOP_STALLS,
+    LoopMonitor,
+)
+
+
+def _block_the_loop(seconds):
+    time.sleep(seconds)
+
+
+def test_from_config():
+    monitor = LoopMonitor.from_config({"loop_monitor_threshold": 5})
+
+    assert monitor.interval == DEFAULT_LOOP_MONITOR_INTERVAL
+    assert monitor.threshold == 5
+
+
+@pytest.mark.asyncio
+async def test_monitor_records_lag():
+    monitor = LoopMonitor(interval=0.01, threshold=1)
+    count_before, _ = LOOP_LAG.get()
+
+    monitor.start()
+    await asyncio.sleep(0.1)
+    await monitor.stop()
+
+    count, _ = LOOP_LAG.get()
+    assert count > count_before
+    assert monitor.stalls == 0
+
+
+@pytest.mark.asyncio
+async def test_monitor_logs_stack_of_blocking_code(patch_logger):
+    monitor = LoopMonitor(interval=0.01, threshold=0.05)
+    stalls_before = LOOP_STALLS.get()
+
+    monitor.start()
+    await asyncio.sleep(0.02)
+    _block_the_loop(0.3)
+    await asyncio.sleep(0.05)
+    await monitor.stop()
+
+    assert monitor.stalls == 1
+    assert LOOP_STALLS.get() == stalls_before + 1
+    assert monitor.max_lag >= 0.2
+    patch_logger.assert_present("Event loop blocked for more than")
+    patch_logger.assert_present("_block_the_loop")
+
+
+@pytest.mark.asyncio
+async def test_monitor_can_be_restarted():
+    monitor = LoopMonitor(interval=0.01)
+
+    monitor.start()
+    await monitor.stop()
+    monitor.start()
+    await asyncio.sleep(0.03)
+    await monitor.stop()
+
+    assert monitor.max_lag < 1
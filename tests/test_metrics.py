@@ -0,0 +1,207 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+import asyncio
+import json
+import socket
+import sys
+import threading
+
+import aiohttp
+import pytest
+
+from connectors.metrics import MetricsExporter, MetricsRegistry
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def test_counter():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs", "Jobs", labelnames=("status",))
+
+    counter.inc(status="completed")
+    counter.inc(2, status="completed")
+    counter.inc(status="error")
+
+    assert counter.get(status="completed") == 3
+    assert counter.get(status="error") == 1
+    assert counter.get(status="canceled") == 0
+    assert 'jobs_total{status="completed"} 3' in registry.to_prometheus()
+
+
+def test_gauge():
+    registry = MetricsRegistry()
+    gauge = registry.gauge("depth", "Depth")
+
+    gauge.set(5)
+    gauge.inc()
+    gauge.dec(3)
+    assert gauge.get() == 3
+
+    gauge.set_function(lambda: 42)
+    assert gauge.get() == 42
+    assert "depth 42" in registry.to_prometheus()
+
+
+def test_histogram():
+    registry = MetricsRegistry()
+    histogram = registry.histogram("duration", "Duration", buckets=(1, 10))
+
+    for value in (0.5, 1, 5, 50):
+        histogram.observe(value)
+
+    assert histogram.get() == (4, 56.5)
+    assert registry.to_prometheus().splitlines() == [
+        "# HELP duration Duration",
+        "# TYPE duration histogram",
+        'duration_bucket{le="1"} 2',
+        'duration_bucket{le="10"} 3',
+        'duration_bucket{le="+Inf"} 4',
+        "duration_sum 56.5",
+        "duration_count 4",
+    ]
+
+
+def test_registry_returns_existing_metric():
+    registry = MetricsRegistry()
+    counter = registry.counter("jobs", "Jobs")
+
+    assert registry.counter("jobs", "Jobs") is counter
+    assert registry.get("jobs") is counter
+    with pytest.raises(ValueError):
+        registry.gauge("jobs", "Jobs")
+
+
+def test_labels_are_escaped():
+    registry = MetricsRegistry()
+    registry.counter("requests", "Requests", labelnames=("path",)).inc(path='a"b')
+
+    assert 'requests_total{path="a\\"b"} 1' in registry.to_prometheus()
+
+
+def test_to_dict():
+    registry = MetricsRegistry()
+    registry.counter("jobs", "Jobs", labelnames=("status",)).inc(status="completed")
+    registry.histogram("duration", "Duration", buckets=(1,)).observe(2)
+
+    assert registry.to_dict() == {
+        "jobs": {
+            "type": "counter",
+            "help": "Jobs",
+            "values": [{"labels": {"status": "completed"}, "value": 1}],
+        },
+        "duration": {
+            "type": "histogram",
+            "help": "Duration",
+            "values": [
+                {
+                    "labels": {},
+                    "value": {"count": 1, "sum": 2, "buckets": {"1": 0, "+Inf": 1}},
+                }
+            ],
+        },
+    }
+
+
+def test_metrics_are_updated_from_threads():
+    registry = MetricsRegistry()
+    counter = registry.counter("stalls", "Stalls", labelnames=("thread",))
+    histogram = registry.histogram("lag", "Lag", labelnames=("thread",))
+
+    def _update(thread):
+        for _ in range(10000):
+            counter.inc(thread=thread)
+            histogram.observe(0.01, thread=thread)
+            counter.inc(thread="shared")
+
+    threads = [threading.Thread(target=_update, args=(str(i),)) for i in range(4)]
+    switch_interval = sys.getswitchinterval()
+    # switch threads as often as possible, to interleave the updates
+    sys.setswitchinterval(1e-6)
+    try:
+        for thread in threads:
+            thread.start()
+        # exporting while the values are updated
+        while any(thread.is_alive() for thread in threads):
+            registry.to_dict()
+            registry.to_prometheus()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+
+    assert counter.get(thread="shared") == 40000
+    assert [counter.get(thread=str(i)) for i in range(4)] == [10000] * 4
+    assert [histogram.get(thread=str(i))[0] for i in range(4)] == [10000] * 4
+
+
+def test_exporter_from_config():
+    exporter = MetricsExporter.from_config({"metrics_port": 9464})
+
+    assert exporter.enabled()
+    assert exporter.port == 9464
+    assert exporter.dump_path is None
+    assert not MetricsExporter.from_config({}).enabled()
+
+
+@pytest.mark.asyncio
+async def test_exporter_serves_metrics():
+    registry = MetricsRegistry()
+    registry.counter("jobs", "Jobs").inc()
+    port = _free_port()
+    exporter = MetricsExporter(registry, port=port)
+
+    await exporter.start()
+    try:
+        async with aiohttp.ClientSession() as session:
+            async with session.get(f"http://127.0.0.1:{port}/metrics") as response:
+                assert response.status == 200
+                assert "jobs_total 1" in await response.text()
+    finally:
+        await exporter.stop()
+
+
+@pytest.mark.asyncio
+async def test_exporter_dumps_metrics(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter("jobs", "Jobs").inc()
+    dump_path = tmp_path / "metrics.json"
+    exporter = MetricsExporter(registry, dump_path=str(dump_path), dump_interval=60)
+
+    await exporter.start()
+    await exporter.stop()
+
+    dump = json.loads(dump_path.read_text())
+    assert dump["metrics"]["jobs"]["values"] == [{"labels": {}, "value": 1}]
+
+
+@pytest.mark.asyncio
+async def test_exporter_keeps_dumping_after_a_failed_dump(tmp_path, patch_logger):
+    registry = MetricsRegistry()
+    dump_path = tmp_path / "missing" / "metrics.json"
+    exporter = MetricsExporter(registry, dump_path=str(dump_path), dump_interval=0.01)
+
+    await exporter.start()
+    await asyncio.sleep(0.05)
+    assert not exporter._dump_task.done()
+
+    (tmp_path / "missing").mkdir()
+    await asyncio.sleep(0.05)
+    assert dump_path.exists()
+
+    # a failed last dump does not raise
+    (tmp_path / "missing" / "metrics.json.tmp").mkdir()
+    await exporter.stop()
+    errors = [
+        message
+        for message in patch_logger.logs
+        if str(message).startswith(f"Could not dump metrics to {dump_path}")
+    ]
+    # at least one failed periodic dump, and the failed last dump
+    assert len(errors) >= 2
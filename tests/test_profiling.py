@@ -0,0 +1,87 @@
+#
+# Copyright Elasticsearch B.V. and/or licensed to Elasticsearch B.V. under one
+# or more contributor license agreements. Licensed under the Elastic License 2.0;
+# you may not use this file except in compliance with the Elastic License 2.0.
+#
+import asyncio
+import time
+import tracemalloc
+
+import pytest
+
+from connectors.profiling import DEFAULT_PROFILING_INTERVAL, SyncJobProfiler
+
+
+def _busy_job_work(seconds):
+    time.sleep(seconds)
+    return [bytearray(1024) for _ in range(1000)]
+
+
+def _busy_other_work(seconds):
+    time.sleep(seconds)
+
+
+def test_from_config(tmp_path):
+    profiler = SyncJobProfiler.from_config("job-1", {"profiling_dir": str(tmp_path)})
+
+    assert profiler.output_dir == str(tmp_path)
+    assert profiler.interval == DEFAULT_PROFILING_INTERVAL
+
+
+@pytest.mark.asyncio
+async def test_profiler_samples_tasks_of_the_job_only(tmp_path):
+    allocated = []
+
+    async def job():
+        profiler = SyncJobProfiler("job-1", output_dir=str(tmp_path), interval=0.001)
+        profiler.start()
+
+        async def job_subtask():
+            allocated.append(_busy_job_work(0.1))
+
+        await asyncio.create_task(job_subtask())
+        await asyncio.sleep(0.15)
+        return profiler, await profiler.stop()
+
+    async def other_job():
+        await asyncio.sleep(0.01)
+        _busy_other_work(0.1)
+
+    (profiler, profile), _ = await asyncio.gather(job(), other_job())
+
+    assert profile == {
+        "stacks": str(tmp_path / "job-1.collapsed"),
+        "allocations": str(tmp_path / "job-1.allocations.txt"),
+    }
+    assert profiler.samples > 0
+
+    stacks = (tmp_path / "job-1.collapsed").read_text()
+    assert "job_subtask (test_profiling.py" in stacks
+    assert "_busy_job_work" in stacks
+    assert "_busy_other_work" not in stacks
+
+    allocations = (tmp_path / "job-1.allocations.txt").read_text()
+    assert "test_profiling.py" in allocations
+    assert not tracemalloc.is_tracing()
+
+
+@pytest.mark.asyncio
+async def test_stop_twice(tmp_path):
+    profiler = SyncJobProfiler("job-1", output_dir=str(tmp_path))
+
+    profiler.start()
+    assert await profiler.stop() is not None
+    assert await profiler.stop() is None
+
+
+@pytest.mark.asyncio
+async def test_stop_stops_tracing_when_the_profile_cannot_be_written(tmp_path):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    profiler = SyncJobProfiler("job-1", output_dir=str(not_a_dir / "profiles"))
+
+    profiler.start()
+    with pytest.raises(OSError):
+        await profiler.stop()
+
+    assert not tracemalloc.is_tracing()
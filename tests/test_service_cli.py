@@ -210,3 +210,14 @@ def test_unknown_service_type(set_env):
         f"Could not find a connector for service type {unknown_service_type}"
         in result.output
     )
+
+
+@patch("connectors.service_cli._start_service", new_callable=AsyncMock)
+def test_sink_option_overrides_config(start_service, set_env):
+    runner = CliRunner()
+
+    result = runner.invoke(main, ["--config-file", CONFIG, "--sink", "file"])
+
+    assert result.exit_code == SUCCESS_EXIT_CODE
+    config = start_service.call_args[0][1]
+    assert config["service"]["sink"] == "file"
@@ -3,19 +3,24 @@
 # or more contributor license agreements. Licensed under the Elastic License 2.0;
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
+import asyncio
+import hashlib
+import os
 from datetime import datetime
 from decimal import Decimal
 from unittest import TestCase, mock
+from unittest.mock import AsyncMock, Mock
 
 import pytest
 from bson import Decimal128
 
 from connectors.filtering.validation import (
     BasicRuleAgainstSchemaValidator,
+    BasicRuleNoCatastrophicBacktrackingValidator,
     BasicRuleNoMatchAllRegexValidator,
     BasicRulesSetSemanticValidator,
 )
-from connectors.protocol import Features
+from connectors.protocol import Features, Filter
 from connectors.source import (
     BaseDataSource,
     ConfigurableFieldDependencyError,
@@ -23,10 +28,12 @@ from connectors.source import (
     DataSourceConfiguration,
     Field,
     MalformedConfigurationError,
+    SpooledTempFile,
     ValidationTypes,
     get_source_klass,
     get_source_klasses,
 )
+from tests.commons import AsyncIterator
 
 CONFIG = {
     "host": {
@@ -821,6 +828,7 @@ async def test_base_class():
     assert BaseDataSource.basic_rules_validators() == [
         BasicRuleAgainstSchemaValidator,
         BasicRuleNoMatchAllRegexValidator,
+        BasicRuleNoCatastrophicBacktrackingValidator,
         BasicRulesSetSemanticValidator,
     ]
 
@@ -927,3 +935,226 @@ async def test_validate_config_fields_when_invalid_raises_error():
     ds = DataSource(configuration=DataSourceConfiguration(configuration))
     with pytest.raises(MalformedConfigurationError):
         ds.validate_config_fields()
+
+
+class PushDownDataSource(DataSource):
+    def can_push_down_basic_rule(self, basic_rule):
+        return basic_rule.field == "path"
+
+
+def basic_rule_json(id_, order, policy, field, value="value"):
+    return {
+        "id": id_,
+        "order": order,
+        "policy": policy,
+        "field": field,
+        "rule": "equals",
+        "value": value,
+    }
+
+
+DEFAULT_RULE_JSON = basic_rule_json("DEFAULT", 0, "include", "_", ".*")
+
+
+@pytest.mark.parametrize(
+    "basic_rules, expected_pushed_down_ids, expected_remaining_ids",
+    [
+        ([], [], []),
+        (
+            [
+                basic_rule_json("1", 1, "exclude", "path"),
+                basic_rule_json("2", 2, "exclude", "path"),
+                DEFAULT_RULE_JSON,
+            ],
+            ["1", "2"],
+            ["DEFAULT"],
+        ),
+        (
+            [
+                basic_rule_json("1", 1, "exclude", "path"),
+                basic_rule_json("2", 2, "include", "path"),
+                basic_rule_json("3", 3, "exclude", "path"),
+            ],
+            ["1"],
+            ["2", "3"],
+        ),
+        (
+            [
+                basic_rule_json("1", 1, "exclude", "name"),
+                basic_rule_json("2", 2, "exclude", "path"),
+            ],
+            [],
+            ["1", "2"],
+        ),
+        (
+            # rules are pushed down in order, not in the order they are stored
+            [
+                basic_rule_json("2", 2, "exclude", "name"),
+                basic_rule_json("1", 1, "exclude", "path"),
+            ],
+            ["1"],
+            ["2"],
+        ),
+    ],
+)
+def test_push_down_basic_rules(
+    basic_rules, expected_pushed_down_ids, expected_remaining_ids
+):
+    filter_ = Filter({"rules": basic_rules, "advanced_snippet": {"value": {}}})
+    ds = PushDownDataSource(configuration=DataSourceConfiguration({}))
+
+    remaining_filter = ds.push_down_basic_rules(filter_)
+
+    assert [rule.id_ for rule in ds.pushed_down_basic_rules] == expected_pushed_down_ids
+    assert [
+        rule["id"] for rule in remaining_filter.basic_rules
+    ] == expected_remaining_ids
+    assert remaining_filter.advanced_rules == filter_.advanced_rules
+    assert filter_.basic_rules == basic_rules
+
+
+def test_push_down_basic_rules_is_disabled_by_default():
+    filter_ = Filter({"rules": [basic_rule_json("1", 1, "exclude", "path")]})
+    ds = DataSource(configuration=DataSourceConfiguration({}))
+
+    assert ds.push_down_basic_rules(filter_) is filter_
+    assert ds.pushed_down_basic_rules == []
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "extraction_service, expected_content_hash",
+    [
+        (mock.Mock(), hashlib.sha256(b"chunk1chunk2").hexdigest()),
+        (None, None),
+    ],
+)
+async def test_download_to_temp_file_returns_content_hash(
+    extraction_service, expected_content_hash
+):
+    ds = DataSource(configuration=DataSourceConfiguration({}))
+    ds.extraction_service = extraction_service
+    async_buffer = mock.AsyncMock()
+
+    content_hash = await ds.download_to_temp_file(
+        "temp_file", "file.txt", async_buffer, AsyncIterator([b"chunk1", b"chunk2"])
+    )
+
+    assert content_hash == expected_content_hash
+    assert async_buffer.write.await_count == 2
+    async_buffer.close.assert_awaited_once()
+
+
+@pytest.mark.asyncio
+async def test_spooled_temp_file_keeps_small_files_in_memory():
+    spooled_file = SpooledTempFile(max_size=10)
+
+    await spooled_file.write(b"12345")
+    await spooled_file.write(b"67890")
+    await spooled_file.close()
+
+    assert spooled_file.in_memory()
+    assert spooled_file.name is None
+    assert spooled_file.getvalue() == b"1234567890"
+
+
+@pytest.mark.asyncio
+async def test_spooled_temp_file_rolls_over_to_disk(tmp_path):
+    spooled_file = SpooledTempFile(max_size=8, suffix=".txt", dir_=str(tmp_path))
+
+    await spooled_file.write(b"12345")
+    await spooled_file.write(b"67890")
+    await spooled_file.write(b"!")
+    await spooled_file.close()
+
+    assert not spooled_file.in_memory()
+    assert spooled_file.name.endswith(".txt")
+    assert (tmp_path / os.path.basename(spooled_file.name)).read_bytes() == (
+        b"1234567890!"
+    )
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "max_in_memory_file_size, in_memory",
+    [
+        (1024, True),
+        (4, False),
+    ],
+)
+async def test_download_and_extract_file_converts_content_to_base64(
+    max_in_memory_file_size, in_memory
+):
+    ds = DataSource(configuration=DataSourceConfiguration({}))
+    ds.framework_config.max_in_memory_file_size = max_in_memory_file_size
+
+    with mock.patch.object(
+        ds, "remove_temp_file", wraps=ds.remove_temp_file
+    ) as remove_temp_file, mock.patch(
+        "connectors.source.asyncio.to_thread", wraps=asyncio.to_thread
+    ) as to_thread:
+        doc = await ds.download_and_extract_file(
+            {"id": 1},
+            "file.pdf",
+            ".pdf",
+            AsyncIterator([b"chunk1", b"chunk2"]),
+        )
+
+    assert doc == {"id": 1, "_attachment": "Y2h1bmsxY2h1bmsy"}
+    assert remove_temp_file.called is not in_memory
+    # the content is encoded off the event loop, in memory or not
+    to_thread.assert_called()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("file_pointers", [True, False])
+async def test_download_and_extract_file_skips_extraction_of_empty_files(
+    file_pointers, tmp_path
+):
+    with mock.patch(
+        "connectors.content_extraction.ContentExtraction.get_extraction_config",
+        return_value={"host": "http://localhost:8090"},
+    ):
+        ds = DataSource(
+            configuration=DataSourceConfiguration(
+                {"use_text_extraction_service": {"value": True, "type": "bool"}}
+            )
+        )
+    ds.extraction_service = Mock()
+    ds.extraction_service._check_configured = Mock(return_value=True)
+    ds.extraction_service.extract_text = AsyncMock(return_value="text")
+    if file_pointers:
+        ds.download_dir = str(tmp_path)
+
+    doc = await ds.download_and_extract_file(
+        {"id": 1}, "empty.pdf", ".pdf", AsyncIterator([b""])
+    )
+
+    assert doc == {"id": 1, "body": ""}
+    ds.extraction_service.extract_text.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize(
+    "max_in_memory_file_size, plain_text_extraction, expected_doc",
+    [
+        (1024, True, {"id": 1, "body": "chunk1chunk2"}),
+        (4, True, {"id": 1, "body": "chunk1chunk2"}),
+        (1024, False, {"id": 1, "_attachment": "Y2h1bmsxY2h1bmsy"}),
+    ],
+)
+async def test_download_and_extract_file_extracts_plain_text(
+    max_in_memory_file_size, plain_text_extraction, expected_doc
+):
+    ds = DataSource(configuration=DataSourceConfiguration({}))
+    ds.framework_config.max_in_memory_file_size = max_in_memory_file_size
+    ds.framework_config.plain_text_extraction = plain_text_extraction
+
+    doc = await ds.download_and_extract_file(
+        {"id": 1},
+        "file.md",
+        ".md",
+        AsyncIterator([b"chunk1", b"chunk2"]),
+    )
+
+    assert doc == expected_doc
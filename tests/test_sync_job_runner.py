@@ -4,6 +4,7 @@
 # you may not use this file except in compliance with the Elastic License 2.0.
 #
 import asyncio
+import json
 from unittest.mock import ANY, AsyncMock, Mock, patch
 
 import pytest
@@ -19,6 +20,12 @@ from elasticsearch import (
 
 from connectors.es.client import License
 from connectors.es.index import DocumentNotFoundError
+from connectors.file_sink import FileSyncOrchestrator
+from connectors.filtering.basic_rule import (
+    PROFILE_SYNC_RULES,
+    SLOWEST_SYNC_RULES,
+    SYNC_RULES_STATS,
+)
 from connectors.filtering.validation import InvalidFilteringError
 from connectors.protocol import Filter, JobStatus, JobType, Pipeline
 from connectors.source import BaseDataSource
@@ -50,6 +57,7 @@ def mock_connector():
     connector.sync_done = AsyncMock()
     connector.reload = AsyncMock()
     connector.native = True
+    connector.profile_syncs = False
 
     return connector
 
@@ -75,6 +83,7 @@ def mock_sync_job(job_type, index_name):
     sync_job.reload = AsyncMock()
     sync_job.validate_filtering = AsyncMock()
     sync_job.update_metadata = AsyncMock()
+    sync_job.profile = False
 
     return sync_job
 
@@ -94,6 +103,7 @@ def create_runner(
     data_provider.changed = AsyncMock(return_value=source_changed)
     data_provider.set_features = Mock()
     data_provider.validate_config_fields = Mock()
+    data_provider.push_down_basic_rules = Mock(side_effect=lambda filter_: filter_)
     data_provider.validate_config = AsyncMock(side_effect=validate_config_exception)
     data_provider.ping = AsyncMock()
     if not source_available:
@@ -519,6 +529,136 @@ async def test_sync_job_runner(job_type, sync_cursor, sync_orchestrator_mock):
     )
 
 
+@pytest.mark.asyncio
+async def test_sync_job_runner_reports_sync_rules_stats(sync_orchestrator_mock):
+    sync_rules_stats = {
+        "DEFAULT": {"policy": "include", "matches_count": 10},
+        "1": {"policy": "exclude", "matches_count": 5, "calls": 15},
+    }
+    sync_orchestrator_mock.ingestion_stats.return_value = {
+        "indexed_document_count": 10,
+        SYNC_RULES_STATS: sync_rules_stats,
+    }
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    await sync_job_runner.execute()
+
+    sync_job_runner.sync_job.update_metadata.assert_any_await(
+        connector_metadata={SYNC_RULES_STATS: sync_rules_stats}
+    )
+    sync_job_runner.sync_job.done.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_sync_job_runner_profiles_sync_rules(sync_orchestrator_mock):
+    sync_orchestrator_mock.ingestion_stats.return_value = {
+        SYNC_RULES_STATS: {"1": {"policy": "exclude", "matches_count": 5}},
+        SLOWEST_SYNC_RULES: ["1"],
+    }
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    sync_job_runner.service_config["profile_sync_rules"] = True
+
+    await sync_job_runner.execute()
+
+    options = sync_orchestrator_mock.async_bulk.call_args.kwargs["options"]
+    assert options[PROFILE_SYNC_RULES] is True
+    sync_job_runner.sync_job.log_info.assert_any_call("Slowest sync rules: ['1']")
+
+
+@pytest.mark.parametrize(
+    "job_profile, connector_profile", [(True, False), (False, True)]
+)
+@pytest.mark.asyncio
+async def test_sync_job_runner_profiles_sync(job_profile, connector_profile, tmp_path):
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    sync_job_runner.sync_job.profile = job_profile
+    sync_job_runner.connector.profile_syncs = connector_profile
+    sync_job_runner.service_config["profiling_dir"] = str(tmp_path)
+
+    await sync_job_runner.execute()
+
+    profile = {
+        "stacks": str(tmp_path / "1.collapsed"),
+        "allocations": str(tmp_path / "1.allocations.txt"),
+    }
+    sync_job_runner.sync_job.update_metadata.assert_any_await(
+        connector_metadata={"profile": profile}
+    )
+    assert (tmp_path / "1.collapsed").exists()
+    assert (tmp_path / "1.allocations.txt").exists()
+    sync_job_runner.sync_job.done.assert_awaited()
+
+
+@pytest.mark.asyncio
+async def test_sync_job_runner_stores_sync_rules_stats_and_profile_in_one_update(
+    sync_orchestrator_mock, tmp_path
+):
+    sync_rules_stats = {"1": {"policy": "exclude", "matches_count": 5}}
+    sync_orchestrator_mock.ingestion_stats.return_value = {
+        SYNC_RULES_STATS: sync_rules_stats
+    }
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    sync_job_runner.sync_job.profile = True
+    sync_job_runner.service_config["profiling_dir"] = str(tmp_path)
+
+    await sync_job_runner.execute()
+
+    sync_job_runner.sync_job.update_metadata.assert_awaited_once_with(
+        connector_metadata={
+            SYNC_RULES_STATS: sync_rules_stats,
+            "profile": {
+                "stacks": str(tmp_path / "1.collapsed"),
+                "allocations": str(tmp_path / "1.allocations.txt"),
+            },
+        }
+    )
+
+
+@pytest.mark.asyncio
+async def test_sync_job_runner_completes_sync_when_profile_cannot_be_written(
+    tmp_path,
+):
+    not_a_dir = tmp_path / "file"
+    not_a_dir.write_text("")
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    sync_job_runner.sync_job.profile = True
+    sync_job_runner.service_config["profiling_dir"] = str(not_a_dir / "profiles")
+
+    await sync_job_runner.execute()
+
+    sync_job_runner.sync_job.log_error.assert_called_once()
+    sync_job_runner.sync_job.done.assert_awaited()
+    sync_job_runner.sync_job.fail.assert_not_awaited()
+
+
+@pytest.mark.asyncio
+async def test_sync_job_runner_does_not_profile_sync_by_default():
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+
+    await sync_job_runner.execute()
+
+    assert sync_job_runner.profiler is None
+
+
+@pytest.mark.asyncio
+async def test_sync_job_runner_writes_to_file_sink(sync_orchestrator_mock, tmp_path):
+    sync_job_runner = create_runner(job_type=JobType.FULL)
+    sync_job_runner.service_config.update(
+        {"sink": "file", "file_sink_dir": str(tmp_path)}
+    )
+    sync_job_runner.source_klass.return_value.get_docs.return_value = AsyncIterator(
+        [({"_id": "1", "title": "one"}, None)]
+    )
+
+    await sync_job_runner.execute()
+
+    assert isinstance(sync_job_runner.sync_orchestrator, FileSyncOrchestrator)
+    sync_orchestrator_mock.async_bulk.assert_not_awaited()
+    lines = (tmp_path / SEARCH_INDEX_NAME / "1-00001.ndjson").read_text().splitlines()
+    assert json.loads(lines[0]) == {"index": {"_index": SEARCH_INDEX_NAME, "_id": "1"}}
+    assert json.loads(lines[1])["title"] == "one"
+    sync_job_runner.sync_job.done.assert_awaited()
+
+
 @pytest.mark.parametrize(
     "job_type, sync_cursor",
     [
@@ -8,6 +8,7 @@ import base64
 import binascii
 import contextlib
 import functools
+import io
 import os
 import random
 import ssl
@@ -23,7 +24,6 @@ from dateutil.tz import tzutc
 from freezegun import freeze_time
 from pympler import asizeof
 
-from connectors import utils
 from connectors.utils import (
     ConcurrentTasks,
     InvalidIndexNameError,
@@ -35,6 +35,7 @@ from connectors.utils import (
     convert_to_b64,
     decode_base64_value,
     deep_merge_dicts,
+    encode_file_to_b64,
     evaluate_timedelta,
     filter_nested_dict_by_keys,
     get_base64_value,
@@ -523,52 +524,39 @@ async def test_concurrent_tasks_join_raise_on_error():
 
 
 @contextlib.contextmanager
-def temp_file(converter):
-    if converter == "system":
-        assert utils._BASE64 is not None
-        _SAVED = None
-    else:
-        _SAVED = utils._BASE64
-        utils._BASE64 = None
-    try:
-        content = binascii.hexlify(os.urandom(32)).strip()
-        with tempfile.NamedTemporaryFile() as fp:
-            fp.write(content)
-            fp.flush()
-            yield fp.name, content
-    finally:
-        if _SAVED is not None:
-            utils._BASE64 = _SAVED
-
-
-@pytest.mark.parametrize("converter", ["system", "py"])
-def test_convert_to_b64_inplace(converter):
-    with temp_file(converter) as (source, content):
+def temp_file(size=32):
+    content = binascii.hexlify(os.urandom(size)).strip()
+    with tempfile.NamedTemporaryFile() as fp:
+        fp.write(content)
+        fp.flush()
+        yield fp.name, content
+
+
+def test_convert_to_b64_inplace():
+    with temp_file() as (source, content):
         # convert in-place
         result = convert_to_b64(source)
 
         assert result == source
         with open(result, "rb") as f:
-            assert f.read().strip() == base64.b64encode(content).strip()
+            assert f.read() == base64.b64encode(content)
 
 
-@pytest.mark.parametrize("converter", ["system", "py"])
-def test_convert_to_b64_target(converter):
-    with temp_file(converter) as (source, content):
+def test_convert_to_b64_target():
+    with temp_file() as (source, content):
         # convert to a specific file
         try:
             target = f"{source}.here"
             result = convert_to_b64(source, target=target)
             with open(result, "rb") as f:
-                assert f.read().strip() == base64.b64encode(content).strip()
+                assert f.read() == base64.b64encode(content)
         finally:
             if os.path.exists(target):
                 os.remove(target)
 
 
-@pytest.mark.parametrize("converter", ["system", "py"])
-def test_convert_to_b64_no_overwrite(converter):
-    with temp_file(converter) as (source, content):
+def test_convert_to_b64_no_overwrite():
+    with temp_file() as (source, content):
         # check overwrite
         try:
             target = f"{source}.here"
@@ -582,41 +570,29 @@ def test_convert_to_b64_no_overwrite(converter):
             # ..unless we use `overwrite`
             result = convert_to_b64(source, target=target, overwrite=True)
             with open(result, "rb") as f:
-                assert f.read().strip() == base64.b64encode(content)
+                assert f.read() == base64.b64encode(content)
         finally:
             if os.path.exists(target):
                 os.remove(target)
 
 
-@pytest.fixture
-def patch_file_ops():
-    with patch("connectors.utils.open"):
-        with patch("os.remove"):
-            with patch("os.rename"):
-                yield
+@pytest.mark.parametrize("size", [0, 1, 2, 3, 4, 5, 6, 7, 100])
+def test_encode_file_to_b64_across_chunks(size):
+    # hexlified content is twice the size, chunks of 6 bytes cover all the padding cases
+    with temp_file(size) as (source, content):
+        assert encode_file_to_b64(source, chunk_size=6) == (
+            base64.b64encode(content).decode()
+        )
 
 
-@pytest.mark.parametrize(
-    "system,mac_ver,cmd_template",
-    [
-        ("Darwin", "13.0", "/usr/bin/base64 -i {source} -o {target}"),
-        ("Darwin", "12.0", "/usr/bin/base64 {source} > {target}"),
-        ("Ubuntu", None, "/usr/bin/base64 -w 0 {source} > {target}"),
-    ],
-)
-def test_convert_to_b64_newer_macos(system, mac_ver, cmd_template, patch_file_ops):
-    with (
-        patch("platform.system", return_value=system),
-        patch("platform.mac_ver", return_value=[mac_ver]),
-        patch("subprocess.check_call") as subprocess_mock,
-    ):
-        with temp_file("system") as (source, content):
-            target = f"{source}.b64"
+def test_encode_file_to_b64_writes_to_target():
+    with temp_file(1000) as (source, content):
+        target = io.BytesIO()
 
-            convert_to_b64(source, target, overwrite=False)
+        written = encode_file_to_b64(source, target=target, chunk_size=9)
 
-            expected_cmd = cmd_template.format(source=source, target=target)
-            subprocess_mock.assert_called_with(expected_cmd, shell=True)
+        assert target.getvalue() == base64.b64encode(content)
+        assert written == len(target.getvalue())
 
 
 class CustomException(Exception):
@@ -1013,7 +989,7 @@ def test_html_to_text_with_lxml_exception():
             parser_mock = Mock()
             return parser_mock
 
-    with patch("connectors.utils.BeautifulSoup") as beautiful_soup_patch:
+    with patch("bs4.BeautifulSoup") as beautiful_soup_patch:
         beautiful_soup_patch.side_effect = _init_func
         html = "lala <br/>"
 